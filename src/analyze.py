@@ -8,6 +8,7 @@ import imp
 import re
 
 from lib.static import  StaticAnalysis
+from lib import results
 from lib.dynamic import DynamicAnalysis, DynamicOptions, SIMULATIONS
 
 SCRIPT_DIR = './post_analysis/'
@@ -93,6 +94,7 @@ class Package():
             self.logger.exception('Error in static analysis: %s' % e)
         finally:
             self.sa.dump()
+            results.update(self.logbase, 'static', self.sa.get_dict())
 
         self.logger.info('Starting dynamic analysis')
         self.da.analyse(self.sa)
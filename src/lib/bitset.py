@@ -0,0 +1,185 @@
+#!/usr/bin/python
+
+import binascii
+import gzip
+
+from collections import defaultdict
+
+# Method inventory of an APK with dense integer IDs, and coverage as bitsets
+# over these IDs.
+#
+# The methods are numbered in (package, class) order, such that every package
+# (including its sub packages) and every top-level class (including its inner
+# classes) is a contiguous range of IDs. A bitset is a Python long with bit <i>
+# set if method <i> was hit, so the coverage of any package, class or
+# component is the popcount of one precomputed range.
+
+# Kinds of components listed by static.StaticAnalysis
+COMPONENTS = ['activity', 'service', 'receiver', 'provider']
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+##
+# Split a class name into its package and its top-level class
+# 'com.foo.Main$1' -> ('com.foo', 'com.foo.Main')
+def split_class(class_name):
+    top_level = class_name.split('$')[0]
+    return top_level.rpartition('.')[0], top_level
+
+def get_sort_key(function):
+    package, top_level = split_class(function.target_object)
+    return (package.split('.') if package else []), function.target_object, function.get_signature_key()
+
+class MethodInventory:
+    def __init__(self, functions):
+        self.functions = sorted(functions, key = get_sort_key)
+        self.ids       = {}     # Signature (trace.Function.get_signature()) -> list of IDs. An APK can define a signature more than once.
+        self.classes   = {}     # Top-level class name -> (first ID, last ID + 1)
+        self.packages  = {}     # Package name -> (first ID, last ID + 1), including sub packages. '' is the whole APK.
+
+        ancestors = {}          # Package name -> list of the package and all of its parents
+
+        for i, function in enumerate(self.functions):
+            self.ids.setdefault(function.get_signature(), []).append(i)
+
+            package, top_level = split_class(function.target_object)
+            self._extend(self.classes, top_level, i)
+
+            if package not in ancestors:
+                parts = package.split('.') if package else []
+                ancestors[package] = [''] + [ '.'.join(parts[:depth]) for depth in xrange(1, len(parts) + 1) ]
+            for name in ancestors[package]:
+                self._extend(self.packages, name, i)
+
+    def _extend(self, ranges, name, i):
+        if name in ranges: ranges[name] = (ranges[name][0], i + 1)
+        else:              ranges[name] = (i, i + 1)
+
+    def __len__(self):
+        return len(self.functions)
+
+    ##
+    # Get the bitset of the functions that were hit (function.called > 0).
+    # @param    functions   trace.Function() objects, matched against the
+    #                       inventory by signature (setting the bits of all
+    #                       methods with that signature). Defaults to the
+    #                       inventory itself.
+    def get_bitset(self, functions = None):
+        if functions is None: functions = self.functions
+
+        # Set the bits in a bytearray and convert it once, instead of growing a
+        # long one bit at a time
+        buf = bytearray( (len(self.functions) + 7) / 8 )
+        for function in functions:
+            if not function.called: continue
+            for i in self.ids.get(function.get_signature(), []):
+                buf[i / 8] |= 1 << (i % 8)
+
+        if not buf: return 0L
+        buf.reverse()
+        return long(binascii.hexlify(buf), 16)
+
+    ##
+    # Number of bits set in <bits> in the ID range [start, end)
+    def count(self, bits, start, end):
+        return popcount( (bits >> start) & ((1L << (end - start)) - 1) )
+
+    ##
+    # Get the ID range of a component of <package_name>. Component names may be
+    # relative to the package ('.Main').
+    # @return   (first ID, last ID + 1), or None if the APK does not implement it
+    def get_component_range(self, component, package_name):
+        if component.startswith('.'): component = package_name + component
+        return self.classes.get(component)
+
+    ##
+    # Write a hierarchical coverage report: components, then every package with
+    # its sub packages and classes.
+    # @param    f               File to write to
+    # @param    bits            Bitset of the hit methods
+    # @param    components      Dictionary of component kind -> list of names
+    # @param    package_name    Package name of the APK
+    def report(self, f, bits, components = {}, package_name = ''):
+        def line(indent, name, start, end):
+            hits  = self.count(bits, start, end)
+            total = end - start
+            f.write('%s%-*s %7.2f%% (%8d of %8d)\n' % ('  ' * indent, 72 - 2 * indent, name, (100.0 / total) * hits, hits, total))
+
+        if not self.functions:
+            f.write('no methods\n')
+            return
+
+        line(0, '<all>', *self.packages[''])
+
+        f.write('components:\n')
+        for kind in COMPONENTS:
+            for component in sorted(components.get(kind, [])):
+                r = self.get_component_range(component, package_name)
+                if r: line(1, '%-8s %s' % (kind, component), *r)
+
+        f.write('packages:\n')
+        classes = defaultdict(list)
+        for top_level, r in sorted(self.classes.items(), key = lambda x: x[1]):
+            classes[split_class(top_level)[0]].append( (top_level, r) )
+
+        for package in sorted(self.packages, key = lambda x: x.split('.') if x else []):
+            depth = package.count('.') + 1 if package else 0
+            if package: line(depth, package, *self.packages[package])
+
+            # classes directly in this package
+            for top_level, r in classes[package]:
+                line(depth + 1, top_level.rpartition('.')[2], *r)
+
+##
+# Write bitsets to a gzipped text file, one per line:
+# <key 1>\t...\t<key n>\t<number of bits>\t<bits in hex>
+# @param    bitmaps     Dictionary of key tuple -> (number of bits, bitset)
+def write_bitmaps(filename, bitmaps):
+    f = gzip.open(filename, 'wb')
+    for key, (nbits, bits) in sorted(bitmaps.iteritems()):
+        f.write('%s\t%d\t%x\n' % ('\t'.join(key), nbits, bits))
+    f.close()
+
+##
+# Read a file written by write_bitmaps()
+# @return   Dictionary of key tuple -> (number of bits, bitset)
+def read_bitmaps(filename):
+    bitmaps = {}
+    f = gzip.open(filename, 'rb')
+    for line in f:
+        fields = line.rstrip('\n').split('\t')
+        bitmaps[ tuple(fields[:-2]) ] = ( int(fields[-2]), long(fields[-1], 16) )
+    f.close()
+    return bitmaps
+
+##
+# Write the methods of inventories to a gzipped text file, one per line in ID
+# order: <key 1>\t...\t<key n>\t<signature key>. Together with the bitmaps
+# (see write_bitmaps()) they name the methods that were hit.
+# @param    inventories     Dictionary of key tuple -> list of signature keys
+#                           (trace.Function.get_signature_key()) in ID order
+def write_inventories(filename, inventories):
+    f = gzip.open(filename, 'wb')
+    for key, signatures in sorted(inventories.iteritems()):
+        prefix = '\t'.join(key)
+        for signature in signatures:
+            f.write('%s\t%s\n' % (prefix, signature))
+    f.close()
+
+##
+# Read a file written by write_inventories()
+# @return   Dictionary of key tuple -> list of signature keys in ID order
+def read_inventories(filename):
+    inventories = defaultdict(list)
+    f = gzip.open(filename, 'rb')
+    for line in f:
+        fields = line.rstrip('\n').split('\t')
+        inventories[ tuple(fields[:-1]) ].append(fields[-1])
+    f.close()
+    return dict(inventories)
+
+##
+# IDs of the bits set in <bits>
+def get_ids(bits):
+    return [ i for i, bit in enumerate(bin(bits)[:1:-1]) if bit == '1' ]
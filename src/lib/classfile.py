@@ -0,0 +1,260 @@
+#!/usr/bin/python
+
+import struct
+import zipfile
+import multiprocessing
+
+# Minimal parser for Java .class files: the class name, its access flags and
+# the names, descriptors, access flags and declared exceptions of its methods.
+# Everything else (fields, other attributes, code) is skipped.
+
+ACC_PUBLIC       = 0x0001
+ACC_PRIVATE      = 0x0002
+ACC_PROTECTED    = 0x0004
+ACC_STATIC       = 0x0008
+ACC_FINAL        = 0x0010
+ACC_SYNCHRONIZED = 0x0020
+ACC_NATIVE       = 0x0100
+ACC_INTERFACE    = 0x0200
+ACC_ABSTRACT     = 0x0400
+
+MAGIC = 0xCAFEBABE
+
+PRIMITIVES = {'B': 'byte',
+              'C': 'char',
+              'D': 'double',
+              'F': 'float',
+              'I': 'int',
+              'J': 'long',
+              'S': 'short',
+              'Z': 'boolean',
+              'V': 'void'}
+
+class Error(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+class ClassFormatError(Error):
+    pass
+
+class Method:
+    def __init__(self, access_flags, name, descriptor, exceptions = []):
+        self.access_flags = access_flags
+        self.name         = name
+        self.descriptor   = descriptor
+        self.exceptions   = exceptions  # Class names of the declared exceptions (throws)
+
+        self.parameters, self.return_type = parse_descriptor(descriptor)
+
+    # The method as printed by javap
+    def __str__(self):
+        modifiers = get_modifiers(self.access_flags, METHOD_MODIFIERS)
+        line = '%s%s %s(%s)' % (modifiers and modifiers + ' ', self.return_type, self.name, ', '.join(self.parameters))
+        if self.exceptions: line += '       throws ' + ', '.join(self.exceptions)
+        return line + ';'
+
+class ClassFile:
+    def __init__(self, data = None):
+        self.access_flags = 0
+        self.name         = None    # Class name ('java.lang.Object')
+        self.super_name   = None    # Name of the super class, None for java.lang.Object
+        self.interfaces   = []      # Names of the implemented interfaces
+        self.methods      = []      # Method() objects
+
+        if data is not None: self._parse(data)
+
+    def _parse(self, data):
+        try:
+            magic, = struct.unpack_from('>I', data, 0)
+            if magic != MAGIC: raise ClassFormatError('Bad magic: %x' % magic)
+
+            # constant pool. Only UTF8 and Class entries are kept.
+            count, = struct.unpack_from('>H', data, 8)
+            utf8    = {}
+            classes = {}
+            offset  = 10
+            i = 1
+            while i < count:
+                tag = ord(data[offset])
+                if tag == 1:                                    # Utf8
+                    length, = struct.unpack_from('>H', data, offset + 1)
+                    utf8[i] = data[offset + 3:offset + 3 + length]
+                    offset += 3 + length
+                elif tag == 7:                                  # Class
+                    classes[i], = struct.unpack_from('>H', data, offset + 1)
+                    offset += 3
+                elif tag in (8, 16, 19, 20):                    # String, MethodType, Module, Package
+                    offset += 3
+                elif tag == 15:                                 # MethodHandle
+                    offset += 4
+                elif tag in (3, 4, 9, 10, 11, 12, 17, 18):      # Integer, Float, refs, NameAndType, (Invoke)Dynamic
+                    offset += 5
+                elif tag in (5, 6):                             # Long, Double take two slots
+                    offset += 9
+                    i += 1
+                else:
+                    raise ClassFormatError('Unknown constant pool tag %d' % tag)
+                i += 1
+
+            def class_name(index):
+                if index == 0: return None
+                return utf8[classes[index]].replace('/', '.')
+
+            self.access_flags, this_class, super_class, n = struct.unpack_from('>HHHH', data, offset)
+            self.name       = class_name(this_class)
+            self.super_name = class_name(super_class)
+            offset += 8
+
+            self.interfaces = [ class_name(index) for index in struct.unpack_from('>%dH' % n, data, offset) ]
+            offset += 2 * n
+
+            # fields
+            offset = self._skip_members(data, offset)
+
+            # methods
+            n, = struct.unpack_from('>H', data, offset)
+            offset += 2
+            for i in xrange(n):
+                access_flags, name, descriptor, attributes = struct.unpack_from('>HHHH', data, offset)
+                offset += 8
+
+                exceptions = []
+                for j in xrange(attributes):
+                    attribute, length = struct.unpack_from('>HI', data, offset)
+                    if utf8.get(attribute) == 'Exceptions':
+                        count, = struct.unpack_from('>H', data, offset + 6)
+                        exceptions = [ class_name(index) for index in struct.unpack_from('>%dH' % count, data, offset + 8) ]
+                    offset += 6 + length
+
+                self.methods.append( Method(access_flags, utf8[name], utf8[descriptor], exceptions) )
+
+        except (struct.error, IndexError, KeyError) as exception:
+            raise ClassFormatError('Truncated or corrupt class file: %s' % exception)
+
+    # The class declaration as printed by javap
+    def get_declaration(self):
+        modifiers = get_modifiers(self.access_flags, CLASS_MODIFIERS)
+        if self.access_flags & ACC_INTERFACE:
+            modifiers = modifiers.replace('abstract', '').strip()
+            line = '%sinterface %s' % (modifiers and modifiers + ' ', self.name)
+            if self.interfaces: line += ' extends ' + ', '.join(self.interfaces)
+        else:
+            line = '%sclass %s' % (modifiers and modifiers + ' ', self.name)
+            if self.super_name: line += ' extends ' + self.super_name
+            if self.interfaces: line += ' implements ' + ', '.join(self.interfaces)
+        return line + '{'
+
+    ##
+    # The lines of the javap output of this class that contain 'abstract', the
+    # format of the API .abstracts files used by features.py
+    def get_abstracts(self):
+        lines = []
+
+        declaration = self.get_declaration()
+        if 'abstract' in declaration: lines.append(declaration)
+
+        for method in self.methods:
+            if method.access_flags & ACC_ABSTRACT and not method.access_flags & ACC_PRIVATE:
+                lines.append( str(method) )
+
+        return lines
+
+    def _skip_members(self, data, offset):
+        n, = struct.unpack_from('>H', data, offset)
+        offset += 2
+        for i in xrange(n):
+            attributes, = struct.unpack_from('>H', data, offset + 6)
+            offset = self._skip_attributes(data, offset + 8, attributes)
+        return offset
+
+    def _skip_attributes(self, data, offset, n):
+        for i in xrange(n):
+            length, = struct.unpack_from('>I', data, offset + 2)
+            offset += 6 + length
+        return offset
+
+# Modifiers in javap order
+CLASS_MODIFIERS  = [ (ACC_PUBLIC, 'public'), (ACC_PRIVATE, 'private'), (ACC_PROTECTED, 'protected'),
+                     (ACC_STATIC, 'static'), (ACC_FINAL, 'final'), (ACC_ABSTRACT, 'abstract') ]
+METHOD_MODIFIERS = [ (ACC_PUBLIC, 'public'), (ACC_PRIVATE, 'private'), (ACC_PROTECTED, 'protected'),
+                     (ACC_STATIC, 'static'), (ACC_FINAL, 'final'), (ACC_SYNCHRONIZED, 'synchronized'),
+                     (ACC_NATIVE, 'native'), (ACC_ABSTRACT, 'abstract') ]
+
+def get_modifiers(access_flags, modifiers):
+    return ' '.join([ name for flag, name in modifiers if access_flags & flag ])
+
+##
+# Convert a field descriptor to a Java type name
+# 'Ljava/lang/String;' -> 'java.lang.String', '[I' -> 'int[]'
+# @return   A tuple of the type name and the offset after the descriptor
+def parse_type(descriptor, offset = 0):
+    dimensions = 0
+    while descriptor[offset] == '[':
+        dimensions += 1
+        offset     += 1
+
+    if descriptor[offset] == 'L':
+        end  = descriptor.index(';', offset)
+        name = descriptor[offset + 1:end].replace('/', '.')
+        offset = end + 1
+    else:
+        name = PRIMITIVES[descriptor[offset]]
+        offset += 1
+
+    return name + '[]' * dimensions, offset
+
+##
+# Convert a method descriptor to Java type names
+# '(ILjava/lang/String;)V' -> (['int', 'java.lang.String'], 'void')
+def parse_descriptor(descriptor):
+    parameters = []
+    offset = 1
+    while descriptor[offset] != ')':
+        name, offset = parse_type(descriptor, offset)
+        parameters.append(name)
+    return_type, offset = parse_type(descriptor, offset + 1)
+    return parameters, return_type
+
+def _get_abstracts_worker(args):
+    jar, filenames = args
+
+    lines = []
+    jar_f = zipfile.ZipFile(jar)
+    for filename in filenames:
+        try:
+            lines += ClassFile( jar_f.read(filename) ).get_abstracts()
+        except ClassFormatError:
+            pass
+    jar_f.close()
+    return lines
+
+##
+# Get the abstract classes and methods of all classes in <jar>, in the format of
+# 'javap <class> | grep abstract'. The classes are split over <processes>
+# worker processes (default: one per CPU).
+# @return   A list of lines
+def get_abstracts(jar, processes = None):
+    jar_f = zipfile.ZipFile(jar)
+    filenames = sorted([ info.filename for info in jar_f.infolist() if info.filename.endswith('.class') ])
+    jar_f.close()
+
+    if processes is None: processes = multiprocessing.cpu_count()
+    if processes <= 1 or len(filenames) < 2 * processes:
+        return _get_abstracts_worker( (jar, filenames) )
+
+    size   = (len(filenames) + processes - 1) / processes
+    chunks = [ (jar, filenames[i:i + size]) for i in xrange(0, len(filenames), size) ]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_get_abstracts_worker, chunks)
+    finally:
+        pool.close()
+        pool.join()
+
+    lines = []
+    for result in results:
+        lines += result
+    return lines
@@ -1,6 +1,8 @@
 #!/usr/bin/python
 
+import ast
 import sqlite3
+from collections import defaultdict
 from features import Features
 
 class Error(Exception):
@@ -13,10 +15,144 @@ class Error(Exception):
 class DatabaseError(Error):
     pass
 
+# Feature columns of the Features table, in Features.get_fields() order
+FEATURE_FIELDS = [ field for field, value in Features().get_fields() if field not in ('bloom', 'bloom_array', 'package_name', 'average') ]
+
+# Insert statements per table, for the rows of get_rows()
+INSERTS = [ ('Package',  "INSERT OR REPLACE INTO Package(md5sum, apk, logbase) VALUES(?, ?, ?)"),
+            ('Static',   "INSERT OR REPLACE INTO Static VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"),
+            ('Dynamic',  "INSERT OR REPLACE INTO Dynamic VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"),
+            ('Features', "INSERT OR REPLACE INTO Features VALUES(?, ?" + ", ?" * len(FEATURE_FIELDS) + ")"),
+            ('Ingested', "INSERT OR REPLACE INTO Ingested VALUES(?, ?, ?)") ]
+
+# The manifest lists of the Static table are also stored one entry per row in
+# child tables, such that finding the apps with a given component, action or
+# category is an index lookup instead of an eval() of every Static row.
+# Component kinds of the Component table and the StaticAnalysis lists they are
+# read from
+COMPONENTS = [ ('activity', 'activities'),
+               ('service',  'services'),
+               ('receiver', 'receivers'),
+               ('provider', 'providers') ]
+
+# Insert statements per child table, for the row lists of get_rows(). The
+# child rows of an app are deleted before its rows are inserted again.
+CHILD_INSERTS = [ ('Component',      "INSERT OR IGNORE INTO Component VALUES(?, ?, ?)"),
+                  ('Action',         "INSERT OR IGNORE INTO Action VALUES(?, ?)"),
+                  ('ActivityAction', "INSERT OR IGNORE INTO ActivityAction VALUES(?, ?, ?)"),
+                  ('Category',       "INSERT OR IGNORE INTO Category VALUES(?, ?)") ]
+
+# Per-app method hits are stored against a dictionary of all methods seen in
+# the corpus (the Method table), see Database.insert_hits()
+HIT_INSERT = "INSERT OR REPLACE INTO MethodHit VALUES(?, ?, ?)"
+
+# Number of signatures per SELECT of the Method IDs, below the default limit of
+# 999 host parameters per statement
+METHOD_CHUNK = 500
+
+# Coverage of every app per view and keyword, and corpus summaries of it that
+# are kept up to date on every insert (see Database.insert_coverages()):
+# - CoverageSummary     Per view and keyword: the number of apps, the sums of
+#                       their coverage, hits and totals, and the number of apps
+#                       per flag
+# - ViewSummary         Per view: the number of apps with a coverage for any
+#                       keyword
+# - CoverageHistogram   Per view and keyword: the number of apps per coverage
+#                       value
+COVERAGE_INSERT = "INSERT OR REPLACE INTO Coverage VALUES(?, ?, ?, ?, ?, ?)"
+FLAGS           = ['ANR', 'died', 'exception', 'incomplete', 'vmcrash']
+
+# Version of the schema in PRAGMA user_version, see Database.migrate()
+SCHEMA_VERSION = 2
+
+##
+# Name of a coverage view of a dynamic_results.coverages key
+def get_view(mode):
+    if mode is True:  return 'naive'
+    if mode is False: return 'conservative'
+    return mode
+
+##
+# The child table rows of an app
+# @return   Dictionary of child table name -> list of row tuples
+def get_child_rows(md5sum, activities, services, receivers, providers, actions, activityactions, categories):
+    components = { 'activities': activities, 'services': services, 'receivers': receivers, 'providers': providers }
+
+    rows = {}
+    rows['Component']      = [ (md5sum, kind, name) for kind, field in COMPONENTS for name in components[field] ]
+    rows['Action']         = [ (md5sum, action) for action in actions ]
+    rows['ActivityAction'] = [ (md5sum, activity, action) for activity, values in activityactions.iteritems() for action in values ]
+    rows['Category']       = [ (md5sum, category) for category in categories ]
+    return rows
+
+##
+# The rows of a log directory for every table
+# @param    dynamic_results     A Result object of xx-database.py
+# @param    stamp               Optional state of the log directory files when
+#                               they were parsed (see Database.get_ingested())
+# @param    hits                Optional list of (signature key, is API method,
+#                               number of calls or None if unknown) tuples of
+#                               the methods executed by the app
+# @return   Dictionary of table name -> row tuple, and of child table name ->
+#           list of row tuples
+def get_rows(apk, logdir, static_analysis, dynamic_results, features, stamp = None, hits = None):
+    md5sum = static_analysis.md5sum
+
+    def coverage(naive, attr):
+        result = dynamic_results.coverages.get( ('complete', naive) )
+        if result is None: return None
+        return getattr(result, attr)
+
+    rows = {}
+    rows['Package']  = ( md5sum, apk, logdir )
+    rows['Static']   = (     md5sum,
+                             static_analysis.package_name,
+                             static_analysis.main_activity,
+                         str(static_analysis.activities),
+                         str(static_analysis.services),
+                         str(static_analysis.receivers),
+                         str(static_analysis.providers),
+                         str(static_analysis.actions),
+                         str(static_analysis.activityactions),
+                         str(static_analysis.categories)         )
+    rows['Dynamic']  = (     md5sum,
+                         int(dynamic_results.ANR),
+                         int(dynamic_results.died),
+                         int(dynamic_results.exception),
+                         int(dynamic_results.incomplete),
+                         int(dynamic_results.vmcrash),
+                             coverage(True,  'f_found'),
+                             coverage(False, 'f_found'),
+                             coverage(True,  'f_executed'),
+                             coverage(False, 'f_executed'),
+                             coverage(True,  'coverage'),
+                             coverage(False, 'coverage')             )
+
+    values = features.get_dict()
+    rows['Features'] = tuple( [ md5sum, apk ] + [ str(int(values[field])) for field in FEATURE_FIELDS ] )
+
+    if stamp is not None: rows['Ingested'] = ( logdir, md5sum, stamp )
+
+    rows.update( get_child_rows(md5sum, static_analysis.activities, static_analysis.services, static_analysis.receivers, static_analysis.providers,
+                                static_analysis.actions, static_analysis.activityactions, static_analysis.categories) )
+
+    rows['MethodHit'] = [ (md5sum, signature, api, calls) for signature, api, calls in hits or [] ]
+    rows['Coverage']  = [ (md5sum, get_view(mode), keyword, result.coverage, result.f_executed, result.f_found)
+                          for (keyword, mode), result in sorted(dynamic_results.coverages.iteritems()) ]
+    return rows
+
+##
+# Drop the rows of get_rows() of all but the last log directory of every apk
+# @return   List of rows, in order of the last log directory of each apk
+def get_unique_rows(rows):
+    last = dict( (row['Static'][0], i) for i, row in enumerate(rows) )
+    return [ row for i, row in enumerate(rows) if last[ row['Static'][0] ] == i ]
+
 class Database():
 
     def __init__(self, database):
         self.database = database
+        self.methods  = {}      # Signature -> (Method ID, api flag), of the methods looked up so far
 
         self.open(database)
         self.create_tables()
@@ -26,6 +162,11 @@ class Database():
         self.connection.text_factory = str
         self.cursor = self.connection.cursor()
 
+        # Readers do not block the writer (and the other way around), and a
+        # commit does not wait for the data to reach the disk.
+        self.cursor.execute("PRAGMA journal_mode = WAL")
+        self.cursor.execute("PRAGMA synchronous = NORMAL")
+
     def close(self):
         self.cursor.close()
         self.connection.close()
@@ -63,75 +204,363 @@ class Database():
                    + "  md5sum TEXT PRIMARY KEY,\n" \
                    + "  path   TEXT"
 
-        for field in Features().get_fields():
-            if ( field[0] == 'bloom' or field[0] == 'bloom_array' or field[0] == 'package_name' or field[0] == 'average'): continue
-#           if (                                                     field[0] == 'package_name'                         ): continue
-            q_features = q_features + ",\n  " + field[0] + " INTEGER"
-#           q_features = q_features + ",\n  " + field[0] + " TEXT"
+        for field in FEATURE_FIELDS:
+            q_features = q_features + ",\n  " + field + " INTEGER"
 
         q_features = q_features + ")"
-        
+
+        # Log directories stored by the bulk ingest of xx-database.py, with
+        # the state of their files at that time
+        q_ingested = "CREATE TABLE IF NOT EXISTS Ingested(\n" \
+                   + "  logbase      TEXT PRIMARY KEY,\n" \
+                   + "  md5sum       TEXT,\n" \
+                   + "  stamp        TEXT)"
+
         self.cursor.execute(q_package)
         self.cursor.execute(q_static)
         self.cursor.execute(q_dynamic)
         self.cursor.execute(q_features)
-        self.connection.commit()
+        self.cursor.execute(q_ingested)
 
-    def insert(self, apk, logdir, static_analysis, dynamic_results, features):
-        q_package = "INSERT OR REPLACE INTO Package(md5sum, apk, logbase) VALUES('" + static_analysis.md5sum + "', \
-                                                                                 '" + apk + "', \
-                                                                                 '" + logdir + "')"
-
-        q_static = "INSERT OR REPLACE INTO Static VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
-        a_static = (     static_analysis.md5sum,
-                         static_analysis.package_name,
-                         static_analysis.main_activity,
-                     str(static_analysis.activities),
-                     str(static_analysis.services),
-                     str(static_analysis.receivers),
-                     str(static_analysis.providers),
-                     str(static_analysis.actions),
-                     str(static_analysis.activityactions),
-                     str(static_analysis.categories)         )
-
-        q_dynamic = "INSERT OR REPLACE INTO Dynamic VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
-        a_dynamic = (     static_analysis.md5sum,
-                      int(dynamic_results.ANR),
-                      int(dynamic_results.died),
-                      int(dynamic_results.exception),
-                      int(dynamic_results.incomplete),
-                      int(dynamic_results.vmcrash),
-                          dynamic_results.coverages[('complete',True) ].f_found,
-#                         dynamic_results.coverages[('complete',False)].f_found,
-                          dynamic_results.coverages[('complete',True) ].f_executed,
-#                         dynamic_results.coverages[('complete',False)].f_executed,
-                          dynamic_results.coverages[('complete',True) ].coverage,
-#                         dynamic_results.coverages[('complete',False)].coverage      )
-    
-        q_features = "INSERT OR REPLACE INTO Features VALUES(?, ?"
-        l_features = [  static_analysis.md5sum,
-                        apk                     ]
-
-        for field, value in features.get_values():
-            if ( field == 'bloom' or field == 'bloom_array' or field == 'package_name' or field == 'average'): continue
-#           if (                                               field == 'package_name'                      ): continue
-            q_features = q_features + ", ?"
-            l_features.append(str(int(value)))
-#           l_features.append(str(    value ))
-    
-        q_features = q_features + ")"
-        a_features = tuple(l_features)
-      
-        self.execute(q_package)
-        self.execute(q_static,  a_static )
-        self.execute(q_dynamic, a_dynamic)
-        self.execute(q_features,a_features)
+        # Child tables of Static. The primary keys serve the lookups by
+        # md5sum, the other indexes the lookups by name.
+        q_component      = "CREATE TABLE IF NOT EXISTS Component(\n" \
+                         + "  md5sum       TEXT,\n" \
+                         + "  kind         TEXT,\n" \
+                         + "  name         TEXT,\n" \
+                         + "  PRIMARY KEY (md5sum, kind, name))"
+        q_action         = "CREATE TABLE IF NOT EXISTS Action(\n" \
+                         + "  md5sum       TEXT,\n" \
+                         + "  action       TEXT,\n" \
+                         + "  PRIMARY KEY (md5sum, action))"
+        q_activityaction = "CREATE TABLE IF NOT EXISTS ActivityAction(\n" \
+                         + "  md5sum       TEXT,\n" \
+                         + "  activity     TEXT,\n" \
+                         + "  action       TEXT,\n" \
+                         + "  PRIMARY KEY (md5sum, activity, action))"
+        q_category       = "CREATE TABLE IF NOT EXISTS Category(\n" \
+                         + "  md5sum       TEXT,\n" \
+                         + "  category     TEXT,\n" \
+                         + "  PRIMARY KEY (md5sum, category))"
+
+        self.cursor.execute(q_component)
+        self.cursor.execute(q_action)
+        self.cursor.execute(q_activityaction)
+        self.cursor.execute(q_category)
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS Component_name       ON Component(name, kind)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS Action_action        ON Action(action)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS ActivityAction_action ON ActivityAction(action)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS Category_category    ON Category(category)")
+
+        # Methods executed by the apps: a dictionary of every method seen in
+        # the corpus, and the methods per app with their number of calls (NULL
+        # if only the coverage results are known). The primary key serves
+        # the lookups by app, the index the lookups by method.
+        q_method         = "CREATE TABLE IF NOT EXISTS Method(\n" \
+                         + "  id           INTEGER PRIMARY KEY,\n" \
+                         + "  signature    TEXT UNIQUE,\n" \
+                         + "  api          INTEGER)"
+        q_methodhit      = "CREATE TABLE IF NOT EXISTS MethodHit(\n" \
+                         + "  md5sum       TEXT,\n" \
+                         + "  method       INTEGER REFERENCES Method(id),\n" \
+                         + "  calls        INTEGER,\n" \
+                         + "  PRIMARY KEY (md5sum, method))"
+
+        self.cursor.execute(q_method)
+        self.cursor.execute(q_methodhit)
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS MethodHit_method      ON MethodHit(method, md5sum, calls)")
+
+        q_coverage       = "CREATE TABLE IF NOT EXISTS Coverage(\n" \
+                         + "  md5sum       TEXT,\n" \
+                         + "  view         TEXT,\n" \
+                         + "  keyword      TEXT,\n" \
+                         + "  coverage     REAL,\n" \
+                         + "  hits         INTEGER,\n" \
+                         + "  total        INTEGER,\n" \
+                         + "  PRIMARY KEY (md5sum, view, keyword))"
+        q_summary        = "CREATE TABLE IF NOT EXISTS CoverageSummary(\n" \
+                         + "  view         TEXT,\n" \
+                         + "  keyword      TEXT,\n" \
+                         + "  apps         INTEGER DEFAULT 0,\n" \
+                         + "  coverage     REAL    DEFAULT 0,\n" \
+                         + "  hits         INTEGER DEFAULT 0,\n" \
+                         + "  total        INTEGER DEFAULT 0" \
+                         + "".join([ ",\n  %-12s INTEGER DEFAULT 0" % flag for flag in FLAGS ]) + ",\n" \
+                         + "  PRIMARY KEY (view, keyword))"
+        q_viewsummary    = "CREATE TABLE IF NOT EXISTS ViewSummary(\n" \
+                         + "  view         TEXT PRIMARY KEY,\n" \
+                         + "  apps         INTEGER DEFAULT 0)"
+        q_histogram      = "CREATE TABLE IF NOT EXISTS CoverageHistogram(\n" \
+                         + "  view         TEXT,\n" \
+                         + "  keyword      TEXT,\n" \
+                         + "  coverage     REAL,\n" \
+                         + "  apps         INTEGER DEFAULT 0,\n" \
+                         + "  PRIMARY KEY (view, keyword, coverage))"
+
+        self.cursor.execute(q_coverage)
+        self.cursor.execute(q_summary)
+        self.cursor.execute(q_viewsummary)
+        self.cursor.execute(q_histogram)
         self.connection.commit()
 
+        self.migrate()
+
+    ##
+    # Bring a database written by an older version up to SCHEMA_VERSION:
+    # - 1   Fill the child tables of Static from its list columns
+    # - 2   Fill Coverage from the complete coverage of Dynamic, and build the
+    #       summaries. The other keywords are only stored on the next ingest:
+    #       all log directories are marked as not ingested.
+    def migrate(self):
+        self.execute("PRAGMA user_version")
+        version = self.cursor.fetchone()[0]
+        if version >= SCHEMA_VERSION: return
+
+        try:
+            if version < 1:
+                # The list columns hold str() of the lists (and of the
+                # activityactions dictionary)
+                def parse(value, default):
+                    if not value: return default
+                    return ast.literal_eval(value)
+
+                # Read with a cursor of its own, in batches, while the child
+                # rows are inserted
+                static = self.connection.cursor()
+                static.execute("SELECT md5sum, activities, services, receivers, providers, actions, activityactions, categories FROM Static")
+                while True:
+                    batch = static.fetchmany(1000)
+                    if not batch: break
+
+                    rows = []
+                    for md5sum, activities, services, receivers, providers, actions, activityactions, categories in batch:
+                        rows.append( get_child_rows(md5sum, parse(activities, []), parse(services, []), parse(receivers, []), parse(providers, []),
+                                                            parse(actions, []), parse(activityactions, {}), parse(categories, [])) )
+                    self.insert_children([ row[0] for row in batch ], rows)
+                static.close()
+
+            if version < 2:
+                for view, suffix in [ ('naive', '_naive'), ('conservative', '') ]:
+                    self.execute("INSERT OR REPLACE INTO Coverage SELECT md5sum, '%s', 'complete', cc%s, f_hit%s, f_found%s FROM Dynamic WHERE cc%s IS NOT NULL" % ((view, ) + (suffix, ) * 4))
+                self.execute("DELETE FROM Ingested")
+                self.rebuild_summaries()
+
+            self.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+            self.connection.commit()
+        except DatabaseError:
+            self.connection.rollback()
+            raise
+
+    def insert(self, apk, logdir, static_analysis, dynamic_results, features, hits = None):
+        self.insert_many([ get_rows(apk, logdir, static_analysis, dynamic_results, features, hits = hits) ])
+
+    ##
+    # Store the rows of many log directories (see get_rows()) in a single
+    # transaction, with one executemany() per table. Of several log directories
+    # of the same apk (an apk that was analyzed again), the last one is stored,
+    # the others are only recorded as ingested.
+    # @param    ingested    Additional Ingested rows, of log directories whose
+    #                       rows were dropped by the caller
+    def insert_many(self, rows, ingested = []):
+        ingested = list(ingested) + [ row['Ingested'] for row in rows if 'Ingested' in row ]
+        rows     = get_unique_rows(rows)
+        try:
+            self.insert_coverages([ row['Static'][0] for row in rows ], rows)
+            for table, query in INSERTS:
+                if table == 'Ingested': self.executemany(query, ingested)
+                else:                   self.executemany(query, [ row[table] for row in rows if table in row ])
+            self.insert_children([ row['Static'][0] for row in rows ], rows)
+            self.insert_hits([ row['Static'][0] for row in rows ], rows)
+            self.connection.commit()
+        except (DatabaseError, sqlite3.Error) as e:
+            self.connection.rollback()
+            self.methods = {}
+            if isinstance(e, DatabaseError): raise
+            raise DatabaseError("Could not store %d log directories. %s" % (len(rows), e))
+
+    # Replace the child table rows of the apps <md5sums> by those of <rows>,
+    # without committing
+    def insert_children(self, md5sums, rows):
+        for table, query in CHILD_INSERTS:
+            self.executemany("DELETE FROM " + table + " WHERE md5sum = ?", [ (md5sum, ) for md5sum in md5sums ])
+            self.executemany(query, [ child for row in rows for child in row.get(table, []) ])
+
+    ##
+    # Replace the coverage rows of the apps <md5sums> by those of <rows>, and
+    # update the summaries by the difference, without committing. Must be
+    # called before the Dynamic rows of the apps are replaced, as the flags of
+    # the stored rows are read from there.
+    def insert_coverages(self, md5sums, rows):
+        summaries  = defaultdict(lambda: [0] * (4 + len(FLAGS)))   # (view, keyword) -> apps, coverage, hits, total, flags
+        views      = defaultdict(int)                               # view -> apps
+        histograms = defaultdict(int)                               # (view, keyword, coverage) -> apps
+
+        def add(coverages, flags, sign):
+            for view, keyword, coverage, hits, total in coverages:
+                summary = summaries[ (view, keyword) ]
+                for i, value in enumerate([1, coverage, hits, total] + flags):
+                    summary[i] += sign * value
+                histograms[ (view, keyword, coverage) ] += sign
+            for view in set( view for view, keyword, coverage, hits, total in coverages ):
+                views[view] += sign
+
+        for md5sum in set(md5sums):
+            self.execute("SELECT view, keyword, Coverage.coverage, hits, total, " + ", ".join([ "IFNULL(Dynamic.%s, 0)" % flag for flag in FLAGS ]) +
+                         " FROM Coverage LEFT JOIN Dynamic ON Dynamic.md5sum = Coverage.md5sum WHERE Coverage.md5sum = ?", (md5sum, ))
+            stored = self.cursor.fetchall()
+            if stored: add([ row[:5] for row in stored ], list(stored[0][5:]), -1)
+
+        for row in rows:
+            if 'Dynamic' in row: add([ coverage[1:] for coverage in row.get('Coverage', []) ], list(row['Dynamic'][1:1 + len(FLAGS)]), 1)
+
+        self.executemany("DELETE FROM Coverage WHERE md5sum = ?", [ (md5sum, ) for md5sum in md5sums ])
+        self.executemany(COVERAGE_INSERT, [ coverage for row in rows for coverage in row.get('Coverage', []) ])
+
+        self.executemany("INSERT OR IGNORE INTO CoverageSummary(view, keyword) VALUES(?, ?)", summaries.keys())
+        self.executemany("UPDATE CoverageSummary SET apps = apps + ?, coverage = coverage + ?, hits = hits + ?, total = total + ?" +
+                         "".join([ ", %s = %s + ?" % (flag, flag) for flag in FLAGS ]) + " WHERE view = ? AND keyword = ?",
+                         [ tuple(summary) + key for key, summary in summaries.iteritems() ])
+        self.executemany("INSERT OR IGNORE INTO ViewSummary(view) VALUES(?)", [ (view, ) for view in views ])
+        self.executemany("UPDATE ViewSummary SET apps = apps + ? WHERE view = ?", [ (apps, view) for view, apps in views.iteritems() ])
+        self.executemany("INSERT OR IGNORE INTO CoverageHistogram(view, keyword, coverage) VALUES(?, ?, ?)", histograms.keys())
+        self.executemany("UPDATE CoverageHistogram SET apps = apps + ? WHERE view = ? AND keyword = ? AND coverage = ?",
+                         [ (apps, ) + key for key, apps in histograms.iteritems() if apps ])
+
+        self.execute("DELETE FROM CoverageSummary WHERE apps <= 0")
+        self.execute("DELETE FROM ViewSummary WHERE apps <= 0")
+        self.execute("DELETE FROM CoverageHistogram WHERE apps <= 0")
+
+    ##
+    # Build the summaries of insert_coverages() again from the Coverage and
+    # Dynamic tables, without committing
+    def rebuild_summaries(self):
+        self.execute("DELETE FROM CoverageSummary")
+        self.execute("DELETE FROM ViewSummary")
+        self.execute("DELETE FROM CoverageHistogram")
+        self.execute("INSERT INTO CoverageSummary SELECT view, keyword, COUNT(*), TOTAL(Coverage.coverage), IFNULL(SUM(hits), 0), IFNULL(SUM(total), 0), " +
+                     ", ".join([ "IFNULL(SUM(Dynamic.%s), 0)" % flag for flag in FLAGS ]) +
+                     " FROM Coverage LEFT JOIN Dynamic ON Dynamic.md5sum = Coverage.md5sum GROUP BY view, keyword")
+        self.execute("INSERT INTO ViewSummary SELECT view, COUNT(DISTINCT md5sum) FROM Coverage GROUP BY view")
+        self.execute("INSERT INTO CoverageHistogram SELECT view, keyword, coverage, COUNT(*) FROM Coverage GROUP BY view, keyword, coverage")
+
+    ##
+    # @return   Dictionary of keyword -> dictionary of the columns of
+    #           CoverageSummary (apps, coverage, hits, total and the flags) for
+    #           a coverage view
+    def get_coverage_summary(self, view):
+        columns = ['keyword', 'apps', 'coverage', 'hits', 'total'] + FLAGS
+        self.execute("SELECT " + ", ".join(columns) + " FROM CoverageSummary WHERE view = ?", (view, ))
+        return dict( (row[0], dict(zip(columns[1:], row[1:]))) for row in self.cursor.fetchall() )
+
+    ##
+    # @return   Number of apps with a coverage for any keyword of a view
+    def get_view_apps(self, view):
+        self.execute("SELECT apps FROM ViewSummary WHERE view = ?", (view, ))
+        row = self.cursor.fetchone()
+        if row: return row[0]
+        return 0
+
+    ##
+    # @return   Sorted list of (coverage, number of apps) tuples of a view and
+    #           keyword
+    def get_coverage_histogram(self, view, keyword):
+        self.execute("SELECT coverage, apps FROM CoverageHistogram WHERE view = ? AND keyword = ? ORDER BY coverage", (view, keyword))
+        return self.cursor.fetchall()
+
+    # Replace the method hits of the apps <md5sums> by those of <rows>, without
+    # committing
+    def insert_hits(self, md5sums, rows):
+        hits = [ hit for row in rows for hit in row.get('MethodHit', []) ]
+        ids  = self.get_method_ids( [ (signature, api) for md5sum, signature, api, calls in hits ] )
+
+        self.executemany("DELETE FROM MethodHit WHERE md5sum = ?", [ (md5sum, ) for md5sum in md5sums ])
+        self.executemany(HIT_INSERT, [ (md5sum, ids[signature], calls) for md5sum, signature, api, calls in hits ])
+
+    ##
+    # Get the IDs of methods, adding the methods that are not in the Method
+    # table yet and correcting the api flag of the ones that are. IDs are
+    # cached, as they never change.
+    # @param    methods     List of (signature key, is API method) tuples
+    # @return   Dictionary of signature key -> ID
+    def get_method_ids(self, methods):
+        new = {}
+        for signature, api in methods:
+            cached = self.methods.get(signature)
+            if cached is None or cached[1] != int(api): new[signature] = int(api)
+
+        if new:
+            self.executemany("INSERT OR IGNORE INTO Method(signature, api) VALUES(?, ?)", new.items())
+            self.executemany("UPDATE Method SET api = ? WHERE signature = ? AND api IS NOT ?", [ (api, signature, api) for signature, api in new.iteritems() ])
+
+            signatures = new.keys()
+            for i in xrange(0, len(signatures), METHOD_CHUNK):
+                chunk = signatures[i:i + METHOD_CHUNK]
+                self.execute("SELECT signature, id FROM Method WHERE signature IN (" + ", ".join(["?"] * len(chunk)) + ")", chunk)
+                for signature, method in self.cursor.fetchall():
+                    self.methods[signature] = (method, new[signature])
+
+        return dict( (signature, self.methods[signature][0]) for signature, api in methods )
+
+    ##
+    # Get the apps that executed a method
+    # @param    signature   Signature key (trace.Function.get_signature_key())
+    # @return   Sorted list of (md5sum, number of calls) tuples. The number of
+    #           calls is None if only the coverage results of an app are known.
+    def get_method_apps(self, signature):
+        self.execute("SELECT md5sum, calls FROM MethodHit WHERE method = (SELECT id FROM Method WHERE signature = ?)", (signature, ))
+        return sorted(self.cursor.fetchall())
+
+    ##
+    # Get the methods executed by an app
+    # @return   Sorted list of (signature key, is API method, number of calls)
+    #           tuples
+    def get_app_methods(self, md5sum):
+        self.execute("SELECT signature, api, calls FROM MethodHit JOIN Method ON Method.id = MethodHit.method WHERE md5sum = ?", (md5sum, ))
+        return sorted( (signature, bool(api), calls) for signature, api, calls in self.cursor.fetchall() )
+
+    ##
+    # Get the methods that were executed by the most apps
+    # @param    api     If not None, only API methods (True) or only methods
+    #                   of the apps (False)
+    # @return   List of (signature key, number of apps, number of calls) tuples
+    def get_top_methods(self, limit = 10, api = None):
+        query = "SELECT signature, COUNT(*), SUM(calls) FROM MethodHit JOIN Method ON Method.id = MethodHit.method"
+        if api is not None: query += " WHERE api = %d" % int(api)
+        query += " GROUP BY method ORDER BY COUNT(*) DESC, SUM(calls) DESC LIMIT %d" % limit
+        self.execute(query)
+        return self.cursor.fetchall()
+
+    ##
+    # Find the apps that declare a manifest entry
+    # @param    field   'activities', 'services', 'receivers', 'providers',
+    #                   'actions', 'activityactions' (<name> is the action) or
+    #                   'categories'
+    # @return   Sorted list of md5sums
+    def find(self, field, name):
+        kinds = dict( (value, key) for key, value in COMPONENTS )
+        if   field in kinds:             self.execute("SELECT md5sum FROM Component WHERE name = ? AND kind = ?", (name, kinds[field]))
+        elif field == 'actions':         self.execute("SELECT md5sum FROM Action WHERE action = ?", (name, ))
+        elif field == 'activityactions': self.execute("SELECT DISTINCT md5sum FROM ActivityAction WHERE action = ?", (name, ))
+        elif field == 'categories':      self.execute("SELECT md5sum FROM Category WHERE category = ?", (name, ))
+        else: raise DatabaseError("Unknown manifest field: " + field)
+        return sorted( md5sum for md5sum, in self.cursor.fetchall() )
+
+    ##
+    # @return   Dictionary of logbase -> stamp of the ingested log directories
+    def get_ingested(self):
+        self.execute("SELECT logbase, stamp FROM Ingested")
+        return dict(self.cursor.fetchall())
+
     def execute(self, query, parameters = None):
         try:
             if parameters: self.cursor.execute(query, parameters)
             else:          self.cursor.execute(query)
-        except sqlite3.OperationalError as e:
+        except sqlite3.Error as e:
             raise DatabaseError("Could not execute query: " + query + " (" + str(parameters) + ") . " + str(e))
 
+    def executemany(self, query, parameters):
+        if not parameters: return
+        try:
+            self.cursor.executemany(query, parameters)
+        except sqlite3.Error as e:
+            raise DatabaseError("Could not execute query: " + query + " (" + str(len(parameters)) + " rows) . " + str(e))
@@ -0,0 +1,295 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import Queue
+import struct
+import signal
+import socket
+import cPickle
+import logging
+import argparse
+import threading
+
+import db
+
+# Single writer of a results database (see db.py).
+#
+# Analysis workers that finish at the same time all want the SQLite write lock
+# of the same database. Instead of opening the database themselves, they can
+# submit their rows (db.get_rows()) to a Writer process over a Unix socket,
+# <database>.sock by default. The writer is the only process that opens the
+# database: it stores everything that was submitted while it was committing
+# the previous batch in a single transaction, and only then acknowledges each
+# result to its worker. A busy writer therefore commits large batches, an idle
+# one commits every result right away.
+#
+# Start it with:
+#   python lib/dbwriter.py --database analysis.db
+# post_analysis/xx-database.py submits to it if its socket exists, and writes to
+# the database itself if the writer does not acknowledge its result.
+
+# Maximum number of results per transaction
+BATCH_SIZE = 1000
+
+# Seconds a worker waits for the acknowledgement of its result
+SUBMIT_TIMEOUT = 300
+
+# Connections that may wait to be accepted
+BACKLOG = 128
+
+##
+# Address of the writer of <database>
+def get_address(database):
+    return database + '.sock'
+
+# Messages are pickled objects, preceded by their length
+def _send(connection, obj):
+    data = cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+    connection.sendall(struct.pack('!I', len(data)) + data)
+
+def _recv_bytes(connection, n):
+    chunks = []
+    while n:
+        chunk = connection.recv(min(n, 1 << 20))
+        if not chunk: raise EOFError()
+        chunks.append(chunk)
+        n -= len(chunk)
+    return ''.join(chunks)
+
+def _recv(connection):
+    n, = struct.unpack('!I', _recv_bytes(connection, 4))
+    return cPickle.loads(_recv_bytes(connection, n))
+
+def connect(address):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(address)
+    except socket.error:
+        connection.close()
+        raise
+    return connection
+
+##
+# Submit the rows of a log directory to the writer at <address> and wait until
+# they are committed.
+# @param    rows    Result of db.get_rows()
+# @raise    socket.error if there is no writer at <address>, db.DatabaseError
+#           if the writer could not store the rows or did not acknowledge them
+#           in time
+def submit(address, rows, timeout = SUBMIT_TIMEOUT):
+    connection = connect(address)
+    try:
+        _send(connection, rows)
+        connection.settimeout(timeout)
+        status, msg = _recv(connection)
+    except socket.timeout:
+        raise db.DatabaseError("No acknowledgement from database writer %s within %ds" % (address, timeout))
+    except EOFError:
+        raise db.DatabaseError("Database writer %s closed the connection" % address)
+    finally:
+        connection.close()
+
+    if status != 'ok': raise db.DatabaseError(msg)
+
+class Writer:
+    def __init__(self, database, address = None, logger = None, batch_size = BATCH_SIZE):
+        self.database   = database
+        self.address    = address or get_address(database)
+        self.logger     = logger or logging.getLogger('dbwriter')
+        self.batch_size = batch_size
+
+        self.queue      = Queue.Queue()     # (connection, rows) tuples of the received results
+        self.running    = False
+        self.listening  = False             # Whether or not the socket at self.address is ours
+        self.lock       = threading.Lock()
+        self.receiving  = 0                 # Number of connections accepted but not queued or answered yet
+
+        self.committed  = 0                 # Number of results stored
+        self.failed     = 0                 # Number of results that could not be stored
+        self.batches    = 0                 # Number of transactions
+
+    ##
+    # Accept results until stop() is called. The database is opened in the
+    # calling thread, which does all the writing; every connection is read by
+    # a thread of its own. On stop(), new connections are refused, and every
+    # connection that was accepted before is still stored and acknowledged.
+    def serve(self):
+        database = db.Database(self.database)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.address)
+        self.listening = True
+        os.chmod(self.address, 0600)
+        listener.listen(BACKLOG)
+        listener.settimeout(1)
+
+        self.running = True
+        acceptor = threading.Thread(target = self._accept, args = (listener, ))
+        acceptor.daemon = True
+        acceptor.start()
+        self.logger.info("Database writer for %s listening on %s" % (self.database, self.address))
+
+        try:
+            while self.running or acceptor.is_alive() or self.receiving or not self.queue.empty():
+                try:
+                    batch = [ self.queue.get(timeout = 1) ]
+                except Queue.Empty:
+                    continue
+
+                # Everything that arrived during the previous commit goes into
+                # this one
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append( self.queue.get_nowait() )
+                    except Queue.Empty:
+                        break
+
+                self._commit(database, batch)
+        finally:
+            self._unlink()
+            listener.close()
+            database.close()
+            self.logger.info("%d results stored in %d transactions, %d failed" % (self.committed, self.batches, self.failed))
+
+    def stop(self, *args):
+        self.running = False
+
+    # Remove the socket, such that workers write to the database themselves
+    def _unlink(self):
+        if not self.listening: return
+        self.listening = False
+        if os.path.exists(self.address): os.remove(self.address)
+
+    def _accept(self, listener):
+        while self.running:
+            try:
+                connection, address = listener.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            self._start_receiver(connection)
+
+        # Refuse new connections, then take the ones that are already waiting.
+        # A worker that connects in between gets an error and writes to the
+        # database itself.
+        self._unlink()
+        listener.setblocking(0)
+        while True:
+            try:
+                connection, address = listener.accept()
+            except socket.error:
+                break
+            self._start_receiver(connection)
+        listener.close()
+
+    def _start_receiver(self, connection):
+        with self.lock:
+            self.receiving += 1
+        receiver = threading.Thread(target = self._receive, args = (connection, ))
+        receiver.daemon = True
+        receiver.start()
+
+    def _receive(self, connection):
+        try:
+            connection.settimeout(SUBMIT_TIMEOUT)
+            try:
+                rows = _recv(connection)
+            except Exception:
+                connection.close()
+                return
+
+            if isinstance(rows, dict) and 'Static' in rows: self.queue.put( (connection, rows) )
+            else:                                           self._ack(connection, 'error', 'Not a result of db.get_rows()')
+        finally:
+            with self.lock:
+                self.receiving -= 1
+
+    def _ack(self, connection, status, msg = None):
+        try:
+            _send(connection, (status, msg))
+        except Exception:
+            pass    # The worker is gone, its result is stored anyway
+        connection.close()
+
+    ##
+    # Store a batch in a single transaction. If that fails, the results are
+    # stored one by one, such that one bad result does not fail the others.
+    def _commit(self, database, batch):
+        t = time.time()
+        try:
+            database.insert_many([ rows for connection, rows in batch ])
+            errors = [ None ] * len(batch)
+        except Exception as e:
+            self._rollback(database)
+            self.logger.warning("Could not store a batch of %d results (%s)" % (len(batch), e))
+
+            if len(batch) == 1: errors = [ str(e) ]
+            else:               errors = [ self._insert(database, rows) for connection, rows in batch ]
+
+        for (connection, rows), error in zip(batch, errors):
+            if error is None:
+                self._ack(connection, 'ok')
+                self.committed += 1
+            else:
+                self._ack(connection, 'error', error)
+                self.failed += 1
+
+        self.batches += 1
+        self.logger.debug("%d results committed in %.3fs" % (len(batch), time.time() - t))
+
+    # Store a single result
+    # @return   None, or the error message if it could not be stored
+    def _insert(self, database, rows):
+        try:
+            database.insert_many([ rows ])
+        except Exception as e:
+            self._rollback(database)
+            return str(e)
+        return None
+
+    # insert_many() only rolls back on DatabaseErrors
+    def _rollback(self, database):
+        database.connection.rollback()
+        database.methods = {}
+
+def get_logger():
+    formatter = logging.Formatter('[%(asctime)s   %(name)s] %(message)s')
+
+    logger = logging.getLogger('dbwriter')
+    logger.setLevel(logging.DEBUG)
+
+    consoleLogger = logging.StreamHandler()
+    consoleLogger.setFormatter(formatter)
+    consoleLogger.setLevel(logging.INFO)
+    logger.addHandler(consoleLogger)
+
+    return logger
+
+def main():
+    parser = argparse.ArgumentParser(description='Single writer of a results database, for concurrent analysis workers')
+    parser.add_argument('--database', action = 'store', required = True,                  help = 'Database file')
+    parser.add_argument('--address',  action = 'store', required = False, default = None, help = 'Unix socket to listen on (default: <database>.sock)')
+
+    args    = parser.parse_args()
+    address = args.address or get_address(args.database)
+
+    # A socket that is left behind by a writer that was killed is removed, a
+    # socket of a running writer is not
+    if os.path.exists(address):
+        try:
+            connect(address).close()
+            print "A database writer is already listening on %s" % address
+            sys.exit()
+        except socket.error:
+            os.remove(address)
+
+    writer = Writer(args.database, address, get_logger())
+    signal.signal(signal.SIGTERM, writer.stop)
+    signal.signal(signal.SIGINT,  writer.stop)
+    writer.serve()
+
+if __name__ == '__main__':
+    main()
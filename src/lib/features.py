@@ -1,15 +1,18 @@
 #!/usr/bin/python
 
-import subprocess
 import operator
 import os
 import sys
+import glob
+import gzip
+import json
 import array
 import hashlib
 
 from collections import Counter
 
 import trace
+import classfile
 
 # Get the platform directories
 ROOTDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
@@ -23,6 +26,269 @@ DIR_API = os.path.join(DIR_AND, 'apis')
 
 API = os.path.join(DIR_API, 'android-10.jar') 
 
+# Header of the .abstracts caches: the md5sum of the jar they were generated
+# from. Caches without this header were generated by javap and are always used.
+ABSTRACTS_HEADER = '# md5sum '
+
+# Summary of the distinct calls of a log directory, written by 02-features.py
+# (see get_call_key()). The feature rules can be evaluated again against this
+# summary instead of the traces.
+SUMMARY_FILENAME = 'features-calls.json.gz'
+
+# The extra SDK jars next to the API jar
+def get_sdk_jars():
+    return sorted([ jar for jar in glob.glob(os.path.join(DIR_API, '*.jar')) if jar != API ])
+
+##
+# For a given API jar, get a list of abstract classes and methods (the lines of
+# its javap output that contain 'abstract'). The list is cached in
+# <api>.abstracts and generated again if the jar changed.
+def load_abstract(api):
+    cache  = api + '.abstracts'
+    md5sum = None
+    if os.path.exists(api):
+        f = open(api, 'rb')
+        md5sum = hashlib.md5(f.read()).hexdigest()
+        f.close()
+
+    if os.path.exists(cache):
+        f = open(cache, 'r')
+        abstracts = [ line.strip() for line in f ]
+        f.close()
+
+        if not abstracts or not abstracts[0].startswith(ABSTRACTS_HEADER): return abstracts
+        if md5sum is None or abstracts[0] == ABSTRACTS_HEADER + md5sum:    return abstracts[1:]
+
+    if md5sum is None: return []
+
+    abstracts = classfile.get_abstracts(api)
+    try:
+        f = open(cache, 'w')
+        print >>f, ABSTRACTS_HEADER + md5sum
+        for line in abstracts:
+            print >>f, line
+        f.close()
+    except IOError:
+        pass
+
+    return abstracts
+
+def load_abstracts(apis):
+    abstracts = []
+    for api in apis:
+        abstracts += load_abstract(api)
+    return abstracts
+
+# Index of the abstract methods of the API and SDK jars (see
+# get_abstracts_index())
+_abstracts_index = None
+
+##
+# The index_abstracts() of the API and SDK jars. It is built once per process,
+# for callers that evaluate the features of many log directories.
+def get_abstracts_index():
+    global _abstracts_index
+    if _abstracts_index is None: _abstracts_index = index_abstracts( load_abstracts([API] + get_sdk_jars()) )
+    return _abstracts_index
+
+##
+# Normalized signature of an abstract method: '<modifiers> abstract
+# <return type> <name>(<parameter types>)'
+def get_abstract_signature(modifiers, return_type, name, parameters):
+    return ' '.join(modifiers + ['abstract', '%s %s(%s)' % (return_type, name, ', '.join(parameters))])
+
+##
+# Set of the normalized signatures of the abstract methods in a list of
+# .abstracts lines. A signature is in the set if it is a substring of one of
+# the lines, the test _get_target_functions used to do with a scan over all
+# lines: every line is added with each tail of its modifiers, and without its
+# throws clause.
+def index_abstracts(abstracts):
+    index = set()
+    for line in abstracts:
+        modifiers, sep, rest = line.partition('abstract ')
+        if not sep or rest.startswith('class ') or '(' not in rest: continue
+
+        words     = modifiers.split()
+        signature = rest.split(')')[0] + ')'
+        for i in xrange(len(words) + 1):
+            index.add( ' '.join(words[i:] + ['abstract', signature]) )
+    return index
+
+# Predicates for rules that look at more than the called class and method
+def _reads_android_id(function, api_classes):
+    return ('java.lang.String', 'android_id') in function.parameters
+
+def _loads_app_class(function, api_classes):
+    return bool(function.parameters) and function.parameters[0][1] not in api_classes
+
+def _is_app_native(function, api_classes):
+    return 'native' in function.modifiers and not function.is_api
+
+# Feature rules, applied to every traced call (including the targets of
+# reflected calls). A rule enables <feature> for calls that match:
+# - <class>         The exact class name. A trailing '*' matches every class
+#                   name starting with the rest. None matches every class.
+# - <method>        The exact method name. None matches every method. '<init>'
+#                   matches constructor calls (only with an exact class name).
+# - <predicate>     Optional function(function, api_classes) that must return
+#                   True as well.
+# - <values>        Types of the parameters whose values <predicate> reads.
+#                   Only these values are kept in call summaries (see
+#                   get_call_key()), so a predicate must list every type it
+#                   looks at.
+# Rules are compiled into a RuleTable, so the cost per call does not depend on
+# the number of rules.
+#
+#    feature                    class                                   method                      predicate                   values
+RULES = [
+    # ANDROID CLASSES FIRST
+    ('telephony_imei',          'android.telephony.TelephonyManager',   'getDeviceId',              None,                       None),
+    ('telephony_imsi',          'android.telephony.TelephonyManager',   'getSubscriberId',          None,                       None),
+    ('telephony_msisdn',        'android.telephony.TelephonyManager',   'getLine1Number',           None,                       None),
+    ('telephony_net_iso',       'android.telephony.TelephonyManager',   'getNetworkCountryIso',     None,                       None),
+    ('telephony_net_op',        'android.telephony.TelephonyManager',   'getNetworkOperator',       None,                       None),
+    ('telephony_net_op_name',   'android.telephony.TelephonyManager',   'getNetworkOperatorName',   None,                       None),
+    ('telephony_net_type',      'android.telephony.TelephonyManager',   'getNetworkType',           None,                       None),
+    ('telephony_sim_serial',    'android.telephony.TelephonyManager',   'getSimSerialNumber',       None,                       None),
+    ('telephony_sim_operator',  'android.telephony.TelephonyManager',   'getSimOperator',           None,                       None),
+    ('telephony_get_call_state','android.telephony.TelephonyManager',   'getCallState',             None,                       None),
+
+    ('telephony_sms',           'android.telephony.SmsManager',         'sendTextMessage',          None,                       None),
+    ('telephony_sms',           'android.telephony.gsm.SmsManager',     'sendTextMessage',          None,                       None),
+    ('telephony_sms',           'android.telephony.SmsMessage*',        None,                       None,                       None),
+
+    ('net_connect_manager',     'android.net.ConnectivityManager',      None,                       None,                       None),
+    ('net_info',                'android.net.NetworkInfo',              None,                       None,                       None),
+    ('location',                'android.location.LocationManager',     None,                       None,                       None),
+    ('misc_alarm',              'android.app.AlarmManager',             None,                       None,                       None),
+
+    ('content_intent',          'android.content.Intent',               'setAction',                None,                       None),
+    ('content_query',           'android.content.ContentResolver',      'query',                    None,                       None),
+    ('content_signature',       'android.content.pm.Signature',         None,                       None,                       None),
+    # These functions are implemented by android.content.Context, but they are inherited by other classes as well, which is why we make it a bit more generic here.
+    ('content_get_service',     None,                                   'getSystemService',         None,                       None),
+    ('content_get_pmanager',    None,                                   'getPackageManager',        None,                       None),
+    ('content_get_prefs',       None,                                   'getSharedPreferences',     None,                       None),
+    ('content_start_service',   None,                                   'startService',             None,                       None),
+    ('io_fopen',                None,                                   'openFileInput',            None,                       None),
+    ('io_fopen',                None,                                   'openFileOutput',           None,                       None),
+    ('io_delete',               None,                                   'deleteFile',               None,                       None),
+
+    ('settings_android_id',     'android.provider.Settings$Secure',     'getString',                _reads_android_id,          ('java.lang.String',)),
+
+    ('io_database',             'android.database*',                    None,                       None,                       None),
+
+    ('misc_handler',            'android.os.Handler',                   'sendMessageAtTime',        None,                       None),
+    ('misc_handler',            'android.os.Handler',                   'sendMessageDelayed',       None,                       None),
+    ('misc_handler',            'android.os.Handler',                   'sendEmptyMessageAtTime',   None,                       None),
+    ('misc_handler',            'android.os.Handler',                   'sendEmptyMessageDelayed',  None,                       None),
+    ('misc_handler',            'android.os.Handler',                   'postAtTime',               None,                       None),
+    ('misc_handler',            'android.os.Handler',                   'postDelayed',              None,                       None),
+
+    # THEN JAVA
+    ('misc_digest',             'java.security.MessageDigest',          'digest',                   None,                       None),
+    ('misc_schedule',           'java.util.Timer',                      None,                       None,                       None),
+    ('misc_sleep',              'java.lang.Thread',                     'sleep',                    None,                       None),
+    ('misc_locale',             'java.util.Locale',                     None,                       None,                       None),
+    ('io_fexists',              'java.io.File',                         'exists',                   None,                       None),
+    ('io_exec',                 'java.lang.Runtime',                    'exec',                     None,                       None),
+    ('misc_classloader',        'java.lang.ClassLoader',                'loadClass',                _loads_app_class,           ('java.lang.String',)),
+    ('misc_classloader',        'java.lang.System',                     'loadLibrary',              None,                       None),
+    ('network_http',            'java.net.HttpURLConnection',           'connect',                  None,                       None),
+    ('network_http',            'org.apache.http*',                     None,                       None,                       None),
+    ('network',                 'java.net*',                            None,                       None,                       None),
+    ('misc_crypto',             'javax.crypto*',                        None,                       None,                       None),
+    ('misc_reflection',         'java.lang.reflect*',                   None,                       None,                       None),
+    ('io_file',                 'java.io.File*',                        None,                       None,                       None),
+    ('misc_zip',                'java.util.zip*',                       None,                       None,                       None),
+
+    ('misc_native',             None,                                   None,                       _is_app_native,             None),
+
+    # CONSTRUCTORS
+    ('io_fopen',                'java.io.File',                         '<init>',                   None,                       None),
+]
+
+##
+# RULES compiled into hash maps and a prefix trie. The rules that apply to a
+# (class, method) pair are looked up once and cached, so classifying a call is
+# a single dictionary lookup for calls seen before.
+class RuleTable:
+    def __init__(self, rules = RULES):
+        self.exact    = {}      # (class, method) -> rules
+        self.classes  = {}      # class -> rules
+        self.methods  = {}      # method -> rules
+        self.prefixes = {}      # Character trie of class prefixes. A node's None key holds its rules.
+        self.always   = []      # Rules for every call
+        self.news     = {}      # class -> rules for constructor calls
+        self.cache    = {}      # (class, method) -> all rules that apply
+        self.reads    = {}      # predicate -> parameter types whose values it reads
+        self.values   = {}      # (class, method, constructor) -> parameter types whose values the rules read
+
+        for feature, class_name, method, predicate, values in rules:
+            rule = (feature, predicate)
+            if predicate and values: self.reads.setdefault(predicate, set()).update(values)
+
+            if class_name and class_name.endswith('*'):
+                node = self.prefixes
+                for c in class_name[:-1]:
+                    node = node.setdefault(c, {})
+                if method: node.setdefault(None, []).append( (method, rule) )
+                else:      node.setdefault(None, []).append( (None,   rule) )
+            elif method == '<init>':    self.news.setdefault(class_name, []).append(rule)
+            elif class_name and method: self.exact.setdefault( (class_name, method), [] ).append(rule)
+            elif class_name:            self.classes.setdefault(class_name, []).append(rule)
+            elif method:                self.methods.setdefault(method, []).append(rule)
+            else:                       self.always.append(rule)
+
+    ##
+    # Get the (feature, predicate) rules that apply to calls of <method> of
+    # <class_name>
+    def match(self, class_name, method):
+        key = (class_name, method)
+        rules = self.cache.get(key)
+        if rules is not None: return rules
+
+        rules = []
+        rules += self.exact.get(key, [])
+        rules += self.classes.get(class_name, [])
+        rules += self.methods.get(method, [])
+
+        node = self.prefixes
+        for c in class_name:
+            node = node.get(c)
+            if node is None: break
+            for prefix_method, rule in node.get(None, []):
+                if prefix_method is None or prefix_method == method: rules.append(rule)
+
+        rules += self.always
+
+        self.cache[key] = rules
+        return rules
+
+    ##
+    # Get the (feature, predicate) rules that apply to constructor calls of
+    # <class_name>. Constructors only match rules that name them explicitly.
+    def match_constructor(self, class_name):
+        return self.news.get(class_name, [])
+
+    ##
+    # Get the types of the parameters whose values the predicates of the rules
+    # for calls of <method> of <class_name> read (see RULES)
+    # @return   A frozenset of type names
+    def get_values(self, class_name, method, constructor = False):
+        key = (class_name, method, constructor)
+        values = self.values.get(key)
+        if values is not None: return values
+
+        if not class_name: rules = []
+        elif constructor:  rules = self.match_constructor(class_name)
+        else:              rules = self.match(class_name, method)
+        values = frozenset([ t for feature, predicate in rules if predicate for t in self.reads.get(predicate, ()) ])
+
+        self.values[key] = values
+        return values
+
 
 class Feature():
     def __init__(self, name, value = False):
@@ -143,181 +409,282 @@ class Features():
             self.output.close()
 
     # Find features
-    def get_features(self, traces, api_classes, package_name):
-
-        # For a given API, get a list of abstract classes 
-        def _load_abstracts(api):
-            abstracts   = []
-            api_classes = trace.load_api([api])
-
-            try:
-                abstracts_f = open(api + ".abstracts", 'r')
-                for line in abstracts_f:
-                    abstracts.append(line.strip())
-                abstracts_f.close()
-            except IOError:
-                abstracts_f = open(api + ".abstracts", 'w')
-
-                for classname in api_classes:
-                    p = subprocess.Popen(["javap", "-classpath", api, classname], stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-                    out, err = p.communicate()
-                    for line in out.splitlines():
-                        if 'abstract' in line:
-                            abstracts.append(line.strip())
-                            print >>abstracts_f, line.strip()
-
-                abstracts_f.close()
-
-            return abstracts
-
-        # Generate a list of traced functions that are *not*:
-        # - Android API calls
-        # - Implemented abstract methods from the Android API
-        # - VM internals (e.g. access$...() calls)
-        # This will give us a list of functions that were declared by the target app itself
-        def _get_target_functions(functions, abstracts): 
-            dict = {}
-            targ = []
-            
-            for function in functions:
-                if not function.is_api and function.modifiers and function.return_type and function.name and not '$' in function.name:
-                    name = "%s abstract %s %s(%s)" % (" ".join(function.modifiers), function.return_type, function.name, ", ".join([x[0] for x in function.parameters]) )
-                    if not any(name in s for s in abstracts):
-                        if function.name in dict: dict[function.name] = dict[function.name] + 1
-                        else:                     dict[function.name] = 1
-                        targ.append(function)
-                        
-            return dict, targ
-
-        def _bloom_array(target):
-            myarray = array.array('i', (0 for i in range(0,1024)) )
-            for k, v in target.iteritems():
-                hashint = int(hashlib.sha224(k[0]).hexdigest(), 16)
-                index = int(hashint % 1024)
-                
-                myarray[index] = myarray[index] + v
-            return myarray
-
-        def _bloom(target):
-            myhash = 0
-            numones = 0         # for debugging
-            numcollisions = 0   # for debugging
-            for s in target:
-                hashint = int(hashlib.sha224(s[0]).hexdigest(), 16)
-                index = (1 << (hashint % 1024))
-
-                if myhash & index == 0:
-                    numones += 1
-                else:
-                    numcollisions += 1
-                
-                myhash = myhash | index
-
-            assert(myhash < (2 ** 1024))
-            return myhash
-
-        function_names    = Counter()
-        functions         = []
-        constructor_names = Counter()
-        constructors      = []
-        reflected_names   = Counter()
-        for key, value in traces.iteritems():
-            function_names    += Counter(value.get_function_names())
-            functions         += value.functions
-            constructor_names += Counter(value.get_constructor_names())
-            constructors      += value.constructors
-            reflected_names   += Counter(value.get_reflected_names())
-
-        # TODO Not sure if necessary, but this does not include recursive reflection calls.
-        reflected = [x.reflected_method for x in functions if x.reflected_method]
+    #   <traces> is a dictionary of Trace objects, or a generator of (key,
+    #   Trace) tuples (see trace.iter_dir()).
+    #   <budget> optionally limits the memory (in bytes) used for the function
+    #   name counters.
+    #   <library> is an optional sdk.LibraryIndex. Functions of bundled
+    #   library classes are then not counted as declared by the app.
+    def get_features(self, traces, api_classes, package_name, budget = None, library = None):
+        accumulator = FeatureAccumulator(self, api_classes, budget, library)
+        self.package_name.enable(package_name)
+
+        if isinstance(traces, dict): traces = traces.iteritems()
+
+        for key, value in traces:
+            for function in value.functions:
+                accumulator.add(function)
+            for constructor in value.constructors:
+                accumulator.add(constructor)
 
+        accumulator.finish()
+
+    # Find features in the trace files of <logdir>
+    #   Same as get_features(), but every call is passed to the accumulator
+    #   while it is parsed and no call is kept afterwards, so memory usage does
+    #   not depend on the number of traced calls.
+    #   If <summary> is set, the distinct calls are written to this file (see
+    #   write_summary()).
+    def get_dir_features(self, logdir, api_classes, package_name, logger, budget = None, library = None, summary = None):
+        accumulator = FeatureAccumulator(self, api_classes, budget, library, summarize = bool(summary))
+        self.package_name.enable(package_name)
+
+        for key, value in trace.iter_dir(logdir, api_classes, logger, fields = ['parameters'], keep_calls = False, listener = accumulator.add):
+            pass
+
+        accumulator.finish()
+        if summary: write_summary(summary, accumulator.calls)
+
+    # Find features in a call summary written by get_dir_features(), without
+    # the traces. Gives the same features as get_dir_features(), as long as the
+    # rules declare the parameter values their predicates read (see RULES).
+    def get_summary_features(self, summary, api_classes, package_name, budget = None, library = None):
+        accumulator = FeatureAccumulator(self, api_classes, budget, library)
         self.package_name.enable(package_name)
-       
-        for function in functions+reflected :
-      
-            if function.target_object:
-                # ANDROID CLASSES FIRST
-                if function.target_object == 'android.telephony.TelephonyManager':
-                    if function.name == 'getDeviceId':                 self.telephony_imei.enable()
-                    if function.name == 'getSubscriberId':             self.telephony_imsi.enable()
-                    if function.name == 'getLine1Number':              self.telephony_msisdn.enable()
-                    if function.name == 'getNetworkCountryIso':        self.telephony_net_iso.enable()
-                    if function.name == 'getNetworkOperator':          self.telephony_net_op.enable()
-                    if function.name == 'getNetworkOperatorName':      self.telephony_net_op_name.enable()
-                    if function.name == 'getNetworkType':              self.telephony_net_type.enable()
-                    if function.name == 'getSimSerialNumber':          self.telephony_sim_serial.enable()
-                    if function.name == 'getSimOperator':              self.telephony_sim_operator.enable()
-                    if function.name == 'getCallState':                self.telephony_get_call_state.enable()
-
-                if (   (function.target_object == 'android.telephony.SmsManager'     and function.name == 'sendTextMessage')
-                    or (function.target_object == 'android.telephony.gsm.SmsManager' and function.name == 'sendTextMessage')): self.telephony_sms.enable()
-                if function.target_object.startswith('android.telephony.SmsMessage'):                                          self.telephony_sms.enable()
-
-                if function.target_object == 'android.net.ConnectivityManager':  self.net_connect_manager.enable()
-                if function.target_object == 'android.net.NetworkInfo':          self.net_info.enable()
-                if function.target_object == 'android.location.LocationManager': self.location.enable()
-                if function.target_object == 'android.app.AlarmManager':         self.misc_alarm.enable()
-
-                if function.target_object == 'android.content.Intent'          and function.name == 'setAction': self.content_intent.enable()
-                if function.target_object == 'android.content.ContentResolver' and function.name == 'query':     self.content_query.enable()
-                if function.target_object == 'android.content.pm.Signature':                                     self.content_signature.enable()
-                # These functions are implemented by android.content.Context, but they are inherited by other classes as well, which is why we make it a bit more generic here.
-                if function.name == 'getSystemService':     self.content_get_service.enable()
-                if function.name == 'getPackageManager':    self.content_get_pmanager.enable()
-                if function.name == 'getSharedPreferences': self.content_get_prefs.enable()
-                if function.name == 'startService':         self.content_start_service.enable()
-                if function.name == 'openFileInput':        self.io_fopen.enable()
-                if function.name == 'openFileOutput':       self.io_fopen.enable()
-                if function.name == 'deleteFile':           self.io_delete.enable()
-      
-                if function.target_object == 'android.provider.Settings$Secure' and function.name == 'getString' and ('java.lang.String', 'android_id') in function.parameters: self.settings_android_id.enable()
-      
-                if function.target_object.startswith('android.database'): self.io_database.enable()
-      
-                if (function.target_object == 'android.os.Handler' and
-                       (function.name == 'sendMessageAtTime' or
-                        function.name == 'sendMessageDelayed' or
-                        function.name == 'sendEmptyMessageAtTime' or
-                        function.name == 'sendEmptyMessageDelayed' or
-                        function.name == 'postAtTime' or
-                        function.name == 'postDelayed')):                   self.misc_handler.enable()
-
-
-                # THEN JAVA
-                if function.target_object == 'java.security.MessageDigest' and function.name == 'digest':      self.misc_digest.enable()
-                if function.target_object == 'java.util.Timer':                                                self.misc_schedule.enable()
-                if function.target_object == 'java.lang.Thread'            and function.name == 'sleep':       self.misc_sleep.enable()
-                if function.target_object == 'java.util.Locale':                                               self.misc_locale.enable()
-                if function.target_object == 'java.io.File'                and function.name == 'exists':      self.io_fexists.enable()
-                if function.target_object == 'java.lang.Runtime'           and function.name == 'exec':        self.io_exec.enable()
-                if function.target_object == 'java.lang.ClassLoader'       and function.name == 'loadClass' and function.parameters[0][1] not in api_classes: 
-                                                                                                               self.misc_classloader.enable()
-                if function.target_object == 'java.lang.System'            and function.name == 'loadLibrary': self.misc_classloader.enable()
-                if function.target_object == 'java.net.HttpURLConnection'  and function.name == 'connect':     self.network_http.enable()
-                if function.target_object.startswith('org.apache.http'):                                       self.network_http.enable()
-                if function.target_object.startswith('java.net'):                                              self.network.enable()
-                if function.target_object.startswith('javax.crypto'):                                          self.misc_crypto.enable()
-                if function.target_object.startswith('java.lang.reflect'):                                     self.misc_reflection.enable()
-                if function.target_object.startswith('java.io.File'):                                          self.io_file.enable()
-                if function.target_object.startswith('java.util.zip'):                                         self.misc_zip.enable()
-
-                if 'native' in function.modifiers and not function.is_api:                                     self.misc_native.enable()
-            
-        for constructor in constructors:
-            if constructor.class_name == 'java.io.File':  self.io_fopen.enable()
-
-        abstracts = _load_abstracts(API)
-
-        target_function_count, target_function_list = _get_target_functions(functions, abstracts) 
-        target_function_names = list(target_function_count)
-
-        if target_function_names:
-            average = lambda x: sum(x) / float(len(x))
-            self.average.enable(average( map(lambda x: len(x), target_function_names )))
-
-        if function_names:
-            self.bloom.enable(       _bloom( list(function_names)         ))
-            self.bloom_array.enable( _bloom_array(function_names).tolist() )
+
+        accumulator.replay( read_summary(summary) )
+
+        accumulator.finish()
+
+##
+# Streaming feature extraction. Calls are added one at a time, in any order:
+# every call updates the feature flags of <features> and the number of calls
+# per function name (input for the bloom filters) and per target function name
+# (input for the average). finish() computes the average and the bloom filters.
+class FeatureAccumulator:
+    def __init__(self, features, api_classes, budget = None, library = None, summarize = False):
+        self.features    = features
+        self.api_classes = api_classes
+        self.library     = library
+        self.libraries   = {}       # Library lookups per class name
+        self.budget      = budget
+
+        self.abstracts   = get_abstracts_index()
+        self.rules       = RuleTable()
+
+        # With a memory budget, the counters (and the calls, if <summarize>)
+        # are kept in SpillSets that share the budget and are spilled to disk.
+        counters = 3 if summarize else 2
+        if budget:
+            self.function_names = trace.SpillSet(budget / counters)
+            self.target_names   = trace.SpillSet(budget / counters)
+        else:
+            self.function_names = Counter()
+            self.target_names   = Counter()
+
+        # Number of calls per encoded call key (see encode_call_key()), if
+        # <summarize>
+        if not summarize: self.calls = None
+        elif budget:      self.calls = trace.SpillSet(budget / counters)
+        else:             self.calls = Counter()
+
+    ##
+    # Add a call
+    # @param    obj     A trace.Function or trace.Constructor (usable as the
+    #                   listener of a trace.Trace)
+    def add(self, obj):
+        if self.calls is not None:
+            self._count(self.calls, self._get_call_key(obj), obj.count)
+            if isinstance(obj, trace.Function) and obj.reflected_method:
+                self._count(self.calls, self._get_call_key(obj.reflected_method, 'reflected'), obj.count)
+
+        if isinstance(obj, trace.Constructor):
+            for feature, predicate in self.rules.match_constructor(obj.class_name):
+                if predicate is None or predicate(obj, self.api_classes): getattr(self.features, feature).enable()
+            return
+
+        self._count(self.function_names, obj.target_object + '.' + obj.name, obj.count)
+
+        self._match(obj)
+        # Reflection is followed one level deep: if the reflected method is
+        # Method.invoke() itself, its target is not part of this call and is
+        # not matched here.
+        if obj.reflected_method: self._match(obj.reflected_method)
+
+        if self._is_target(obj): self._count(self.target_names, obj.name, obj.count)
+
+    ##
+    # Add the calls of a summary
+    # @param    calls   Iterable of (call key, count) tuples
+    def replay(self, calls):
+        for key, count in calls:
+            obj = get_call(key, count)
+            if key[0] == 'reflected': self._match(obj)
+            else:                     self.add(obj)
+
+    def _get_call_key(self, obj, kind = 'call'):
+        if isinstance(obj, trace.Constructor): values = self.rules.get_values(obj.class_name, '<init>', True)
+        else:                                  values = self.rules.get_values(obj.target_object, obj.name)
+        return encode_call_key( get_call_key(obj, values, kind) )
+
+    def _count(self, counter, name, count):
+        if self.budget: counter.add(name, count)
+        else:           counter[name] += count
+
+    def _match(self, function):
+        if not function.target_object: return
+        for feature, predicate in self.rules.match(function.target_object, function.name):
+            if predicate is None or predicate(function, self.api_classes): getattr(self.features, feature).enable()
+
+    def _is_library(self, class_name):
+        if not self.library: return False
+        if class_name not in self.libraries: self.libraries[class_name] = self.library.lookup(class_name)
+        return self.libraries[class_name] is not None
+
+    # Whether or not <function> was declared by the target app itself, i.e.
+    # it is *not*:
+    # - an Android API call
+    # - an implemented abstract method from the Android API
+    # - a VM internal (e.g. access$...() calls)
+    # - a call to bundled library code (if a library index is provided)
+    def _is_target(self, function):
+        if function.is_api or not function.modifiers or not function.return_type or not function.name or '$' in function.name: return False
+        if self._is_library(function.target_object): return False
+        name = get_abstract_signature(function.modifiers, function.return_type, function.name, [x[0] for x in function.parameters])
+        return name not in self.abstracts
+
+    def finish(self):
+        if self.target_names:
+            length, number = 0, 0
+            for name, count in self.target_names.iteritems():
+                length += len(name)
+                number += 1
+            self.features.average.enable( length / float(number) )
+
+        if self.function_names:
+            self.features.bloom.enable(       _bloom(       self.function_names.iteritems() ))
+            self.features.bloom_array.enable( _bloom_array( self.function_names.iteritems() ).tolist() )
+
+##
+# Key of a call in a call summary: everything the feature rules look at.
+# <kind> is 'call' for function calls and 'reflected' for methods called by
+# Method.invoke() (these are only matched against the rules).
+# @param    values  Types of the parameters whose values are kept (see
+#                   RuleTable.get_values())
+# @return   Tuple of (kind, is_api, modifiers, return_type, class name, method
+#           name, parameters), where parameters is a tuple of (type, value)
+#           tuples. Values that are not kept are None.
+def get_call_key(obj, values = frozenset(), kind = 'call'):
+    parameters = tuple([ (t, v if t in values else None) for t, v in obj.parameters ])
+
+    if isinstance(obj, trace.Constructor):
+        return ('new', obj.is_api, (), None, obj.class_name, '<init>', parameters)
+    return (kind, obj.is_api, tuple(obj.modifiers), obj.return_type, obj.target_object, obj.name, parameters)
+
+##
+# Call key as a string, such that it can be counted in a trace.SpillSet. This
+# is the JSON list of a row of a call summary without the count. Strings are
+# encoded as latin-1, so that any byte in a parameter value survives.
+def encode_call_key(key):
+    return json.dumps(key, encoding = 'latin-1', separators = (',', ':'))
+
+##
+# Inverse of get_call_key()
+# @return   A trace.Function or trace.Constructor
+def get_call(key, count = 1):
+    kind, is_api, modifiers, return_type, class_name, name, parameters = key
+    if kind == 'new':
+        obj = trace.Constructor()
+        obj.class_name    = class_name
+    else:
+        obj = trace.Function()
+        obj.modifiers     = list(modifiers)
+        obj.return_type   = return_type
+        obj.target_object = class_name
+        obj.name          = name
+    obj.is_api       = is_api
+    obj.parameters   = list(parameters)
+    obj.count        = count
+    obj.failed_enter = False
+    return obj
+
+##
+# Signature of the function of a call key, in the form of
+# trace.Function.get_signature_key(). Constructors return void, as the
+# constructors listed by the static analysis.
+def get_call_signature(key):
+    kind, is_api, modifiers, return_type, class_name, name, parameters = key
+    if kind == 'new': return_type = 'void'
+    return '%s %s.%s(%s)' % (return_type, class_name, name, ','.join([ t for t, v in parameters ]))
+
+##
+# Write a call summary: a gzipped JSON list of [count, key...] lists. The rows
+# are written one at a time, such that the calls do not have to fit in memory.
+# @param    calls   Counter or trace.SpillSet of encode_call_key() -> count
+def write_summary(filename, calls):
+    f = gzip.open(filename, 'wb')
+    f.write('[')
+    for i, (key, count) in enumerate(calls.iteritems()):
+        if i: f.write(',')
+        f.write('[%d,%s' % (count, key[1:]))
+    f.write(']')
+    f.close()
+
+##
+# Read a call summary written by write_summary()
+# @return   List of (call key, count) tuples
+def read_summary(filename):
+    def _bytes(x):
+        if isinstance(x, unicode): return x.encode('latin-1')
+        return x
+
+    f = gzip.open(filename, 'rb')
+    rows = json.load(f)
+    f.close()
+
+    calls = []
+    for count, kind, is_api, modifiers, return_type, class_name, name, parameters in rows:
+        key = (_bytes(kind), is_api, tuple([ _bytes(x) for x in modifiers ]), _bytes(return_type), _bytes(class_name), _bytes(name),
+               tuple([ (_bytes(t), _bytes(v)) for t, v in parameters ]))
+        calls.append( (key, count) )
+    return calls
+
+# <names> is an iterable of (function_name, count) tuples
+def _bloom_array(names):
+    myarray = array.array('i', (0 for i in range(0,1024)) )
+    for name, count in names:
+        hashint = int(hashlib.sha224(name).hexdigest(), 16)
+        index = int(hashint % 1024)
+
+        myarray[index] = myarray[index] + count
+    return myarray
+
+def _bloom(names):
+    myhash = 0
+    numones = 0         # for debugging
+    numcollisions = 0   # for debugging
+    for name, count in names:
+        hashint = int(hashlib.sha224(name).hexdigest(), 16)
+        index = (1 << (hashint % 1024))
+
+        if myhash & index == 0:
+            numones += 1
+        else:
+            numcollisions += 1
+
+        myhash = myhash | index
+
+    assert(myhash < (2 ** 1024))
+    return myhash
+
+##
+# Inverse of Features.get_dict(), for the results file of a log directory (see
+# results.py)
+def from_dict(d):
+    features = Features()
+    for key, val in d.iteritems():
+        setattr( features, key, Feature(key, val) )
+    return features
 
 def parse(path):
     features = Features()
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+
+import gzip
+import heapq
+import random
+
+from collections import defaultdict
+
+import bitset
+
+# Locality-sensitive hashing index over the 'bloom' feature of analyzed apps
+# (see features.py): a 1024-bit set of the hashes of the called function names.
+#
+# The similarity of two apps is the Jaccard index of their bloom bits. Every app
+# gets a MinHash signature of BANDS * ROWS values, the minimum of a random
+# permutation of the bit positions over its set bits. Two apps agree on a value
+# with a probability equal to their similarity. The signature is split into
+# BANDS bands of ROWS values, and apps that agree on all values of at least one
+# band end up in the same bucket. Only apps that share a bucket with the query
+# are compared, so a query costs BANDS dictionary lookups plus a few exact
+# comparisons, independent of the size of the corpus.
+#
+# With 16 bands of 4 rows, apps with a similarity of 0.5 are found with a
+# probability of 0.65, apps with a similarity of 0.7 with a probability of 0.99.
+
+BLOOM_SIZE = 1024
+
+BANDS = 16
+ROWS  = 4
+
+# The permutations are generated from a fixed seed, such that the signatures of
+# a persisted index stay valid
+SEED = 1024
+
+HEADER = '# lsh'
+
+def get_similarity(a, b):
+    union = bitset.popcount(a | b)
+    if not union: return 0.0
+    return bitset.popcount(a & b) / float(union)
+
+class LSHIndex:
+    def __init__(self, bands = BANDS, rows = ROWS, seed = SEED):
+        self.bands = bands
+        self.rows  = rows
+        self.seed  = seed
+
+        # A permutation maps bit positions to values. It is kept as the list of
+        # positions in order of their value: the MinHash value of a bloom is
+        # the index of its first set bit in this list, which is found after a
+        # few steps for all but the sparsest blooms.
+        generator = random.Random(seed)
+        self.orders = []
+        for i in xrange(bands * rows):
+            permutation = range(BLOOM_SIZE)
+            generator.shuffle(permutation)
+
+            order = [0] * BLOOM_SIZE
+            for position, value in enumerate(permutation):
+                order[value] = position
+            self.orders.append(order)
+
+        self.keys       = []                    # (md5sum, logdir) per app
+        self.blooms     = []                    # Bloom per app
+        self.signatures = []                    # MinHash signature per app
+        self.buckets    = defaultdict(list)     # (band, band values) -> list of apps
+        self.md5sums    = {}                    # md5sum -> app (the last one added)
+        self.logdirs    = set()
+
+    def __len__(self):
+        return len(self.keys)
+
+    ##
+    # MinHash signature of a bloom. The bloom must have at least one bit set.
+    def get_signature(self, bloom):
+        bits = bin(bloom)[:1:-1].ljust(BLOOM_SIZE, '0')    # bits[i] is bit i
+
+        signature = []
+        for order in self.orders:
+            for value, position in enumerate(order):
+                if bits[position] == '1': break
+            signature.append(value)
+        return tuple(signature)
+
+    def _get_band_keys(self, signature):
+        return [ (band, signature[band * self.rows:(band + 1) * self.rows]) for band in xrange(self.bands) ]
+
+    ##
+    # Add an app. Apps without bloom bits (no traced calls) are left out.
+    # @return   True if the app was added
+    def add(self, md5sum, logdir, bloom, signature = None):
+        if not bloom: return False
+        if signature is None: signature = self.get_signature(bloom)
+
+        app = len(self.keys)
+        self.keys.append( (md5sum, logdir) )
+        self.blooms.append(bloom)
+        self.signatures.append(signature)
+        for key in self._get_band_keys(signature):
+            self.buckets[key].append(app)
+
+        self.md5sums[md5sum] = app
+        self.logdirs.add(logdir)
+        return True
+
+    ##
+    # Get the apps that are most similar to <bloom>
+    # @param    k           Maximum number of apps
+    # @param    exhaustive  Compare to all apps instead of the apps that share
+    #                       a bucket with <bloom> (exact, but slow)
+    # @param    exclude     Optional md5sum that is left out of the results
+    #                       (the app itself)
+    # @return   List of (similarity, md5sum, logdir) tuples, most similar first
+    def query(self, bloom, k = 10, exhaustive = False, exclude = None):
+        if not bloom: return []
+
+        if exhaustive:
+            candidates = xrange(len(self.keys))
+        else:
+            candidates = set()
+            for key in self._get_band_keys(self.get_signature(bloom)):
+                candidates.update(self.buckets.get(key, []))
+
+        scored = [ (get_similarity(bloom, self.blooms[app]), app) for app in candidates if self.keys[app][0] != exclude ]
+        return [ (similarity, ) + self.keys[app] for similarity, app in heapq.nlargest(k, scored) ]
+
+    def dump(self, filename):
+        # Blooms and signatures hardly compress, compress fast
+        f = gzip.open(filename, 'wb', 1)
+        f.write('%s %d %d %d\n' % (HEADER, self.bands, self.rows, self.seed))
+        for (md5sum, logdir), bloom, signature in zip(self.keys, self.blooms, self.signatures):
+            f.write('%s\t%s\t%x\t%s\n' % (md5sum, logdir, bloom, ''.join([ '%03x' % x for x in signature ])))
+        f.close()
+
+    ##
+    # Load an index written by dump(). The signatures are computed again if
+    # the index was built with other parameters.
+    @staticmethod
+    def load(filename, bands = BANDS, rows = ROWS, seed = SEED):
+        index = LSHIndex(bands, rows, seed)
+
+        f = gzip.open(filename, 'rb')
+        valid = f.readline().split() == HEADER.split() + [ str(bands), str(rows), str(seed) ]
+        for line in f:
+            md5sum, logdir, bloom, signature = line.rstrip('\n').split('\t')
+            if valid: signature = tuple([ int(signature[i:i + 3], 16) for i in xrange(0, len(signature), 3) ])
+            else:     signature = None
+            index.add(md5sum, logdir, long(bloom, 16), signature)
+        f.close()
+
+        return index
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+
+import os
+import json
+
+# Machine-readable results of a log directory. Next to their human-readable
+# logs, the analysis stages write their results to a single JSON file per log
+# directory, one section per stage:
+# - static      StaticAnalysis.get_dict() (analyze.py)
+# - coverage    Coverage per view and keyword, and the flags raised while
+#               parsing the logcat and the traces (post_analysis/01-coverage.py):
+#               {'views': {view: {keyword: {'coverage': .., 'hits': ..,
+#               'total': ..}}}, 'flags': {'ANR': .., 'died': .., ...}}
+# - features    Features.get_dict() (post_analysis/02-features.py)
+#
+# Consumers read it with load() instead of parsing the logs, and fall back to
+# the logs if a section is missing (log directories of older runs).
+FILENAME = 'results.json'
+
+##
+# Replace <section> of the results file of <logdir> by <data>. The file is
+# replaced atomically, so readers never see a partially written file.
+def update(logdir, section, data):
+    filename = os.path.join(logdir, FILENAME)
+
+    manifest = load(logdir)
+    manifest[section] = data
+
+    f = open(filename + '.tmp', 'w')
+    json.dump(manifest, f, sort_keys = True, separators = (',', ':'))
+    f.close()
+    os.rename(filename + '.tmp', filename)
+
+# json returns unicode strings, the log parsers return str
+def _encode(value):
+    if isinstance(value, unicode): return value.encode('utf-8')
+    if isinstance(value, list):    return [ _encode(x) for x in value ]
+    if isinstance(value, dict):    return dict( (_encode(k), _encode(v)) for k, v in value.iteritems() )
+    return value
+
+##
+# Read the results file of <logdir>
+# @return   Dictionary of section -> data, empty if there is no (valid) file
+def load(logdir):
+    filename = os.path.join(logdir, FILENAME)
+    if not os.path.exists(filename): return {}
+
+    f = open(filename)
+    try:
+        manifest = _encode(json.load(f))
+    except ValueError:
+        manifest = {}
+    f.close()
+
+    return manifest
+
+##
+# Coverage results of a results file, keyed like the coverage lines of the
+# coverage logs: the view is True for 'naive', False for 'conservative' and
+# its name otherwise.
+# @return   Dictionary of (keyword, view) -> (coverage, hits, total)
+def get_coverages(manifest):
+    coverages = {}
+    for view, keywords in manifest.get('coverage', {}).get('views', {}).iteritems():
+        mode = view
+        if view in ('naive', 'conservative'): mode = (view == 'naive')
+        for keyword, result in keywords.iteritems():
+            coverages[ (keyword, mode) ] = (result['coverage'], result['hits'], result['total'])
+    return coverages
+
+##
+# @return   Dictionary of flag name (ANR, died, exception, incomplete,
+#           vmcrash) -> bool
+def get_flags(manifest):
+    return manifest.get('coverage', {}).get('flags', {})
@@ -0,0 +1,242 @@
+#!/usr/bin/python
+
+import os
+import glob
+import zipfile
+import hashlib
+
+from collections import defaultdict, Counter
+
+import classfile
+
+# Get the platform directories
+ROOTDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+if not os.path.exists( os.path.join(ROOTDIR, 'config.sh') ):
+    ROOTDIR = os.path.join(ROOTDIR, '..')
+
+DIR_AND        = os.path.join(ROOTDIR, 'lib', 'android')
+DIR_API        = os.path.join(DIR_AND, 'apis')
+DIR_API_UNUSED = os.path.join(DIR_AND, 'apis-unused')
+API            = os.path.join(DIR_API, 'android-10.jar')
+
+# Index of third-party SDKs (ad networks, support libraries, ...) that apps
+# bundle in their own dex code. Built from the jars in DIR_API and
+# DIR_API_UNUSED and persisted in INDEX, next to these directories.
+#
+# A class is library code if:
+# - its package is, or is a sub package of, a package of one of the jars
+#   (prefix trie lookup), or
+# - it implements the same set of methods as a class of one of the jars, after
+#   mapping every non-platform type to 'L' (hash lookup). This also finds
+#   SDKs that were moved to another package.
+INDEX = os.path.join(DIR_AND, 'libraries.index')
+
+# Format of INDEX. Indexes of another version are rebuilt.
+INDEX_VERSION = '2'
+
+# The SDK jars in DIR_API and DIR_API_UNUSED. The API jar itself is the
+# platform, not a library.
+def get_jars():
+    jars = glob.glob(os.path.join(DIR_API, '*.jar')) + glob.glob(os.path.join(DIR_API_UNUSED, '*.jar'))
+    return sorted([ jar for jar in jars if jar != API ])
+
+# Types in these packages are part of the platform and keep their name in the
+# class hashes
+PLATFORM_PREFIXES = ('java.', 'javax.', 'android.', 'dalvik.', 'org.apache.', 'org.json.', 'org.w3c.', 'org.xml.')
+
+# Packages with fewer components are never considered library packages.
+# Two components are enough on purpose: a package is only added if a jar has
+# classes directly in it, and SDKs like com.tapjoy keep their main classes in
+# their top package and own everything below it. Jars that share a vendor
+# namespace (com.google.ads, com.google.analytics, ...) put their classes in
+# deeper packages and thus only claim those.
+MIN_PREFIX_DEPTH = 2
+
+# Classes with fewer methods (constructors not counted) are not hashed; there
+# are too many of them that look alike
+MIN_HASH_METHODS = 4
+
+def normalize_type(name):
+    base = name.split('[')[0]
+    if base in classfile.PRIMITIVES.values() or base.startswith(PLATFORM_PREFIXES): return name
+    return 'L' + name[len(base):]
+
+##
+# Signature of a method as used in the class hashes
+# @param    return_type     Java type name ('java.lang.String', 'int[]')
+# @param    parameters      List of Java type names
+def get_method_signature(return_type, name, parameters):
+    return '%s %s(%s)' % (normalize_type(return_type), name, ','.join([ normalize_type(x) for x in parameters ]))
+
+##
+# Hash of the set of method signatures of a class, or None if the class has
+# too few methods to be recognized reliably
+def get_class_hash(signatures):
+    signatures = set(signatures)
+    if len([ x for x in signatures if '<init>(' not in x and '<clinit>(' not in x ]) < MIN_HASH_METHODS: return None
+    return hashlib.md5( '\n'.join(sorted(signatures)) ).hexdigest()[:16]
+
+def get_md5sum(filename):
+    f = open(filename, 'rb')
+    md5sum = hashlib.md5(f.read()).hexdigest()
+    f.close()
+    return md5sum
+
+def get_package(class_name):
+    return class_name.rpartition('.')[0]
+
+class LibraryIndex:
+    def __init__(self):
+        self.trie     = {}          # Nested dictionaries of package components. A node's None key holds the set of library names.
+        self.hashes   = {}          # Class hash -> set of library names
+        self.jars     = []          # (basename, md5sum) of the jars this index was built from
+        self.packages = Counter()   # Library name -> number of packages it claims
+        self.version  = None        # INDEX_VERSION of the file this index was loaded from
+
+    def add_package(self, package, library):
+        parts = package.split('.')
+        if len(parts) < MIN_PREFIX_DEPTH: return
+
+        node = self.trie
+        for part in parts:
+            node = node.setdefault(part, {})
+        libraries = node.setdefault(None, set())
+        if library not in libraries:
+            libraries.add(library)
+            self.packages[library] += 1
+
+    def add_hash(self, class_hash, library):
+        self.hashes.setdefault(class_hash, set()).add(library)
+
+    ##
+    # Pick one of the libraries that claim the same package or class hash. Jars
+    # that bundle another SDK (android-support-v13 contains all of
+    # android-support-v4) claim more packages than the SDK itself, so the
+    # library with the fewest packages is the most specific one. Ties are
+    # broken by name to keep the result independent of the order of the jars.
+    def resolve(self, libraries):
+        return min(libraries, key = lambda x: (self.packages[x], x))
+
+    ##
+    # @return   A list of (package, sorted list of library names) for all
+    #           packages that are claimed by more than one library
+    def get_conflicts(self):
+        return [ (package, sorted(libraries)) for package, libraries in self._walk(self.trie, []) if len(libraries) > 1 ]
+
+    ##
+    # Add the classes of a jar. Abstract and native methods are left out, just
+    # like the apk methods of 01-coverage.py, which only lists methods with code.
+    def add_jar(self, jar):
+        library = os.path.splitext(os.path.basename(jar))[0]
+
+        jar_f = zipfile.ZipFile(jar)
+        for info in jar_f.infolist():
+            if not info.filename.endswith('.class'): continue
+            try:
+                cf = classfile.ClassFile( jar_f.read(info.filename) )
+            except classfile.ClassFormatError:
+                continue
+
+            self.add_package(get_package(cf.name), library)
+
+            signatures = [ get_method_signature(m.return_type, m.name, m.parameters) for m in cf.methods
+                           if not m.access_flags & (classfile.ACC_ABSTRACT | classfile.ACC_NATIVE) ]
+            class_hash = get_class_hash(signatures)
+            if class_hash: self.add_hash(class_hash, library)
+        jar_f.close()
+
+        self.jars.append( (os.path.basename(jar), get_md5sum(jar)) )
+
+    ##
+    # Get the library a class belongs to.
+    # @param    class_name  Name of the class
+    # @param    signatures  Optional list of method signatures of the class (see
+    #                       get_method_signature()). If provided, classes
+    #                       outside of the library packages are matched by hash.
+    # @return   The library name, or None
+    def lookup(self, class_name, signatures = None):
+        node = self.trie
+        for part in get_package(class_name).split('.'):
+            node = node.get(part)
+            if node is None: break
+            if None in node: return self.resolve(node[None])
+
+        if signatures:
+            class_hash = get_class_hash(signatures)
+            if class_hash in self.hashes: return self.resolve(self.hashes[class_hash])
+
+        return None
+
+    ##
+    # Classify the classes of a list of trace.Function() objects (e.g. the apk
+    # methods of 01-coverage.py)
+    # @return   Dictionary of class name -> library name for all library classes
+    def classify(self, functions):
+        signatures = defaultdict(list)
+        for f in functions:
+            signatures[f.target_object].append( get_method_signature(f.return_type, f.name, f.parameters) )
+
+        libraries = {}
+        for class_name, class_signatures in signatures.iteritems():
+            library = self.lookup(class_name, class_signatures)
+            if library: libraries[class_name] = library
+        return libraries
+
+    def _walk(self, node, parts):
+        for part, child in sorted(node.iteritems()):
+            if part is None: yield '.'.join(parts), child
+            else:
+                for x in self._walk(child, parts + [part]): yield x
+
+    def dump(self, filename):
+        f = open(filename, 'w')
+        f.write('V\t%s\n' % INDEX_VERSION)
+        for jar in self.jars:
+            f.write('J\t%s\t%s\n' % jar)
+        for package, libraries in self._walk(self.trie, []):
+            for library in sorted(libraries):
+                f.write('P\t%s\t%s\n' % (package, library))
+        for class_hash, libraries in sorted(self.hashes.iteritems()):
+            for library in sorted(libraries):
+                f.write('H\t%s\t%s\n' % (class_hash, library))
+        f.close()
+
+    @staticmethod
+    def load(filename):
+        index = LibraryIndex()
+        f = open(filename)
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if   fields[0] == 'V': index.version = fields[1]
+            elif fields[0] == 'J': index.jars.append( (fields[1], fields[2]) )
+            elif fields[0] == 'P': index.add_package(fields[1], fields[2])
+            elif fields[0] == 'H': index.add_hash(fields[1], fields[2])
+        f.close()
+        return index
+
+##
+# Build an index of <jars>
+def build_index(jars):
+    index = LibraryIndex()
+    for jar in jars:
+        index.add_jar(jar)
+    return index
+
+##
+# Load the persisted library index, or build (and persist) it if it does not
+# exist or if the jars changed since it was built.
+def load_index(jars = None, filename = INDEX):
+    if jars is None: jars = get_jars()
+
+    current = [ (os.path.basename(jar), get_md5sum(jar)) for jar in jars ]
+
+    if os.path.exists(filename):
+        index = LibraryIndex.load(filename)
+        if index.version == INDEX_VERSION and index.jars == current: return index
+
+    index = build_index(jars)
+    try:
+        index.dump(filename)
+    except IOError:
+        pass
+    return index
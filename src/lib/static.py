@@ -8,6 +8,10 @@ import argparse
 
 import androlyze
 
+# Fields of a StaticAnalysis that are written to static.log
+FIELDS = ['apk', 'md5sum', 'package_name', 'main_activity', 'activities', 'services',
+          'receivers', 'providers', 'actions', 'activityactions', 'categories']
+
 class StaticAnalysis:
 
     def __init__(self, filename = None, output = None):
@@ -83,6 +87,11 @@ class StaticAnalysis:
         if self.package_name   == '': self.package_name  = 'unknown'
         if self.main_activity  == '': self.main_activity = 'unknown'
 
+    # The results as written to static.log, for the results file of the log
+    # directory (see results.py)
+    def get_dict(self):
+        return dict( (field, getattr(self, field)) for field in FIELDS )
+
 
 
 def parse(path):
@@ -132,6 +141,14 @@ def parse(path):
 
     return sa
 
+##
+# Inverse of StaticAnalysis.get_dict()
+def from_dict(d):
+    sa = StaticAnalysis()
+    for field in FIELDS:
+        if field in d: setattr(sa, field, d[field])
+    return sa
+
 def main():
     parser = argparse.ArgumentParser(description="Static analysis")
     parser.add_argument("--input",action="store",required=True, help="Android package (.apk)")
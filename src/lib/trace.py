@@ -1,10 +1,13 @@
 #!/usr/bin/python
 
 import re
+import copy
 import zipfile
 import os
 import argparse
 import logging
+import tempfile
+import heapq
 import pydot
 
 from collections import defaultdict, Counter
@@ -38,6 +41,24 @@ possible_modifiers = ['abstract',
 
 colorize = False
 
+# Optional fields of a traced call. Users of Trace and load_dir() can request a
+# subset of these, in which case the parser skips the work for the others:
+# - parameters  Parameter types and values (no parameter regex otherwise)
+# - called_by   Link to the calling Function/Constructor object
+# - return      Return type, return value and exception (no return regex otherwise)
+FIELDS = ['parameters', 'called_by', 'return']
+
+# Estimated number of bytes a single SpillSet entry occupies in memory on top
+# of the length of its key (dict slot, string and int object headers).
+SPILL_ENTRY_OVERHEAD = 100
+
+# Maximum number of sorted runs of a SpillSet. Every run is an open temporary
+# file, so once there are this many, they are merged into one.
+SPILL_MAX_RUNS = 64
+
+# Number of example lines that an ErrorSummary keeps per error class.
+ERROR_SAMPLES = 5
+
 # These functions are accesible without the need of creating a Trace object.
 
 def load_api(apis = [API]):
@@ -51,7 +72,7 @@ def load_api(apis = [API]):
                 api_classes.append(filename.replace('/','.'))
         api_f.close()
 
-    return list(set(api_classes))
+    return set(api_classes)
 
 def is_api(class_name, api_classes):
     if class_name in api_classes:             return True
@@ -72,6 +93,188 @@ def get_linenumbers(filename):
     f.close()
     return linenumbers+1
 
+##
+# Aggregated error reporting. Instead of logging every error, errors are
+# counted per error class and only the first <samples> example lines of each
+# class are kept. report() logs a single summary.
+class ErrorSummary:
+    def __init__(self, samples = ERROR_SAMPLES):
+        self.samples  = samples
+        self.counts   = Counter()           # Number of errors per error class
+        self.examples = defaultdict(list)   # Example lines per error class
+
+    def add(self, error, example):
+        self.counts[error] += 1
+        if len(self.examples[error]) < self.samples: self.examples[error].append(example)
+
+    def total(self):
+        return sum(self.counts.itervalues())
+
+    def __nonzero__(self):
+        return bool(self.counts)
+
+    # Log a summary, e.g.:
+    #   #     ! Could not parse lines: 3
+    #   #     !          3x Function parser regex failed (line incomplete?)
+    #   #     !             public void com.foo.Trunc
+    def report(self, logger, title):
+        if not self.counts: return
+
+        logger.warning('#     ! %s: %d' % (title, self.total()))
+        for error, count in self.counts.most_common():
+            logger.warning('#     !   %8dx %s' % (count, error))
+            for example in self.examples[error]:
+                logger.warning('#     !             %s' % example)
+
+##
+# A node in a calling-context tree: one unique call path from the root of a
+# thread. Times are in the unit of the trace timestamps.
+class CCTNode:
+    def __init__(self, label = None):
+        self.label     = label  # Called method (<class>.<method>)
+        self.count     = 0      # Number of calls in this context
+        self.inclusive = 0      # Total time spent in this context, including callees
+        self.exclusive = 0      # Total time spent in this context, excluding callees
+        self.children  = {}     # Child nodes by label
+
+    def child(self, label):
+        node = self.children.get(label)
+        if node is None:
+            node = CCTNode(label)
+            self.children[label] = node
+        return node
+
+    def merge(self, other):
+        self.count     += other.count
+        self.inclusive += other.inclusive
+        self.exclusive += other.exclusive
+        for label, node in other.children.iteritems():
+            self.child(label).merge(node)
+
+    # Yield (path, node) tuples for this node and all its descendants
+    def walk(self, path = ()):
+        yield path, self
+        for label, node in sorted(self.children.iteritems()):
+            for item in node.walk(path + (label,)): yield item
+
+##
+# Calling-context tree (CCT). A compact, mergeable profile of one or more
+# traces: instead of every call instance, each unique call path is stored once
+# with its call count and inclusive/exclusive time. Trees of different threads
+# or of different runs of the same APK can be merged.
+class CallingContextTree:
+    def __init__(self):
+        self.root = CCTNode('<root>')
+
+    def merge(self, other):
+        self.root.merge(other.root)
+        return self
+
+    # Write one line per call path: <count>\t<inclusive>\t<exclusive>\t<label>;<label>;...
+    def dump(self, filename):
+        f = open(filename, 'w')
+        for path, node in self.root.walk():
+            if path: print >>f, '%d\t%d\t%d\t%s' % (node.count, node.inclusive, node.exclusive, ';'.join(path))
+        f.close()
+
+    @staticmethod
+    def load(filename):
+        cct = CallingContextTree()
+        f = open(filename)
+        for line in f:
+            count, inclusive, exclusive, path = line.rstrip('\n').split('\t', 3)
+            node = cct.root
+            for label in path.split(';'): node = node.child(label)
+            node.count     += int(count)
+            node.inclusive += int(inclusive)
+            node.exclusive += int(exclusive)
+        f.close()
+        return cct
+
+##
+# A multiset of strings that uses a bounded amount of memory. Keys are counted
+# in memory until the estimated size exceeds <budget> bytes, after which they
+# are written as a sorted run to a temporary file. Iterating over the set
+# merges all runs and yields unique (key, count) tuples in sorted order.
+# Keys may not contain tabs or newlines.
+class SpillSet:
+    def __init__(self, budget, tmpdir = None, max_runs = SPILL_MAX_RUNS):
+        self.budget   = budget      # Memory budget in bytes
+        self.tmpdir   = tmpdir      # Directory for the sorted runs (default: system tempdir)
+        self.max_runs = max_runs    # Number of runs at which they are merged into one
+        self.entries  = {}          # In-memory part of the set
+        self.used     = 0           # Estimated number of bytes used by self.entries
+        self.runs     = []          # Sorted runs spilled to disk
+
+    def add(self, key, count = 1):
+        if key in self.entries:
+            self.entries[key] += count
+            return
+
+        self.entries[key] = count
+        self.used += len(key) + SPILL_ENTRY_OVERHEAD
+        if self.used > self.budget: self.spill()
+
+    # Write the in-memory entries as a sorted run to disk
+    def spill(self):
+        if not self.entries: return
+
+        self.runs.append( self._write_run(sorted(self.entries.iteritems())) )
+        self.entries = {}
+        self.used    = 0
+
+        if len(self.runs) >= self.max_runs: self._compact()
+
+    # Merge all runs into a single one, such that the number of open files
+    # stays below max_runs
+    def _compact(self):
+        run = self._write_run( self._merge([ self._read_run(run) for run in self.runs ]) )
+        for old in self.runs: old.close()
+        self.runs = [ run ]
+
+    def _write_run(self, items):
+        run = tempfile.TemporaryFile(dir = self.tmpdir)
+        for key, count in items:
+            run.write('%s\t%d\n' % (key, count))
+        run.seek(0)
+        return run
+
+    def _read_run(self, run):
+        run.seek(0)
+        for line in run:
+            key, _, count = line.rstrip('\n').rpartition('\t')
+            yield key, int(count)
+
+    def __iter__(self):
+        streams = [ self._read_run(run) for run in self.runs ]
+        streams.append( iter(sorted(self.entries.iteritems())) )
+        return self._merge(streams)
+
+    # Merge sorted streams of (key, count) tuples, summing the counts of equal
+    # keys
+    def _merge(self, streams):
+        prev_key, prev_count = None, 0
+        for key, count in heapq.merge(*streams):
+            if key == prev_key:
+                prev_count += count
+                continue
+            if prev_key is not None: yield prev_key, prev_count
+            prev_key, prev_count = key, count
+        if prev_key is not None: yield prev_key, prev_count
+
+    # Same interface as dict.iteritems()
+    def iteritems(self):
+        return iter(self)
+
+    def __nonzero__(self):
+        return bool(self.entries or self.runs)
+
+    def close(self):
+        for run in self.runs: run.close()
+        self.runs    = []
+        self.entries = {}
+        self.used    = 0
+
 
 
 class Error(Exception):
@@ -100,10 +303,18 @@ class Constructor:
         self.timestamp_leave  = 0          # Timestamp of leaving
         self.failed_enter     = True       # Whether or not parsing failed during the constructor call
         self.failed_leave     = True       # Whether or not parsing failed during the return statement of the functino 
+        self.skipped          = False      # Whether or not this call was filtered out by the Trace (only class name is parsed)
+
+        self.count            = 1          # Number of identical consecutive calls represented by this object (see Trace._compress)
+        self.timestamp_last   = timestamp  # Timestamp of entering the last of these calls
     def __str__(self):
         if colorize: return ("new \033[94m%s(\033[0m\033[91m%s\033[0m)" % (self.class_name, self.parameters))
         else:        return ("new %s(%s)" % (self.class_name, self.parameters))
 
+    # Everything that identifies this call, except for timestamps and line numbers
+    def get_call_key(self):
+        return ('new', self.class_name, tuple(self.parameters), self.is_api)
+
 class Function:
     def __init__(self, linenumber = 0, timestamp = 0, depth = 0):
         self.modifiers       = []          # Modifiers of this function (public, private, protected, static, volatile, ...)
@@ -127,6 +338,10 @@ class Function:
         self.timestamp_leave  = 0          # Timestamp of leaving
         self.failed_enter     = True       # Whether or not parsing failed during the function call
         self.failed_leave     = True       # Whether or not parsing failed during the return statement of the function 
+        self.skipped          = False      # Whether or not this call was filtered out by the Trace (only target and name are parsed)
+
+        self.count            = 1          # Number of identical consecutive calls represented by this object (see Trace._compress)
+        self.timestamp_last   = timestamp  # Timestamp of entering the last of these calls
 
         self.reflected_method = None
 
@@ -140,6 +355,23 @@ class Function:
                               self.target_object, self.target_object_s, self.name, self.parameters, 
                               self.retway, self.return_type, self.return_value))
 
+    # Everything that identifies this call, except for timestamps, line numbers
+    # and the return value
+    def get_call_key(self):
+        return (tuple(self.modifiers), self.return_type, self.target_object, self.target_object_s, self.name,
+                tuple(self.parameters), self.retway, self.exception, self.is_api)
+
+    # Key that uniquely identifies the signature of this function. Only
+    # meaningful if parameters is a list of types (i.e., for functions returned
+    # by the _fast() parsers or by static analysis).
+    def get_signature_key(self):
+        return '%s %s.%s(%s)' % (self.return_type, self.target_object, self.name, ','.join(self.parameters))
+
+    # Hashable form of the signature, such that two functions have the same
+    # signature key if and only if equals_signature() holds.
+    def get_signature(self):
+        return (self.target_object, self.name, tuple(self.parameters), self.return_type)
+
     def equals_signature(self, other):
         return (self.name          == other.name
             and self.parameters    == other.parameters
@@ -162,7 +394,14 @@ class Trace:
                         logger               = None,   # Logger.
                         api_classes          = [],     # A list of class names that are considered part of the API.
                         constructors_return  = True,   # Whether or not constructor calls have return statements associated with them (True for VM tracing).
-                        trace_has_timestamps = True    # Whether or not tracelines start with a timestamp.
+                        trace_has_timestamps = True,   # Whether or not tracelines start with a timestamp.
+                        compress             = False,  # Whether or not to run-length compress identical consecutive calls.
+                        cct                  = False,  # Whether or not to fold the calls into a calling-context tree (self.cct).
+                        keep_calls           = True,   # Whether or not to keep every call in self.functions/self.constructors.
+                        fields               = FIELDS, # Optional fields to parse (see FIELDS).
+                        class_prefixes       = None,   # If set, only keep calls to classes that start with one of these prefixes.
+                        skip_api             = False,  # Whether or not to drop calls to API classes.
+                        listener             = None    # Optional function(obj) that is called with every Function/Constructor that passes the filters, as soon as it is parsed.
                 ):
 
         self.function_stack = []        # A stack of function objects. Whenever a return statement is found, a function object is popped from this stack.
@@ -171,12 +410,37 @@ class Trace:
 
         self.constructors_return  = constructors_return
         self.trace_has_timestamps = trace_has_timestamps
+        self.compress             = compress and keep_calls
+        self.keep_calls           = keep_calls
+
+        # Compression needs to know the caller of each call
+        self.fields               = set(fields)
+        if self.compress: self.fields.add('called_by')
+
+        if class_prefixes: self.class_prefixes = tuple(class_prefixes)
+        else:              self.class_prefixes = None
+        self.skip_api             = skip_api
+        self.listener             = listener
+
+        if cct: self.cct = CallingContextTree()
+        else:   self.cct = None
+
+        # Pseudo call that acts as the parent of top-level calls during compression.
+        self.root = Function()
+        self.root.runs, self.root.last_child = [], None
+
+        # Shape IDs by (call key, runs) during compression (see _shape)
+        self.shapes = {}
 
         self.logger = logger
+        self.errors = ErrorSummary()    # Lines that could not be parsed by the _fast() parsers
+
+        # Reflected methods by java.lang.reflect.Method descriptor (see _parse_reflected)
+        self.reflected_cache = {}
 
         # load api classes
         if not api_classes: self.api_classes = load_api()
-        else:               self.api_classes = api_classes
+        else:               self.api_classes = set(api_classes)
 
         # Regular expressions to parse the trace output:
         self.constructor_parser     = re.compile('(.*?)\((.*)')
@@ -190,23 +454,37 @@ class Trace:
     def is_api(self, classname):
         return is_api(classname, self.api_classes)
 
+    # Whether or not calls to <classname> pass the filters of this Trace
+    def is_wanted(self, classname, is_api):
+        if self.skip_api and is_api: return False
+        if self.class_prefixes and not classname.startswith(self.class_prefixes): return False
+        return True
+
+    # The caller of a new call: the top of the stack, or, if that call was
+    # skipped, its (not skipped) caller
+    def _caller(self):
+        if not self.function_stack: return None
+        caller = self.function_stack[-1]
+        if caller.skipped: return caller.called_by
+        return caller
+
     def get_function_names(self, is_api = None):
         name_list = defaultdict(int)
         for function in self.functions:
-            name_list[(function.target_object + "." + function.name, function.is_api)] += 1
+            name_list[(function.target_object + "." + function.name, function.is_api)] += function.count
         return name_list
 
     def get_constructor_names(self, is_api = None):
         name_list = defaultdict(int)
         for constructor in self.constructors:
-            name_list[(constructor.class_name, constructor.is_api)] += 1
+            name_list[(constructor.class_name, constructor.is_api)] += constructor.count
         return name_list
 
     def get_reflected_names(self, is_api = None):
         name_list = defaultdict(int)
         for function in self.functions:
             if function.reflected_method:
-                name_list[(function.reflected_method.target_object + "." + function.reflected_method.name, function.reflected_method.is_api)] += 1
+                name_list[(function.reflected_method.target_object + "." + function.reflected_method.name, function.reflected_method.is_api)] += function.count
         return name_list
 
     def get_failures(self):
@@ -233,8 +511,6 @@ class Trace:
     #   return:    list of parameters
     #
     def _parse_parameters(self, line):
-        print 'parse-parameters, input: '  + line
-
         parameters = []
 
         # Parse using regex
@@ -253,8 +529,6 @@ class Trace:
     def _parse_parameters_fast(self, line):
         # this is not really much faster. we only omit return values, to make
         # it easier to match against static analysis results
-        print 'parse-parameters, input: '  + line
-
         parameters = []
 
         # parse using regex
@@ -288,6 +562,7 @@ class Trace:
             except IndexError as exception:
                 raise ParseError("Could not parse constructor: %s" % exception)
             if self.is_api(obj.class_name): obj.is_api = True
+            if not self.is_wanted(obj.class_name, obj.is_api): obj.skipped = True
 
         else:                                   # FUNCTION
             obj = Function(linenumber, timestamp, depth)
@@ -311,21 +586,71 @@ class Trace:
             except IndexError as exception:
                 raise ParseError("Could not parse function: %s" % exception)
             if self.is_api(obj.target_object): obj.is_api = True
-            
-#            # Extract reflected methods
-#            if obj.target_object == 'java.lang.reflect.Method' and obj.name == 'invoke':
-#                line2 = obj.target_object_s
-#                f = self._parse_enter(line2, linenumber, timestamp, depth)
-##               obj.target_object = f.target_object
-##               obj.target_object_s = f.target_object_s
-##               obj.name = f.name
-#                obj.reflected_method = self._parse_enter(line2, linenumber, timestamp, depth)
+            if not self.is_wanted(obj.target_object, obj.is_api): obj.skipped = True
                 
-        obj.parameters      = self._parse_parameters(line)
+        if 'parameters' in self.fields and not obj.skipped:
+            obj.parameters  = self._parse_parameters(line)
         obj.failed_enter    = False
 
+        # Extract reflected methods
+        if (isinstance(obj, Function) and not obj.skipped and obj.target_object_s and
+                obj.target_object == 'java.lang.reflect.Method' and obj.name == 'invoke'):
+            obj.reflected_method = self._get_reflected(obj, linenumber, timestamp, depth)
+
         return obj 
 
+    # PARSE REFLECTED METHOD
+    #   input:      <modifiers> <return_type> <class_name>.<method_name>(<parameter types>)[ throws <exceptions>]
+    #               (the description of a java.lang.reflect.Method object)
+    #   return:     Function object, or None if the description could not be parsed
+    #
+    #   Results are cached by description: apps that invoke the same reflected
+    #   method over and over again only have it parsed once. The returned object
+    #   is shared and has a list of parameter types as parameters.
+    #
+    def _parse_reflected(self, description):
+        if description in self.reflected_cache: return self.reflected_cache[description]
+
+        function = None
+        head, _, tail = description.partition('(')
+        words = head.split()
+        if tail and len(words) >= 2 and '.' in words[-1]:
+            function = Function()
+            function.modifiers     = [ word for word in words[:-2] if word in possible_modifiers ]
+            function.return_type   = words[-2]
+            function.target_object, _, function.name = words[-1].rpartition('.')
+            function.parameters    = [ x.strip() for x in tail.partition(')')[0].split(',') if x.strip() ]
+            function.is_api        = self.is_api(function.target_object)
+            function.failed_enter  = False
+
+        self.reflected_cache[description] = function
+        return function
+
+    # The method that is called by Method.invoke() call <obj> (and thus by
+    # <obj>), as a new Function object with the parameter values taken from the Object[] argument of the
+    # invoke() call (if they can be matched).
+    def _get_reflected(self, obj, linenumber, timestamp, depth):
+        reflected = self._parse_reflected(obj.target_object_s)
+        if reflected is None: return None
+
+        function = copy.copy(reflected)
+        function.linenumber_enter = linenumber
+        function.timestamp_enter  = timestamp
+        function.timestamp_last   = timestamp
+        function.depth            = depth
+        if 'called_by' in self.fields: function.called_by = obj
+
+        if 'parameters' in self.fields:
+            values = []
+            if len(obj.parameters) == 2 and obj.parameters[1][1]:
+                values = [ x.strip() for x in obj.parameters[1][1].strip('[]').split(',') ]
+            if len(values) != len(reflected.parameters): values = [None] * len(reflected.parameters)
+            function.parameters = zip(reflected.parameters, values)
+        else:
+            function.parameters = []
+
+        return function
+
     # PARSE ENTER CALL, FAST
     #   input:      new <class_name>(<parameters>) | <modifiers> <return_type> <target_object>(<target_object_description>).method_name(<parameters>)
     #   return:     Function object
@@ -365,6 +690,18 @@ class Trace:
             groups = self.function_parser.search(line)
             if groups is None: raise ParseError("Function parser regex failed (line incomplete?)")
             try:
+                # Method.invoke() is handled as a direct call to the reflected method
+                if groups.group(2) == 'java.lang.reflect.Method' and groups.group(5) == 'invoke' and groups.group(4):
+                    reflected = self._parse_reflected(groups.group(4))
+                    if reflected is not None:
+                        if timestamp == 0 and reflected.is_api: return None
+                        function.return_type   = reflected.return_type
+                        function.target_object = reflected.target_object
+                        function.name          = reflected.name
+                        function.parameters    = list(reflected.parameters)
+                        function.timestamp     = timestamp
+                        return function
+
                 # ignore API calls if timestamps are ignored
                 if timestamp == 0: 
                     if self.is_api(groups.group(2)): return None
@@ -452,36 +789,183 @@ class Trace:
                     elif depth < prev_depth:   f = Function()                  # We missed a function call, use a fake one.
                     elif depth > prev_depth:                                   # We missed a return, keep trying...
                         while self.function_stack[-1].depth > depth:
-                            self.function_stack.pop()
+                            missed = self.function_stack.pop()
+                            if self.compress:
+                                self._spoil(missed.called_by)
+                                self._forget(missed)
                         f = self.function_stack.pop()
                 else: f = Function()                                                # No function stack, use a fake Function
-                self._parse_leaving(line, linenumber, int(timestamp), depth, f)
+                try:
+                    if f.skipped or 'return' not in self.fields:
+                        f.linenumber_leave = linenumber
+                        f.timestamp_leave  = int(timestamp)
+                        f.failed_leave     = False
+                    else:
+                        self._parse_leaving(line, linenumber, int(timestamp), depth, f)
+                    if self.cct: self._cct_leave(f)
+                finally:
+                    if self.compress: self._compress(f)
             elif line.split()[0] == 'new':
                 try:
                     constructor = self._parse_enter(line, linenumber, int(timestamp), depth)
-                    if len(self.function_stack) > 0:
-                        constructor.called_by = self.function_stack[-1]
-                    self.constructors.append(constructor)
+                    if 'called_by' in self.fields:
+                        constructor.called_by = self._caller()
+                    if self.cct: self._cct_enter(constructor)
+                    if not constructor.skipped:
+                        if self.compress:   self._track(constructor)
+                        if self.keep_calls: self.constructors.append(constructor)
+                        if self.listener:   self.listener(constructor)
                     if self.constructors_return: self.function_stack.append(constructor)
+                    elif self.compress:          self._compress(constructor)
                 except ParseError as exception:
                     constructor = Constructor()
+                    if self.cct: self._cct_enter(constructor)
                     if self.constructors_return: self.function_stack.append(constructor)
                     raise exception
             else: # Function call
                 try:
                     function = self._parse_enter(line, linenumber, int(timestamp), depth)
-                    if len(self.function_stack) > 0:
-                        function.called_by = self.function_stack[-1]
-                    self.functions.append(function)
+                    if 'called_by' in self.fields:
+                        function.called_by = self._caller()
+                    if self.cct: self._cct_enter(function)
+                    if not function.skipped:
+                        if self.compress:   self._track(function)
+                        if self.keep_calls: self.functions.append(function)
+                        if self.listener:   self.listener(function)
                     self.function_stack.append(function)
                 except ParseError as exception:
                     function = Function()
+                    if self.cct: self._cct_enter(function)
                     self.function_stack.append(function)
                     raise exception
 
         except ParseError as exception:
             pass
 
+    # CALLING-CONTEXT TREE
+    #   On entering a call, the call is attached to the node of its caller (the
+    #   top of the stack) and its count is incremented. On leaving, the time
+    #   between entering and leaving is added to the node, and subtracted from
+    #   the exclusive time of the caller.
+    #
+    def _cct_enter(self, obj):
+        if   isinstance(obj, Constructor) and obj.class_name: label = obj.class_name + '.<init>'
+        elif isinstance(obj, Function)    and obj.name:       label = obj.target_object + '.' + obj.name
+        else:                                                 label = '<unknown>'
+
+        if self.function_stack and hasattr(self.function_stack[-1], 'cct_node'):
+            obj.cct_parent = self.function_stack[-1]
+            obj.cct_node   = obj.cct_parent.cct_node.child(label)
+        else:
+            obj.cct_parent = None
+            obj.cct_node   = self.cct.root.child(label)
+
+        obj.cct_node.count += 1
+        obj.cct_callees     = 0     # Inclusive time of the callees of this call
+
+    def _cct_leave(self, obj):
+        if not hasattr(obj, 'cct_node'): return
+
+        # Placeholders for calls that could not be parsed have no timestamp
+        if obj.failed_enter:
+            del obj.cct_node, obj.cct_parent, obj.cct_callees
+            return
+
+        inclusive = obj.timestamp_leave - obj.timestamp_enter
+        obj.cct_node.inclusive += inclusive
+        obj.cct_node.exclusive += inclusive - obj.cct_callees
+        if obj.cct_parent is not None: obj.cct_parent.cct_callees += inclusive
+
+        del obj.cct_node, obj.cct_parent, obj.cct_callees
+
+    # RUN-LENGTH COMPRESSION
+    #   Hot loops produce long runs of identical consecutive calls (including
+    #   everything they call). With compression enabled, such a run is stored
+    #   once: the first call absorbs the others by adding their counts and
+    #   taking over the timestamps of the last call, after which the others are
+    #   removed from self.functions and self.constructors.
+    #
+    #   While a call is on the stack, it keeps track of where its subtree starts
+    #   in self.functions/self.constructors (first_f, first_c), of the shapes of
+    #   its completed callees as [shape, count] runs, and of its last completed
+    #   callee. A shape is an ID of the call key and the runs of a call:
+    #   interned in self.shapes, such that equal IDs mean equal subtrees. Every
+    #   shape is the shape of at least one call that is kept, so there are no
+    #   more shapes than kept calls.
+    #
+    def _track(self, obj):
+        obj.first_f    = len(self.functions)
+        obj.first_c    = len(self.constructors)
+        obj.runs       = []
+        obj.last_child = None
+
+    # Make sure that <obj> (the parent of a call that did not complete
+    # properly) will never be merged with another call.
+    def _spoil(self, obj):
+        if obj is None: obj = self.root
+        if getattr(obj, 'runs', None) is not None: obj.runs.append([None, 1])
+
+    def _shape(self, obj):
+        if obj.failed_enter: return None
+        if obj.failed_leave and (isinstance(obj, Function) or self.constructors_return): return None
+        if any(shape is None for shape, count in obj.runs): return None
+        key = (obj.get_call_key(), tuple(tuple(run) for run in obj.runs))
+        return self.shapes.setdefault(key, len(self.shapes))
+
+    def _forget(self, obj):
+        if obj is None: return
+        for attr in ('first_f', 'first_c', 'end_f', 'end_c', 'shape', 'runs', 'last_child'):
+            if hasattr(obj, attr): delattr(obj, attr)
+
+    # Called when <obj> returned
+    def _compress(self, obj):
+        # Skipped calls are invisible to consumers, their callees are attached
+        # to the caller of the skipped call
+        if obj.skipped: return
+
+        if not hasattr(obj, 'runs'):
+            # Fake call: we missed the call itself or could not parse it
+            if self.function_stack: self._spoil(self.function_stack[-1])
+            else:                   self._spoil(self.root)
+            return
+
+        parent = obj.called_by or self.root
+        if getattr(parent, 'runs', None) is None:
+            # Parent already returned (we missed its return statement)
+            self._forget(obj)
+            return
+
+        shape = self._shape(obj)
+        self._forget(obj.last_child)
+        del obj.runs, obj.last_child
+
+        prev = parent.last_child
+        if (shape is not None and prev is not None and prev.shape == shape and
+            prev.end_f == obj.first_f and prev.end_c == obj.first_c and
+            len(self.functions)    - obj.first_f == obj.first_f - prev.first_f and
+            len(self.constructors) - obj.first_c == obj.first_c - prev.first_c):
+
+            # Identical to the previous sibling: merge the subtrees node by node
+            for calls, first_prev, first in ((self.functions,    prev.first_f, obj.first_f),
+                                             (self.constructors, prev.first_c, obj.first_c)):
+                for kept, new in zip(calls[first_prev:first], calls[first:]):
+                    kept.count           += new.count
+                    kept.timestamp_last   = new.timestamp_last
+                    kept.timestamp_leave  = new.timestamp_leave
+                    kept.linenumber_leave = new.linenumber_leave
+                del calls[first:]
+
+            parent.runs[-1][1] += 1
+            self._forget(obj)
+            return
+
+        parent.runs.append([shape, 1])
+        self._forget(prev)
+        parent.last_child = obj
+        obj.shape = shape
+        obj.end_f = len(self.functions)
+        obj.end_c = len(self.constructors)
+
     # PARSE A SINGLE TRACE LINE, FAST
     #   input:      input line from trace file
     #   return:     Function object
@@ -502,7 +986,7 @@ class Trace:
             if line.split()[0] in ['return', 'throws']:    return None
             else:                                          return self._parse_enter_fast(line, int(timestamp))
         except (ParseError, IndexError) as exception:
-            self.logger.warning("Could not parse line\n  %s\n--> %s" % (line.strip(), exception ))
+            self.errors.add(str(exception), line.strip())
         
         return None
 
@@ -523,8 +1007,11 @@ class Trace:
         return functions
 
     # PARSE THE ENTIRE FILE, FAST
+    #   If <spill> is a list of SpillSet objects, the signature key of each
+    #   parsed function is added to these sets instead of being returned, which
+    #   keeps memory usage bounded.
     #
-    def _parse_file_fast(self, filename, ignore_timestamps = False, verbose = False):
+    def _parse_file_fast(self, filename, ignore_timestamps = False, verbose = False, spill = None):
         functions = []
 
         # get the total number of lines if we have to keep track of the progress
@@ -545,7 +1032,13 @@ class Trace:
             # we don't care about incomplete lines, these should result in
             # a thrown exception. should not occur that often anymore
             function = self._parse_line_fast(line, ignore_timestamps)
-            if function != None: functions.append(function)
+            if function == None: continue
+
+            if spill is not None:
+                key = function.get_signature_key()
+                for spillset in spill: spillset.add(key)
+            else:
+                functions.append(function)
         f.close()
 
         # return a unique list of functions. this would only make a difference if timestamps are ignored
@@ -558,9 +1051,12 @@ class Trace:
 # PARSE FUNCTIONS                                                                                            #
 ##############################################################################################################
 
-def load_dir(logdir, api_classes, logger):
-    traces = {}
-
+# Parse the trace files in <logdir> one at a time. Yields ((pid, tid), Trace)
+# tuples, so that consumers that process a trace at a time only keep a single
+# trace in memory. With keep_calls = False and a <listener> (see Trace), calls
+# are handed to the listener while parsing and the yielded traces are empty.
+def iter_dir(logdir, api_classes, logger, compress = False, fields = FIELDS, class_prefixes = None, skip_api = False,
+             keep_calls = True, listener = None):
     dump_filename_parser = re.compile('^[a-zA-Z\.]*\.(\d+)\.(\d+)$')
     
     for dirpath, dirnames, filenames in os.walk(logdir):
@@ -574,11 +1070,37 @@ def load_dir(logdir, api_classes, logger):
 
             dump = os.path.join(dirpath, filename)
 
-            traces[ (pid, tid) ] = Trace( filename               = dump,
-                                          api_classes            = api_classes,
-                                          logger                 = logger)
+            yield (pid, tid), Trace( filename               = dump,
+                                     api_classes            = api_classes,
+                                     logger                 = logger,
+                                     compress               = compress,
+                                     fields                 = fields,
+                                     class_prefixes         = class_prefixes,
+                                     skip_api               = skip_api,
+                                     keep_calls             = keep_calls,
+                                     listener               = listener)
+
+def load_dir(logdir, api_classes, logger, compress = False, fields = FIELDS, class_prefixes = None, skip_api = False):
+    return dict( iter_dir(logdir, api_classes, logger, compress, fields, class_prefixes, skip_api) )
+
+# Fold all trace files in <logdir> into a single calling-context tree. Calls are
+# not kept, so memory usage depends on the number of unique call paths only.
+def load_cct(logdir, api_classes, logger):
+    cct = CallingContextTree()
+    dump_filename_parser = re.compile('^[a-zA-Z\.]*\.(\d+)\.(\d+)$')
 
-    return traces
+    for dirpath, dirnames, filenames in os.walk(logdir):
+        for filename in filenames:
+            if dump_filename_parser.search(filename) is None: continue
+
+            traced = Trace( filename    = os.path.join(dirpath, filename),
+                            api_classes = api_classes,
+                            logger      = logger,
+                            cct         = True,
+                            keep_calls  = False)
+            cct.merge(traced.cct)
+
+    return cct
 
 def print_names(names, no_api = None):
     for key, value in sorted(names.iteritems()): 
@@ -734,6 +1256,9 @@ def main():
     parser = argparse.ArgumentParser(description="Load an existing log directory into memory and dump an ipython shell.")
     parser.add_argument("--logdir",  action="store",     required=True, help="Log directory")
     parser.add_argument("--colorize",action="store_true",required=False,help="Colorize output")
+    parser.add_argument("--compress",action="store_true",required=False,help="Run-length compress identical consecutive calls")
+    parser.add_argument("--cct",     action="store",     required=False,help="Write the calling-context tree of all threads to this file instead of dropping a shell")
+    parser.add_argument("--merge",   action="store",     required=False,nargs='+',default=[],help="Calling-context trees (e.g. of other runs of the same APK) to merge into --cct")
     args = parser.parse_args() 
     
     if args.colorize: 
@@ -750,7 +1275,14 @@ def main():
 
     api_classes = load_api()
 
-    traces = load_dir(args.logdir, api_classes, logger)
+    if args.cct:
+        cct = load_cct(args.logdir, api_classes, logger)
+        for filename in args.merge:
+            cct.merge( CallingContextTree.load(filename) )
+        cct.dump(args.cct)
+        return
+
+    traces = load_dir(args.logdir, api_classes, logger, args.compress)
    
     fnames = Counter()
     cnames = Counter()
@@ -5,10 +5,20 @@ import datetime
 import time
 import logging
 import trace
+import bitset
+import sdk
+import static
 import sys
 import os
 import re
 import glob
+import bisect
+import results
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from dynamic import SIMULATIONS
 
@@ -28,8 +38,37 @@ DIR_API = os.path.join(DIR_AND, 'apis')
 # 2. get a list of all methods invoked during stimulation (using trace.py -> _parse_file_fast())
 # 3. compute the code coverage
 
-notfound = []
-multiple = []
+# Signatures (trace.Function.get_signature()) of traced methods that matched
+# no or more than one apk method
+notfound = set()
+multiple = set()
+
+# Unmatched traced methods are not logged one by one, but reported in a single
+# summary by main()
+unmatched = trace.ErrorSummary()
+
+# Problems found while parsing the logcat and the traces (ANR, died, exception,
+# incomplete, vmcrash), for the results file of the logdir (see results.py)
+flags = {}
+FLAGS = ['ANR', 'died', 'exception', 'incomplete', 'vmcrash']
+
+# Coverage views main() can compute from a single static analysis and a single
+# pass over the traces:
+# - naive           See get_apk_methods(). Limited to --package, if provided.
+# - conservative    All methods of the APK, API classes of android-10 only.
+# - package         Naive, limited to --package or else the APK's own package.
+VIEWS = ['naive', 'conservative', 'package']
+
+# Per class, package and component coverage (see bitset.MethodInventory)
+ROLLUP_FILENAME = 'coverage-rollup.log'
+
+# Method coverage bitmaps per view and keyword (see bitset.write_bitmaps()).
+# Read by tools/simulation_gain.py
+BITMAPS_FILENAME = 'coverage-bitmaps.gz'
+
+# Methods of every view in ID order (see bitset.write_inventories()), which
+# name the bits of the bitmaps. Read by post_analysis/xx-database.py
+METHODS_FILENAME = 'coverage-methods.gz'
 
 ##
 # Statically analyze an APK (using Androguard's androlyze) and generate a list
@@ -47,6 +86,17 @@ multiple = []
 #                           which case it does make sense not to be naive.
 # @return   A list of trace.Function() objects defined in <apk>
 def get_apk_methods(apk, api_classes, naive = True, package = ''):
+    apk_functions, package_name = get_all_apk_methods(apk)
+    return select_apk_methods(apk_functions, api_classes, naive, package), package_name
+
+##
+# Statically analyze an APK (using Androguard's androlyze) and generate a list
+# of all functions defined in this apk, without any of the filtering done for
+# naive coverage. Resource constructors are never included.
+# @param    apk             The filename of the target APK
+# @return   A tuple of a list of trace.Function() objects defined in <apk> and
+#           the package name of <apk>
+def get_all_apk_methods(apk):
 
     apk_functions = []
 
@@ -80,17 +130,6 @@ def get_apk_methods(apk, api_classes, naive = True, package = ''):
         # ignore resource constructors
         if method_name == '<init>' and (class_name == package_name + '.R' or class_name.startswith(package_name + '.R$')): continue
 
-        if naive:
-            # ignore mechanically generate bytecode
-            if '$' in method_name: continue
-            if '$' in class_name:  continue
-
-            # ignore API bytecode
-            if trace.is_api(class_name, api_classes): continue
-
-            # limit search to only the provided package (if any)
-            if package and not class_name.startswith(package): continue
-
         f = trace.Function()
         f.target_object = class_name
         f.name          = method_name
@@ -104,6 +143,29 @@ def get_apk_methods(apk, api_classes, naive = True, package = ''):
 
     return apk_functions, package_name
 
+##
+# Select the functions of get_all_apk_methods() that take part in a coverage
+# computation. See get_apk_methods() for <naive>.
+# @return   A list of trace.Function() objects
+def select_apk_methods(apk_functions, api_classes, naive = True, package = ''):
+    if not naive: return list(apk_functions)
+
+    selected = []
+    for f in apk_functions:
+        # ignore mechanically generate bytecode
+        if '$' in f.name:          continue
+        if '$' in f.target_object: continue
+
+        # ignore API bytecode
+        if trace.is_api(f.target_object, api_classes): continue
+
+        # limit search to only the provided package (if any)
+        if package and not f.target_object.startswith(package): continue
+
+        selected.append(f)
+
+    return selected
+
 
 # Return the date as a number of seconds since EPOCH by converting lines like:
 # '[2013-07-05 11:25:48,742   package.02-features.py] Populating API classes'
@@ -154,22 +216,38 @@ def get_simulations(logdir):
 # @param    package_name        Package name of the APK. Used to search for ANR mesesages.
 # @param    logger              Logger
 # @param    verbose             Verbose output (print progress)
-# @return   A list of trace.Function() objects found during dynamic analysis.
-def get_traced_methods(path, api_classes, ignore_timestamps, package_name, logger, verbose):
+# @param    budget              Memory budget in bytes. If set, the signatures
+#                               of traced methods are deduplicated in
+#                               trace.SpillSet objects that are spilled to
+#                               disk once the budget is exceeded. Requires
+#                               ignore_timestamps.
+# @return   A list of trace.Function() objects found during dynamic analysis,
+#           or a trace.SpillSet of signature keys if <budget> is set.
+def get_traced_methods(path, api_classes, ignore_timestamps, package_name, logger, verbose, budget = None):
     
-    # If the output directory contains one of these keywords, the traces will
-    # be stored in the dictionary under this keyword. This is used to compute
-    # code coverage per simulation effect. 
+    # Traces in a subdirectory of <path> named after one of these keywords
+    # (dynamic analysis with --breakdown) are stored in the dictionary under
+    # this keyword. This is used to compute code coverage per simulation effect.
     keywords = SIMULATIONS
 
     # traces will become a dictionary of above keywords, plus 'complete'
-    traces = defaultdict(list)
+    if budget:
+        # A set is spilled as soon as we start parsing a file that does not
+        # belong to it, so only the sets of the current file (its keywords
+        # and the complete set) stay in memory. These split the budget.
+        traces = defaultdict(lambda: trace.SpillSet(budget))
+    else:
+        traces = defaultdict(list)
 
     traced = trace.Trace(api_classes = api_classes, logger = logger)
 
     dump_filename_parser = re.compile('^[a-zA-Z\.]*\.\d+\.\d+$')
     logc_filename_parser = re.compile('^logcat.log$')
 
+    def flag(name, message):
+        logger.warning(message)
+        flags[name] = True
+
     for dirpath, dirnames, filenames in os.walk(path):
         for filename in filenames:
 
@@ -178,11 +256,11 @@ def get_traced_methods(path, api_classes, ignore_timestamps, package_name, logge
             if groups:
                 f = open(os.path.join(dirpath,filename))
                 for line in f:
-                    if 'threadExitUncaughtException()'     in line: logger.warning("#     Uncaught Exception: %s",line.strip())
-                    if 'uncaught exception'                in line: logger.warning("#     Uncaught Exception: %s",line.strip())
-                    if 'ANR in'   in line and package_name in line: logger.warning("#     ANR Detected: %s",line.strip())
-                    if 'has died' in line and package_name in line: logger.warning('#     Died: %s',line.strip())
-                    if 'code around pc'                    in line: logger.warning('#     VM Crashed')
+                    if 'threadExitUncaughtException()'     in line: flag('exception', "#     Uncaught Exception: %s" % line.strip())
+                    if 'uncaught exception'                in line: flag('exception', "#     Uncaught Exception: %s" % line.strip())
+                    if 'ANR in'   in line and package_name in line: flag('ANR',       "#     ANR Detected: %s"       % line.strip())
+                    if 'has died' in line and package_name in line: flag('died',      '#     Died: %s'               % line.strip())
+                    if 'code around pc'                    in line: flag('vmcrash',   '#     VM Crashed')
                 f.close()
 
             # search for method traces
@@ -190,15 +268,49 @@ def get_traced_methods(path, api_classes, ignore_timestamps, package_name, logge
             if groups is None: continue
 
             logger.info("#     Parsing: %s" % filename)
+            if os.path.getsize(os.path.join(dirpath,filename)) == 0: flags['incomplete'] = True
+            subdirs = os.path.relpath(dirpath, path).split(os.sep)
+            if budget:
+                active = [ keyword for keyword in keywords if keyword in subdirs ] + ['complete']
+                for keyword, spillset in traces.items():
+                    if keyword not in active: spillset.spill()
+                for keyword in active:
+                    traces[keyword].budget = budget / len(active)
+                    if traces[keyword].used > traces[keyword].budget: traces[keyword].spill()
+
+                traced._parse_file_fast(os.path.join(dirpath,filename),
+                                        ignore_timestamps    = ignore_timestamps,
+                                        verbose              = verbose,
+                                        spill                = [ traces[keyword] for keyword in active ])
+                continue
+
             traced_functions = traced._parse_file_fast(os.path.join(dirpath,filename),              # path of trace file
                                                        ignore_timestamps    = ignore_timestamps,    # ignore timestamps (speedup)
                                                        verbose              = verbose)              # print progress output
             for keyword in keywords:
-                if keyword in dirpath: traces[keyword] += traced_functions
+                if keyword in subdirs: traces[keyword] += traced_functions
             traces['complete'] += traced_functions
 
+    # One summary of all lines that could not be parsed. xx-database.py uses
+    # this ('Could not parse') to flag incomplete traces.
+    traced.errors.report(logger, 'Could not parse lines')
+    if traced.errors: flags['incomplete'] = True
+
     return traces
 
+##
+# Index APK methods by their signature, such that traced methods can be matched
+# in constant time.
+# @param    apk_functions       List of trace.Function() objects defined in the
+#                               APK
+# @return   A dictionary of trace.Function.get_signature() -> list of
+#           trace.Function() objects with that signature
+def index_apk_methods(apk_functions):
+    index = defaultdict(list)
+    for af in apk_functions:
+        index[af.get_signature()].append(af)
+    return index
+
 ##
 # Provided two lists of functions, compute the code coverage
 # @param    apk_functions       List of trace.Function() objects defined in the
@@ -210,11 +322,16 @@ def get_traced_methods(path, api_classes, ignore_timestamps, package_name, logge
 #                               search for it in <apk_functions>
 # @param    logger              Logger
 # @param    verbose             Verbose output (print progress)
+# @param    index               Result of index_apk_methods(<apk_functions>).
+#                               Built if not provided; pass it in when calling
+#                               this function repeatedly.
 # @return   A tuple of number of hits, total number of functions found in the APK, and code coverage
-def compute_coverage(apk_functions, traced_functions, api_classes, logger, verbose):
+def compute_coverage(apk_functions, traced_functions, api_classes, logger, verbose, index = None):
     total = len(traced_functions)
     prev  = 0
 
+    if index is None: index = index_apk_methods(apk_functions)
+
     for i, tf in enumerate(traced_functions):
 
         # only print progress in verbose mode to avoid bloated coverage log files
@@ -225,32 +342,124 @@ def compute_coverage(apk_functions, traced_functions, api_classes, logger, verbo
 #       if '$' in tf.target_object: continue
 #       if '$' in tf.name: continue
 
-        found = 0
-        for af in apk_functions:
-
-            if af.equals_signature(tf):
-                af.called = af.called + 1
-                found = found + 1
+        signature = tf.get_signature()
+        matches   = index.get(signature, [])
+        for af in matches:
+            af.called = af.called + 1
 
-        if found == 0:
+        if not matches:
             # this is not really an issue probably...
-            # add this method to the notfound list if it is not in there already
-            if not [ x for x in notfound if x.equals_signature(tf) ]:
-                logger.warning("#     No apk method found for traced method: %s" % tf)
-                notfound.append(tf)
+            # add this method to the notfound set if it is not in there already
+            if signature not in notfound:
+                unmatched.add('No apk method found for traced method', str(tf))
+                notfound.add(signature)
             
-        if found > 1:
+        if len(matches) > 1:
             # this would be weird
-            # add this method to the multiple list if it is not in there already
-            if not [ x for x in multiple if x.equals_signature(tf) ]:
-                logger.warning("#     Multiple apk methods found for traced method: %s" % af)
-                multiple.append(tf)
+            # add this method to the multiple set if it is not in there already
+            if signature not in multiple:
+                unmatched.add('Multiple apk methods found for traced method', str(tf))
+                multiple.add(signature)
 
 #   misses = sum([ x.called == 0 for x in apk_functions])
     hits   = sum([ x.called >  0 for x in apk_functions])
     total  = len(apk_functions)
     return hits, total, (100.0 / total) * hits
 
+##
+# Compute the code coverage by merge joining the sorted APK methods against the
+# sorted stream of traced signature keys that comes out of a trace.SpillSet.
+# Only the APK methods are kept in memory.
+# @param    apk_functions       List of trace.Function() objects defined in the
+#                               APK
+# @param    spillset            trace.SpillSet with the signature keys of the
+#                               methods found during dynamic analysis
+# @param    api_classes         A list of API class names
+# @param    logger              Logger
+# @return   A tuple of number of hits, total number of functions found in the APK, and code coverage
+def compute_coverage_external(apk_functions, spillset, api_classes, logger):
+    apk_sorted = sorted( ((af.get_signature_key(), af) for af in apk_functions), key = lambda x: x[0] )
+    i = 0
+
+    for key, count in spillset:
+        while i < len(apk_sorted) and apk_sorted[i][0] < key: i += 1
+
+        found = 0
+        j = i
+        while j < len(apk_sorted) and apk_sorted[j][0] == key:
+            apk_sorted[j][1].called = apk_sorted[j][1].called + count
+            found = found + 1
+            j = j + 1
+
+        if found == 0:
+            # we assume that API methods won't be found inside the APK
+            target_object = key.split(' ',1)[1].split('(',1)[0].rpartition('.')[0]
+            if not trace.is_api(target_object, api_classes):
+                unmatched.add('No apk method found for traced method', key)
+
+        if found > 1:
+            unmatched.add('Multiple apk methods found for traced method', key)
+
+    hits   = sum([ x.called >  0 for x in apk_functions])
+    total  = len(apk_functions)
+    return hits, total, (100.0 / total) * hits
+
+##
+# Get the time at which each APK method was hit first, in a single pass over the
+# traced functions.
+# @param    traced_functions    List of trace.Function() objects found during
+#                               dynamic analysis
+# @param    api_classes         A list of API class names
+# @param    index               Result of index_apk_methods()
+# @return   A sorted list with one first-hit timestamp per APK method that was
+#           hit. Methods that were never hit are not in the list.
+def get_first_hits(traced_functions, api_classes, index):
+    first = {}
+
+    for tf in traced_functions:
+        if trace.is_api(tf.target_object, api_classes): continue
+
+        signature = tf.get_signature()
+        if signature not in index: continue
+
+        if signature not in first or tf.timestamp < first[signature]:
+            first[signature] = tf.timestamp
+
+    first_hits = []
+    for signature, timestamp in first.iteritems():
+        first_hits += [timestamp] * len(index[signature])
+
+    return sorted(first_hits)
+
+##
+# Sweep once over time and generate the coverage-over-time table.
+# @param    first_hits          Result of get_first_hits()
+# @param    call_times          Timestamps of all traced function calls
+# @param    started             Result of get_simulations()
+# @param    interval            Interval between two rows of the table
+# @return   A list of (time, hits, number of function calls, simulation name)
+#           tuples, one per <interval> from the first simulation up to the end
+#           of the last one.
+def get_coverage_table(first_hits, call_times, started, interval):
+    starts = sorted(started.keys())
+    names  = [ started[k] for k in starts ]
+
+    if numpy is not None:
+        ticks = numpy.arange(starts[0], starts[-1], interval, dtype=numpy.int64)
+        hits  = numpy.searchsorted(numpy.array(first_hits, dtype=numpy.int64), ticks, side='right')
+        calls = numpy.searchsorted(numpy.sort(numpy.array(call_times, dtype=numpy.int64)), ticks, side='right')
+        sims  = numpy.searchsorted(numpy.array(starts, dtype=numpy.int64), ticks, side='right') - 1
+        return [ (int(t), int(h), int(c), names[i]) for t, h, c, i in zip(ticks, hits, calls, sims) ]
+
+    call_times = sorted(call_times)
+    table = []
+    for tmp_time in xrange(starts[0], starts[-1], interval):
+        table.append( (tmp_time,
+                       bisect.bisect_right(first_hits, tmp_time),
+                       bisect.bisect_right(call_times, tmp_time),
+                       names[bisect.bisect_right(starts, tmp_time) - 1]) )
+    return table
+
 ##
 # Provided two lists of functions, get the code coverage (computing is done in
 # compute_coverage).
@@ -276,6 +485,8 @@ def get_coverage(apk_functions, traced_functions, api_classes, interval, logdir,
         print 'no traced functions found'
         return -1.0
     
+    index = index_apk_methods(apk_functions)
+
     if interval > 0:
         started = get_simulations(logdir)
         min_time = min([x.timestamp for x in traced_functions])
@@ -290,19 +501,14 @@ def get_coverage(apk_functions, traced_functions, api_classes, interval, logdir,
         if max_time > last_simulation:
             logger.warning('Last method trace line was printed after the emulator was closed! Unreliable results coming up!')
 
+        first_hits = get_first_hits(traced_functions, api_classes, index)
+        call_times = [x.timestamp for x in traced_functions]
 
-#       for tmp_time in xrange (min_time, max_time + interval, interval):
-        for tmp_time in xrange (first_simulation, last_simulation, interval):
-            tlist = [x for x in traced_functions if x.timestamp >= min_time and x.timestamp <= tmp_time]
-
-            simulation_start = max(k for k in started.keys() if k <= tmp_time)
-            simulation_name  = started[simulation_start]
-            
-            # probably not a good idea to show progress of code coverage computation for every interval
-            hits, total, coverage = compute_coverage(apk_functions, tlist, api_classes, logger, verbose = False)
-            logger.info('%16d: %5.02f%% (%d of %d. function calls: %d) %s' % ((tmp_time / 1000000), coverage, hits, total, len(tlist), simulation_name) )
+        for tmp_time, hits, calls, simulation_name in get_coverage_table(first_hits, call_times, started, interval):
+            coverage = (100.0 / len(apk_functions)) * hits
+            logger.info('%16d: %5.02f%% (%d of %d. function calls: %d) %s' % ((tmp_time / 1000000), coverage, hits, len(apk_functions), calls, simulation_name) )
     
-    hits, total, coverage = compute_coverage(apk_functions, traced_functions, api_classes, logger, verbose)
+    hits, total, coverage = compute_coverage(apk_functions, traced_functions, api_classes, logger, verbose, index)
   
 #    for match in [x for x in apk_functions if x.called > 0]: 
 #        if match.name == '<init>': print 'match: %s.%s(%s)'    % (                   match.target_object, match.name, match.parameters)
@@ -313,14 +519,16 @@ def get_coverage(apk_functions, traced_functions, api_classes, interval, logdir,
 
     return hits, total, coverage
 
-def get_logger(logdir, verbose, naive):
+def get_logger(logdir, verbose, views):
     # log filename
-    if naive: 
+    if views == ['naive']: 
 #       log_filename = "coverage.naive." + str(datetime.datetime.now()).replace(' ','.').replace(':','.')
         log_filename = 'coverage.naive.log'
-    else: 
+    elif views == ['conservative']: 
 #       log_filename = "coverage.conservative." + str(datetime.datetime.now()).replace(' ','.').replace(':','.')
         log_filename = 'coverage.conservative.log'
+    else:
+        log_filename = 'coverage.views.log'
 
     # file log format
     formatter = logging.Formatter("")
@@ -349,7 +557,50 @@ def get_logger(logdir, verbose, naive):
     return logger, fileLogger
 
 
-def main(apk = None, logdir = None, verbose = False, interval = 0, naive = False, package = ''):
+##
+# Merge the results of this run into the coverage section of the results file
+# of <logdir> (see results.py), such that separate runs for different views add
+# up.
+# @param    view_results    Dictionary of view -> keyword -> result dictionary
+def write_views(logdir, view_results):
+    previous = results.load(logdir).get('coverage', {})
+
+    views = previous.get('views', {})
+    views.update(view_results)
+
+    # The flags of previous runs are kept, like the coverage logs they were
+    # logged to
+    previous_flags = previous.get('flags', {})
+    merged         = dict( (name, bool(previous_flags.get(name) or flags.get(name))) for name in FLAGS )
+    results.update(logdir, 'coverage', {'views': views, 'flags': merged})
+
+##
+# Merge the coverage bitmaps of this run into the bitmaps file of <logdir>
+# @param    bitmaps     Dictionary of (view, keyword) -> (number of methods, bitset)
+def write_bitmaps(logdir, bitmaps):
+    filename = os.path.join(logdir, BITMAPS_FILENAME)
+
+    if os.path.exists(filename):
+        previous = bitset.read_bitmaps(filename)
+        previous.update(bitmaps)
+        bitmaps = previous
+
+    bitset.write_bitmaps(filename, bitmaps)
+
+##
+# Merge the method inventories of this run into the methods file of <logdir>
+# @param    inventories     Dictionary of view -> bitset.MethodInventory
+def write_inventories(logdir, inventories):
+    filename = os.path.join(logdir, METHODS_FILENAME)
+
+    merged = {}
+    if os.path.exists(filename): merged = bitset.read_inventories(filename)
+    for view, inventory in inventories.iteritems():
+        merged[ (view, ) ] = [ function.get_signature_key() for function in inventory.functions ]
+
+    bitset.write_inventories(filename, merged)
+
+def main(apk = None, logdir = None, verbose = False, interval = 0, naive = False, package = '', budget = 0, views = None, rollup = False, static_analysis = None):
     if not apk or not logdir:
         parser = argparse.ArgumentParser(description="Get the code coverage of a given .APK and its log directory, FAST.")
         parser.add_argument("--input",     action="store",     required=True, help="Android package (.apk) that was analyzed") 
@@ -358,6 +609,9 @@ def main(apk = None, logdir = None, verbose = False, interval = 0, naive = False
         parser.add_argument("--interval",  action="store",     required=False,default=0,    help="Interval used for coverage table in seconds. By default, no coverage table will be generated (faster)")
         parser.add_argument("--naive",action="store_true",required=False,default=False,help="Be naive during code coverage computation (i.e. exclude known libraries and api functions from apk")
         parser.add_argument("--package",action="store", required=False,default='',help="limit coverage to this package name only")
+        parser.add_argument("--memory-budget",action="store",required=False,default=0,type=int,help="Spill traced signatures to disk once this many MB are used (cannot be combined with --interval)")
+        parser.add_argument("--views",action="store",required=False,default='',help="Comma separated list of coverage views to compute in one run (%s). Overrides --naive" % ', '.join(VIEWS))
+        parser.add_argument("--rollup",action="store_true",required=False,default=False,help="Write per class, package and component coverage to %s" % ROLLUP_FILENAME)
         args     = parser.parse_args() 
         apk      = args.input
         logdir   = args.logdir
@@ -365,6 +619,9 @@ def main(apk = None, logdir = None, verbose = False, interval = 0, naive = False
         interval = args.interval
         naive    = args.naive
         package  = args.package
+        budget   = args.memory_budget
+        views    = [ view for view in args.views.split(',') if view ]
+        rollup   = args.rollup
  
 
     if not os.path.exists(apk):
@@ -375,47 +632,127 @@ def main(apk = None, logdir = None, verbose = False, interval = 0, naive = False
         print "Logdir %s does not exist" % logdir
         sys.exit()
 
+    if not views:
+        if naive: views = ['naive']
+        else:     views = ['conservative']
+
+    for view in views:
+        if view not in VIEWS:
+            print "Unknown coverage view %s" % view
+            sys.exit()
+
     if interval == 0: ignore_timestamps = True
     else:             ignore_timestamps = False
 
-    logger, filelogger = get_logger(logdir, verbose, naive)
-    
+    if budget and not ignore_timestamps:
+        print "--memory-budget cannot be combined with --interval"
+        sys.exit()
 
-    if naive: apis = glob.glob( os.path.join(DIR_API, '*.jar') )
-    else:     apis = [ os.path.join( DIR_API, 'android-10.jar') ]
+    logger, filelogger = get_logger(logdir, verbose, views)
+
+    global unmatched, notfound, multiple, flags
+    unmatched = trace.ErrorSummary()
+    notfound  = set()
+    multiple  = set()
+    flags     = {}
     
-    api_classes = trace.load_api(apis)
 
-    if naive: logger.info('# naive')
+    api_classes = {}
+    if 'conservative' in views:
+        api_classes['conservative'] = trace.load_api([ os.path.join( DIR_API, 'android-10.jar') ])
+    if 'naive' in views or 'package' in views:
+        api_classes['naive']   = trace.load_api( glob.glob( os.path.join(DIR_API, '*.jar') ) )
+        api_classes['package'] = api_classes['naive']
 
-    logger.info('# -> Running static analysis')
-    apk_functions, package_name = get_apk_methods(apk, api_classes, naive, package)
+    if views == ['naive']: logger.info('# naive')
+    elif len(views) > 1:   logger.info('# views: %s' % ', '.join(views))
 
-    if len(apk_functions) == 0:
+    logger.info('# -> Running static analysis')
+    all_functions, package_name = get_all_apk_methods(apk)
+
+    # Naive coverage also leaves out bundled third-party SDKs, including the
+    # ones that were moved to another package (see sdk.LibraryIndex)
+    if 'naive' in api_classes:
+        libraries = sdk.load_index().classify(all_functions)
+        if libraries:
+            logger.info('# -> Library classes: %d (%s)' % (len(libraries), ', '.join(sorted(set(libraries.values())))))
+            api_classes['naive']   = api_classes['naive'] | set(libraries)
+            api_classes['package'] = api_classes['naive']
+
+    view_functions = {}
+    for view in views:
+        if view == 'conservative': view_functions[view] = select_apk_methods(all_functions, api_classes[view], False)
+        if view == 'naive':        view_functions[view] = select_apk_methods(all_functions, api_classes[view], True, package)
+        if view == 'package':      view_functions[view] = select_apk_methods(all_functions, api_classes[view], True, package or package_name)
+
+        if len(view_functions[view]) == 0 and len(views) > 1:
+            logger.info('# -> No methods found in apk for view %s' % view)
+
+    if not any(view_functions.values()):
         print 'No methods found in apk'
         sys.exit()
 
+    # The traces are parsed once for all views, so API calls are only dropped
+    # for the smallest set of API classes. compute_coverage() skips the API
+    # calls of the other views.
+    if 'conservative' in views: parse_api_classes = api_classes['conservative']
+    else:                       parse_api_classes = api_classes['naive']
+
     logger.info('# -> Parsing method traces')
     traces = get_traced_methods(logdir, 
-                                api_classes, 
+                                parse_api_classes, 
                                 ignore_timestamps, 
                                 package_name,
                                 logger, 
-                                verbose)
+                                verbose,
+                                budget * 1024 * 1024)
+
+    inventories = dict( (view, bitset.MethodInventory(view_functions[view])) for view in views )
+    bitmaps     = {}
 
+    if rollup:
+        if not static_analysis: static_analysis = static.parse( os.path.join(logdir,'static.log') )
+        components = {'activity': static_analysis.activities,
+                      'service':  static_analysis.services,
+                      'receiver': static_analysis.receivers,
+                      'provider': static_analysis.providers}
+
+        rollup_f = open(os.path.join(logdir, ROLLUP_FILENAME), 'w')
+
+    view_results = defaultdict(dict)
     for keyword, traced_functions in traces.iteritems():
-        if len(traced_functions) > 0:
-            for af in apk_functions:
-                af.called = 0
+        if traced_functions:
+            for view in views:
+                apk_functions = view_functions[view]
+                if not apk_functions: continue
+
+                for af in apk_functions:
+                    af.called = 0
 
-            logger.info('# -> Computing code coverage for %s' % keyword)
-            hits, total, coverage = get_coverage(apk_functions, traced_functions, api_classes, int(interval) * 1000000, logdir, logger, verbose)
+                logger.info('# -> Computing code coverage for %s' % keyword)
+                if budget: hits, total, coverage = compute_coverage_external(apk_functions, traced_functions, api_classes[view], logger)
+                else:      hits, total, coverage = get_coverage(apk_functions, traced_functions, api_classes[view], int(interval) * 1000000, logdir, logger, verbose)
             
-            if naive: logger.info('# -> Code coverage: %15.10f%% (%8d of %8d) (naive)        (%s)' % (coverage, hits, total, keyword))
-            else:     logger.info('# -> Code coverage: %15.10f%% (%8d of %8d) (conservative) (%s)' % (coverage, hits, total, keyword))
+                logger.info('# -> Code coverage: %15.10f%% (%8d of %8d) %-15s(%s)' % (coverage, hits, total, '(%s)' % view, keyword))
+                print '%15.10f %-15s(%s)' % (coverage, '(%s)' % view, keyword)
+
+                view_results[view][keyword] = {'coverage': coverage, 'hits': hits, 'total': total}
+
+                bits = inventories[view].get_bitset(apk_functions)
+                bitmaps[ (view, keyword) ] = (len(apk_functions), bits)
+
+                if rollup:
+                    rollup_f.write('# -> %s (%s)\n' % (view, keyword))
+                    inventories[view].report(rollup_f, bits, components, package_name)
+
+        if budget: traced_functions.close()
+
+    unmatched.report(logger, 'Unmatched traced methods')
 
-            if naive: print '%15.10f (naive)        (%s)' % (coverage, keyword)
-            else:     print '%15.10f (conservative) (%s)' % (coverage, keyword)
+    write_views(logdir, view_results)
+    write_bitmaps(logdir, bitmaps)
+    write_inventories(logdir, inventories)
+    if rollup: rollup_f.close()
 
     for handler in list(logger.handlers):
         logger.removeHandler(handler)
@@ -425,7 +762,8 @@ def main(apk = None, logdir = None, verbose = False, interval = 0, naive = False
 
 def post_analysis(apk, logbase, static_analysis, logger):
 #   main(apk = apk, logdir = logbase, naive = False)
-    main(apk = apk, logdir = logbase, naive = True)
+#   main(apk = apk, logdir = logbase, naive = True)
+    main(apk = apk, logdir = logbase, views = VIEWS, rollup = True, static_analysis = static_analysis)
 
 if __name__ == "__main__":
     main()
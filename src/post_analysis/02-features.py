@@ -4,10 +4,13 @@ import argparse
 import logging
 import os
 import re
+import sys
 
 import features
 
+import sdk
 import static
+import results
 import trace
 
 # Get the platform directories
@@ -46,12 +49,16 @@ def close_logger(logger):
         handler.close()
     logging.shutdown()
 
-def main(apk = None, logdir = None, static_analysis = None, logger = None):
+def main(apk = None, logdir = None, static_analysis = None, logger = None, budget = 0, from_summary = False):
     if not apk or not logdir:
         parser = argparse.ArgumentParser(description="Get the features of a given log directory.")
         parser.add_argument("--logdir",    action="store",     required=True, help="Log directory")
-        args     = parser.parse_args() 
-        logdir   = args.logdir
+        parser.add_argument("--memory-budget",action="store",required=False,default=0,type=int,help="Spill function name counters to disk once this many MB are used")
+        parser.add_argument("--from-summary",action="store_true",required=False,default=False,help="Evaluate the feature rules against the call summary of a previous run (%s) instead of parsing the traces" % features.SUMMARY_FILENAME)
+        args         = parser.parse_args() 
+        logdir       = args.logdir
+        budget       = args.memory_budget
+        from_summary = args.from_summary
 
         # Get filename of the original APK
         apk = os.path.basename( os.path.normpath(logdir) )
@@ -66,14 +73,29 @@ def main(apk = None, logdir = None, static_analysis = None, logger = None):
     logger.info('Populating API classes')
     api_classes = trace.load_api([API])
 
-    logger.info('Parsing trace files')
-    traces = trace.load_dir(logdir, api_classes, logger)
+    logger.info('Loading library index')
+    library = sdk.load_index()
+
+    summary = os.path.join(logdir, features.SUMMARY_FILENAME)
 
-    logger.info('Searching for features')
     fs = features.Features(output = os.path.join(logdir,'features.log') )
-    fs.get_features(traces, api_classes, static_analysis.package_name)
+    if from_summary:
+        if not os.path.exists(summary):
+            print "Call summary %s does not exist" % summary
+            sys.exit()
+
+        logger.info('Searching for features in the call summary')
+        fs.get_summary_features(summary, api_classes, static_analysis.package_name, budget * 1024 * 1024, library)
+    else:
+        # Calls are handed to the feature accumulator while the trace files
+        # are parsed, so that they are never kept in memory. The distinct calls
+        # are written to the call summary.
+        logger.info('Searching for features')
+        fs.get_dir_features(logdir, api_classes, static_analysis.package_name, logger, budget * 1024 * 1024, library, summary)
     fs.dump()
 
+    results.update(logdir, 'features', fs.get_dict())
+
     close_logger(logger)
 
 def post_analysis(apk, logbase, static_analysis, logger):
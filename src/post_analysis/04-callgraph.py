@@ -63,7 +63,7 @@ def main(apk = None, logdir = None, static_analysis = None, logger = None):
     api_classes = trace.load_api([API])
 
     logger.info('Parsing trace files')
-    traces = trace.load_dir(logdir, api_classes, logger)
+    traces = trace.load_dir(logdir, api_classes, logger, compress = True, fields = ['called_by'])
 
     logger.info('Generating Callgraph')
     fnames = Counter()
@@ -2,18 +2,36 @@
 
 import argparse 
 import logging
+import multiprocessing
 import os
 import re
+import sys
+import time
+import socket
 
 
 import features
 import db 
+import dbwriter
 
+import bitset
 import static
+import results
 
 
 DATABASE = 'analysis.db'
 
+# Number of log directories stored per transaction by the bulk ingest
+BATCH_SIZE = 1000
+
+# Coverage bitmaps and the methods they are over, written by
+# post_analysis/01-coverage.py
+BITMAPS_FILENAME = 'coverage-bitmaps.gz'
+METHODS_FILENAME = 'coverage-methods.gz'
+
+# Files a log directory is parsed from, next to the coverage logs
+STAMP_FILES = [results.FILENAME, 'static.log', 'features.log', features.SUMMARY_FILENAME, BITMAPS_FILENAME, METHODS_FILENAME]
+
 class Coverage:
     def __init__(self):
         self.coverage = 0.0
@@ -71,10 +89,34 @@ def get_coverage_result(outdir):
                         if groups.group(6): keyword = groups.group(6)
                         else:               keyword = 'everything'
 
-                        result.coverages[ (keyword, naive) ] = coverage
+                        # Logs with several views name the view on every coverage line
+                        mode = naive
+                        if groups.group(5):
+                            mode = groups.group(5).strip()
+                            if mode in ('naive', 'conservative'): mode = (mode == 'naive')
+
+                        result.coverages[ (keyword, mode) ] = coverage
         
     return result
 
+##
+# Same as get_coverage_result(), from the results file of the log directory
+# (see results.py) instead of the coverage logs
+def get_manifest_result(outdir, manifest):
+    result = Result( os.path.basename(os.path.normpath(outdir)) )
+
+    for name, value in results.get_flags(manifest).iteritems():
+        setattr(result, name, value)
+
+    for key, (percentage, hits, total) in results.get_coverages(manifest).iteritems():
+        coverage = Coverage()
+        coverage.coverage   = percentage
+        coverage.f_executed = hits
+        coverage.f_found    = total
+        result.coverages[key] = coverage
+
+    return result
+
 def get_logger():
     # file log format
     formatter  = logging.Formatter('[%(asctime)s   %(name)s] %(message)s')
@@ -99,32 +141,230 @@ def close_logger(logger):
         handler.close()
     logging.shutdown()
 
+##
+# State of the files of a log directory that are parsed by load(), such that
+# the bulk ingest can skip log directories that did not change since they were
+# ingested: name, size and modification time of each file.
+def get_stamp(logdir):
+    coverage_filename_parser = re.compile('^coverage\..*$')
+
+    stamp = []
+    for filename in sorted(os.listdir(logdir)):
+        if filename not in STAMP_FILES and not coverage_filename_parser.search(filename): continue
+        st = os.stat( os.path.join(logdir, filename) )
+        stamp.append('%s:%d:%d' % (filename, st.st_size, int(st.st_mtime)))
+    return ' '.join(stamp)
+
+# Filename of the original APK
+def get_apk(logdir):
+    apk = os.path.basename( os.path.normpath(logdir) )
+    return re.sub('\.\d{4}-\d{2}-\d{2}\.\d{2}\.\d{2}\.\d{2}\.\d{6}', '', apk)
+
+##
+# Read the results of a log directory. The results file of the log directory
+# is used if the stage that writes a section ran, the logs otherwise (log
+# directories of older runs).
+# @return   Tuple of the static analysis, the coverage Result() and the features
+def load(logdir, static_analysis = None, logger = None):
+    manifest = results.load(logdir)
+
+    # Get static analysis
+    if not static_analysis:
+        if 'static' in manifest: static_analysis = static.from_dict(manifest['static'])
+        else:                    static_analysis = static.parse( os.path.join(logdir,'static.log') )
+
+    if 'coverage' in manifest:
+        coverages = get_manifest_result(logdir, manifest)
+    else:
+        if logger: logger.info("Parsing coverage output")
+        coverages = get_coverage_result(logdir)
+
+    if 'features' in manifest:
+        fs = features.from_dict(manifest['features'])
+    else:
+        if logger: logger.info("Parsing feature output")
+        fs = features.parse( os.path.join(logdir,'features.log') )
+
+    return static_analysis, coverages, fs
+
+##
+# Get the methods executed by the app of a log directory: the calls of the
+# call summary of 02-features.py, plus the apk methods that were hit in any
+# coverage view of 01-coverage.py (their number of calls is only known from
+# the call summary).
+# @return   List of (signature key, is API method, number of calls or None if
+#           not known) tuples
+def get_method_hits(logdir):
+    hits = {}
+
+    summary = os.path.join(logdir, features.SUMMARY_FILENAME)
+    if os.path.exists(summary):
+        for key, count in features.read_summary(summary):
+            # Reflected calls are the targets of calls that are in the
+            # summary already
+            if key[0] == 'reflected': continue
+
+            signature = features.get_call_signature(key)
+            if signature in hits: hits[signature][1] += count
+            else:                 hits[signature] = [key[1], count]
+
+    bitmaps = os.path.join(logdir, BITMAPS_FILENAME)
+    methods = os.path.join(logdir, METHODS_FILENAME)
+    if os.path.exists(bitmaps) and os.path.exists(methods):
+        inventories = bitset.read_inventories(methods)
+        for (view, keyword), (nbits, bits) in bitset.read_bitmaps(bitmaps).iteritems():
+            signatures = inventories.get( (view, ) )
+            if keyword != 'complete' or not signatures or len(signatures) != nbits: continue
+
+            for i in bitset.get_ids(bits):
+                if signatures[i] not in hits: hits[ signatures[i] ] = [False, None]
+
+    return [ (signature, api, calls) for signature, (api, calls) in hits.iteritems() ]
+
+# Parse a log directory for the bulk ingest (in a worker process)
+def _get_rows(args):
+    logdir, stamp = args
+    try:
+        static_analysis, coverages, fs = load(logdir)
+        return logdir, db.get_rows(get_apk(logdir), logdir, static_analysis, coverages, fs, stamp, get_method_hits(logdir)), None
+    except Exception as e:
+        return logdir, None, str(e)
+
+##
+# Store a batch of ingested log directories in a single transaction. Of several
+# log directories of the same apk, only the last one is stored (the log
+# directories are ingested in sorted order, i.e. the latest analysis wins), the
+# others are only recorded as ingested. A batch that cannot be stored is logged
+# and skipped.
+# @return   Number of log directories stored
+def store(database, batch, logger):
+    if not batch: return 0
+
+    rows       = db.get_unique_rows(batch)
+    unique     = set( id(row) for row in rows )
+    superseded = [ row['Ingested'] for row in batch if id(row) not in unique and 'Ingested' in row ]
+    try:
+        database.insert_many(rows, superseded)
+    except db.DatabaseError as e:
+        logger.warning("Could not store a batch of %d log directories: %s" % (len(batch), e.msg))
+        return 0
+    return len(batch)
+
+##
+# Store all log directories in <indir> that were not ingested before, or that
+# changed since. The log directories are parsed by <processes> worker
+# processes, the main process is the only writer and stores BATCH_SIZE log
+# directories per transaction.
+# @return   Tuple of the number of log directories stored, skipped (unchanged)
+#           and failed
+def ingest(indir, database, logger, processes = None):
+    database = db.Database(database)
+    ingested = database.get_ingested()
+
+    logdirs = []
+    skipped = 0
+    for dirpath, dirnames, filenames in sorted(os.walk(indir)):
+        if 'static.log' not in filenames and results.FILENAME not in filenames: continue
+
+        logdir = os.path.abspath(dirpath)
+        stamp  = get_stamp(logdir)
+        if ingested.get(logdir) == stamp: skipped += 1
+        else:                             logdirs.append( (logdir, stamp) )
+    logger.info("%d log directories to ingest, %d unchanged" % (len(logdirs), skipped))
+
+    if processes is None: processes = multiprocessing.cpu_count()
+    if processes > 1 and len(logdirs) > 1:
+        pool = multiprocessing.Pool(processes)
+        parsed = pool.imap(_get_rows, logdirs, chunksize = 32)
+    else:
+        pool = None
+        parsed = (_get_rows(x) for x in logdirs)
+
+    stored = 0
+    failed = 0
+    batch  = []
+    try:
+        for logdir, rows, error in parsed:
+            if rows is None:
+                logger.warning("Could not parse %s: %s" % (logdir, error))
+                failed += 1
+                continue
+
+            batch.append(rows)
+            if len(batch) >= BATCH_SIZE:
+                n = store(database, batch, logger)
+                stored += n
+                failed += len(batch) - n
+                batch   = []
+                logger.info("%d of %d log directories stored" % (stored, len(logdirs)))
+
+        n = store(database, batch, logger)
+        stored += n
+        failed += len(batch) - n
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        database.close()
+
+    return stored, skipped, failed
+
 def main(apk = None, logdir = None, static_analysis = None, logger = None):
     if not apk or not logdir:
         parser = argparse.ArgumentParser(description="Store output results in database.")
-        parser.add_argument("--logdir",    action="store",     required=True, help="Log directory")
+        parser.add_argument("--logdir",    action="store",     required=False,default=None, help="Log directory")
+        parser.add_argument("--input",     action="store",     required=False,default=None, help="Directory containing the analysis output directories to ingest in bulk (log directories that did not change since they were ingested are skipped)")
+        parser.add_argument("--database",  action="store",     required=False,default=DATABASE, help="Database file (default: %s)" % DATABASE)
+        parser.add_argument("--processes", action="store",     required=False,default=None, type=int, help="Number of worker processes for --input (default: one per CPU)")
         args     = parser.parse_args() 
         logdir   = args.logdir
 
-        # Get filename of the original APK
-        apk = os.path.basename( os.path.normpath(logdir) )
-        apk = re.sub('\.\d{4}-\d{2}-\d{2}\.\d{2}\.\d{2}\.\d{2}\.\d{6}', '', apk)
-
-        # Get static analysis
-        static_analysis = static.parse( os.path.join(logdir,'static.log') )
+        if not logdir and not args.input:
+            print "Either --logdir or --input is required"
+            sys.exit()
 
         # Get logger
         logger = get_logger()
 
-    logger.info("Parsing coverage output")
-    coverages = get_coverage_result(logdir)
-
-    logger.info("Parsing feature output")
-    fs = features.parse( os.path.join(logdir,'features.log') )
+        if args.input:
+            if not os.path.exists(args.input):
+                print "Input %s does not exist" % args.input
+                sys.exit()
+
+            t = time.time()
+            stored, skipped, failed = ingest(args.input, args.database, logger, args.processes)
+            logger.info("%d log directories stored, %d unchanged, %d failed in %.1fs" % (stored, skipped, failed, time.time() - t))
+            close_logger(logger)
+            return
+
+        apk      = get_apk(logdir)
+        database = args.database
+    else:
+        database = DATABASE
+
+    static_analysis, coverages, fs = load(logdir, static_analysis, logger)
+    rows = db.get_rows(apk, logdir, static_analysis, coverages, fs, hits = get_method_hits(logdir))
+
+    # Leave the writing to the database writer (lib/dbwriter.py) if one is
+    # running, instead of competing with other workers for the write lock
+    address = dbwriter.get_address(database)
+    if os.path.exists(address):
+        try:
+            logger.info("Submitting to database writer %s" % address)
+            dbwriter.submit(address, rows)
+            close_logger(logger)
+            return
+        except socket.error as e:
+            logger.warning("Database writer %s is not running (%s), writing to the database" % (address, e))
+        except db.DatabaseError as e:
+            # The writer stopped or failed before it acknowledged the rows.
+            # Storing them again replaces whatever it may have stored.
+            logger.warning("Database writer %s did not store the results (%s), writing to the database" % (address, e))
 
     logger.info("Writing to database")
-    database = db.Database(DATABASE)
-    database.insert(apk, logdir, static_analysis, coverages, fs)
+    database = db.Database(database)
+    database.insert_many([ rows ])
+    database.close()
 
     close_logger(logger)
 
@@ -134,4 +374,3 @@ def post_analysis(apk, logbase, static_analysis, logger):
 
 if __name__ == "__main__":
     main()
-
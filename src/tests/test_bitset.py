@@ -0,0 +1,71 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import trace
+import bitset
+
+def get_function(class_name, name, called = 0, parameters = []):
+    function = trace.Function()
+    function.target_object = class_name
+    function.name          = name
+    function.parameters    = parameters
+    function.return_type   = 'void'
+    function.called        = called
+    return function
+
+class MethodInventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir    = tempfile.mkdtemp()
+        self.functions = [ get_function('com.foo.bar.Util',   'tick', 1, ['int']),
+                           get_function('com.foo.Main',       'onCreate', 1),
+                           get_function('com.foo.Main$1',     'run'),
+                           get_function('com.foo.Main',       'onPause'),
+                           get_function('com.ads.Banner',     'show', 2),
+                           get_function('com.foo.bar.Util',   'tock') ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_ranges(self):
+        inventory = bitset.MethodInventory(self.functions)
+        bits      = inventory.get_bitset()
+
+        self.assertEqual(len(inventory), 6)
+        self.assertEqual(inventory.count(bits, *inventory.packages['']),             3)
+        self.assertEqual(inventory.count(bits, *inventory.packages['com.foo']),      2)
+        self.assertEqual(inventory.count(bits, *inventory.packages['com.foo.bar']),  1)
+        self.assertEqual(inventory.classes['com.foo.Main'][1] - inventory.classes['com.foo.Main'][0], 3)
+        self.assertEqual(inventory.get_component_range('.Main', 'com.foo'), inventory.classes['com.foo.Main'])
+
+    def test_duplicate_signatures(self):
+        functions = self.functions + [ get_function('com.foo.Main', 'onCreate', 1) ]
+        inventory = bitset.MethodInventory(functions)
+        bits      = inventory.get_bitset([ get_function('com.foo.Main', 'onCreate', 1) ])
+
+        self.assertEqual(bitset.popcount(bits), 2)
+        self.assertEqual([ inventory.functions[i].name for i in bitset.get_ids(bits) ], ['onCreate', 'onCreate'])
+
+    def test_round_trip(self):
+        inventory = bitset.MethodInventory(self.functions)
+        bits      = inventory.get_bitset()
+        hit       = sorted( function.get_signature_key() for function in self.functions if function.called )
+
+        bitmaps   = { ('naive', 'complete'): (len(inventory), bits), ('naive', 'boot'): (len(inventory), 0L) }
+        filename  = os.path.join(self.tmpdir, 'coverage-bitmaps.gz')
+        bitset.write_bitmaps(filename, bitmaps)
+        self.assertEqual(bitset.read_bitmaps(filename), bitmaps)
+
+        inventories = { ('naive', ): [ function.get_signature_key() for function in inventory.functions ] }
+        filename    = os.path.join(self.tmpdir, 'coverage-methods.gz')
+        bitset.write_inventories(filename, inventories)
+        self.assertEqual(bitset.read_inventories(filename), inventories)
+
+        signatures = bitset.read_inventories(filename)[ ('naive', ) ]
+        self.assertEqual(sorted( signatures[i] for i in bitset.get_ids(bits) ), hit)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import struct
+import zipfile
+import tempfile
+import unittest
+
+import classfile
+from classfile import ACC_PUBLIC, ACC_PRIVATE, ACC_STATIC, ACC_FINAL, ACC_NATIVE, ACC_INTERFACE, ACC_ABSTRACT
+
+# The first lines of lib/android/apis/android-10.jar.abstracts, as printed by
+# 'javap java.security.cert.Certificate | grep abstract' and
+# 'javap android.preference.Preference$OnPreferenceClickListener | grep abstract'
+JAVAP_LINES = ['public abstract class java.security.cert.Certificate extends java.lang.Object implements java.io.Serializable{',
+               'public abstract byte[] getEncoded()       throws java.security.cert.CertificateEncodingException;',
+               'public abstract void verify(java.security.PublicKey)       throws java.security.cert.CertificateException, java.security.NoSuchAlgorithmException, java.security.InvalidKeyException, java.security.NoSuchProviderException, java.security.SignatureException;',
+               'public abstract void verify(java.security.PublicKey, java.lang.String)       throws java.security.cert.CertificateException, java.security.NoSuchAlgorithmException, java.security.InvalidKeyException, java.security.NoSuchProviderException, java.security.SignatureException;',
+               'public abstract java.lang.String toString();',
+               'public abstract java.security.PublicKey getPublicKey();',
+               'public abstract boolean onPreferenceClick(android.preference.Preference);']
+
+VERIFY_EXCEPTIONS = ['java/security/cert/CertificateException', 'java/security/NoSuchAlgorithmException', 'java/security/InvalidKeyException',
+                     'java/security/NoSuchProviderException', 'java/security/SignatureException']
+
+##
+# Assemble a class file with the given methods, a few fields and constant pool
+# entries of other types that the parser has to skip
+class ClassWriter:
+    def __init__(self):
+        self.pool  = []
+        self.index = {}
+
+    def _add(self, key, data, slots = 1):
+        if key not in self.index:
+            self.index[key] = len(self.pool) + 1
+            self.pool.append(data)
+            if slots == 2: self.pool.append('')
+        return self.index[key]
+
+    def utf8(self, value):
+        return self._add( ('utf8', value), struct.pack('>BH', 1, len(value)) + value )
+
+    def klass(self, name):
+        return self._add( ('class', name), struct.pack('>BH', 7, self.utf8(name)) )
+
+    def write(self, access_flags, name, super_name, interfaces, methods):
+        self._add( ('long',),   struct.pack('>BQ', 5, 1 << 40), 2 )
+        self._add( ('string',), struct.pack('>BH', 8, self.utf8('a string')) )
+        self._add( ('int',),    struct.pack('>Bi', 3, -1) )
+
+        body  = struct.pack('>HHH', access_flags, self.klass(name), super_name and self.klass(super_name) or 0)
+        body += struct.pack('>H', len(interfaces)) + ''.join([ struct.pack('>H', self.klass(x)) for x in interfaces ])
+
+        # fields
+        body += struct.pack('>H', 1)
+        body += struct.pack('>HHHH', ACC_PRIVATE, self.utf8('type'), self.utf8('Ljava/lang/String;'), 1)
+        body += struct.pack('>HI', self.utf8('Signature'), 2) + struct.pack('>H', self.utf8('x'))
+
+        body += struct.pack('>H', len(methods))
+        for flags, method_name, descriptor, exceptions in methods:
+            attributes = ''
+            count      = 0
+            if not flags & (ACC_ABSTRACT | ACC_NATIVE):
+                code = '\x00' * 12
+                attributes += struct.pack('>HI', self.utf8('Code'), len(code)) + code
+                count += 1
+            if exceptions:
+                data = struct.pack('>H', len(exceptions)) + ''.join([ struct.pack('>H', self.klass(x)) for x in exceptions ])
+                attributes += struct.pack('>HI', self.utf8('Exceptions'), len(data)) + data
+                count += 1
+            body += struct.pack('>HHHH', flags, self.utf8(method_name), self.utf8(descriptor), count) + attributes
+
+        body += struct.pack('>H', 0)
+
+        header = struct.pack('>IHHH', classfile.MAGIC, 0, 50, len(self.pool) + 1)
+        return header + ''.join(self.pool) + body
+
+def write_certificate():
+    abstract = ACC_PUBLIC | ACC_ABSTRACT
+    return ClassWriter().write(ACC_PUBLIC | ACC_ABSTRACT | 0x0020, 'java/security/cert/Certificate', 'java/lang/Object', ['java/io/Serializable'], [
+        (0x0004,                   '<init>',       '(Ljava/lang/String;)V',                    []),
+        (ACC_PUBLIC | ACC_FINAL,   'getType',      '()Ljava/lang/String;',                     []),
+        (abstract,                 'getEncoded',   '()[B',                                     ['java/security/cert/CertificateEncodingException']),
+        (abstract,                 'verify',       '(Ljava/security/PublicKey;)V',             VERIFY_EXCEPTIONS),
+        (abstract,                 'verify',       '(Ljava/security/PublicKey;Ljava/lang/String;)V', VERIFY_EXCEPTIONS),
+        (abstract,                 'toString',     '()Ljava/lang/String;',                     []),
+        (abstract,                 'getPublicKey', '()Ljava/security/PublicKey;',              []),
+        (ACC_PRIVATE | ACC_NATIVE, 'check',        '([[IJ)Z',                                  []),
+        (ACC_STATIC,               '<clinit>',     '()V',                                      []) ])
+
+def write_listener():
+    return ClassWriter().write(ACC_PUBLIC | ACC_STATIC | ACC_INTERFACE | ACC_ABSTRACT, 'android/preference/Preference$OnPreferenceClickListener', 'java/lang/Object', [], [
+        (ACC_PUBLIC | ACC_ABSTRACT, 'onPreferenceClick', '(Landroid/preference/Preference;)Z', []) ])
+
+class ClassFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_javap_lines(self):
+        cf = classfile.ClassFile( write_certificate() )
+        self.assertEqual(cf.name,       'java.security.cert.Certificate')
+        self.assertEqual(cf.interfaces, ['java.io.Serializable'])
+        self.assertEqual(str(cf.methods[-2]), 'private native boolean check(int[][], long);')
+        self.assertEqual(cf.get_abstracts() + classfile.ClassFile( write_listener() ).get_abstracts(), JAVAP_LINES)
+
+    def test_javap_abstracts_file(self):
+        abstracts = os.path.join(os.path.dirname(__file__), '..', '..', 'lib', 'android', 'apis', 'android-10.jar.abstracts')
+        if not os.path.exists(abstracts): self.skipTest('%s not found' % abstracts)
+
+        f = open(abstracts)
+        lines = [ f.readline().strip() for line in JAVAP_LINES ]
+        f.close()
+        self.assertEqual(lines, JAVAP_LINES)
+
+    def test_jar(self):
+        jar = os.path.join(self.tmpdir, 'test.jar')
+        jar_f = zipfile.ZipFile(jar, 'w')
+        jar_f.writestr('java/security/cert/Certificate.class',                        write_certificate())
+        jar_f.writestr('android/preference/Preference$OnPreferenceClickListener.class', write_listener())
+        jar_f.writestr('broken/Truncated.class',                                      write_listener()[:40])
+        jar_f.writestr('META-INF/MANIFEST.MF',                                        'Manifest-Version: 1.0\n')
+        jar_f.close()
+
+        self.assertEqual(sorted(classfile.get_abstracts(jar, processes = 1)), sorted(JAVAP_LINES))
+
+    def test_bad_magic(self):
+        self.assertRaises(classfile.ClassFormatError, classfile.ClassFile, '\x00' * 16)
+
+if __name__ == '__main__':
+    unittest.main()
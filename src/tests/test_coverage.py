@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+import os
+import imp
+import random
+import logging
+import unittest
+
+import trace
+
+cov = imp.load_source('coverage_01', os.path.join(os.path.dirname(__file__), '..', 'post_analysis', '01-coverage.py'))
+
+API_CLASSES = set(['android.app.Activity', 'java.lang.String'])
+CLASSES     = ['com.foo.Main', 'com.foo.Util', 'com.foo.Main$1'] + list(API_CLASSES)
+NAMES       = ['run', 'onCreate', 'tick', '<init>']
+PARAMETERS  = [[], ['int'], ['java.lang.String', 'int']]
+
+def make_function(target_object, name, parameters, return_type = 'void', timestamp = 0):
+    function = trace.Function()
+    function.target_object = target_object
+    function.name          = name
+    function.parameters    = list(parameters)
+    function.return_type   = return_type
+    function.called        = 0
+    function.timestamp     = timestamp
+    return function
+
+def random_function(rnd, timestamp = 0):
+    return make_function(rnd.choice(CLASSES), rnd.choice(NAMES), rnd.choice(PARAMETERS),
+                         rnd.choice(['void', 'int']), timestamp)
+
+##
+# APK methods (including duplicate signatures) and traced methods (including
+# API calls and methods that are not in the APK) with increasing timestamps.
+def make_functions(seed, apk = 40, traced = 300):
+    rnd = random.Random(seed)
+    apk_functions = [ random_function(rnd) for i in xrange(apk) ]
+    apk_functions = [ af for af in apk_functions if not trace.is_api(af.target_object, API_CLASSES) ]
+    apk_functions += [ make_function(af.target_object, af.name, af.parameters, af.return_type) for af in apk_functions[:3] ]
+
+    time = 1000
+    traced_functions = []
+    for i in xrange(traced):
+        time += rnd.randint(0, 50)
+        traced_functions.append(random_function(rnd, time))
+    return apk_functions, traced_functions
+
+# The linear match that compute_coverage() used before the signature index
+def reference_coverage(apk_functions, traced_functions, api_classes):
+    for tf in traced_functions:
+        if trace.is_api(tf.target_object, api_classes): continue
+        for af in apk_functions:
+            if af.equals_signature(tf):
+                af.called = af.called + 1
+
+    hits   = sum([ x.called >  0 for x in apk_functions])
+    total  = len(apk_functions)
+    return hits, total, (100.0 / total) * hits
+
+# The per-interval computation that get_coverage_table() replaces
+def reference_table(apk_functions, traced_functions, api_classes, started, interval):
+    starts = sorted(started.keys())
+    table  = []
+    for tmp_time in xrange(starts[0], starts[-1], interval):
+        tlist = [x for x in traced_functions if x.timestamp <= tmp_time]
+        simulation_name = started[max(k for k in starts if k <= tmp_time)]
+        for af in apk_functions: af.called = 0
+        hits, total, coverage = reference_coverage(apk_functions, tlist, api_classes)
+        table.append( (tmp_time, hits, len(tlist), simulation_name) )
+    return table
+
+class ComputeCoverageTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('test_coverage')
+        self.logger.addHandler(logging.NullHandler())
+
+    def test_index_matches_linear(self):
+        for seed in xrange(10):
+            apk_functions, traced_functions = make_functions(seed)
+            expected = reference_coverage(apk_functions, traced_functions, API_CLASSES)
+            called   = [ af.called for af in apk_functions ]
+
+            for af in apk_functions: af.called = 0
+            self.assertEqual(cov.compute_coverage(apk_functions, traced_functions, API_CLASSES, self.logger, False), expected)
+            self.assertEqual([ af.called for af in apk_functions ], called)
+
+    def test_duplicates_and_unmatched(self):
+        main  = make_function('com.foo.Main', 'run', [])
+        dup   = make_function('com.foo.Main', 'run', [])
+        other = make_function('com.foo.Main', 'run', ['int'])
+        traced = [ make_function('com.foo.Main', 'run', []), make_function('com.foo.Gone', 'run', []),
+                   make_function('java.lang.String', 'run', []) ]
+
+        cov.notfound.clear()
+        cov.multiple.clear()
+        self.assertEqual(cov.compute_coverage([main, dup, other], traced, API_CLASSES, self.logger, False)[:2], (2, 3))
+        self.assertEqual((main.called, dup.called, other.called), (1, 1, 0))
+        self.assertEqual(cov.notfound, set([ ('com.foo.Gone', 'run', (), 'void') ]))
+        self.assertEqual(cov.multiple, set([ ('com.foo.Main', 'run', (), 'void') ]))
+
+class CoverageTableTest(unittest.TestCase):
+    def check_table(self, seed):
+        apk_functions, traced_functions = make_functions(seed)
+        started  = { 900: 'Initial', 4000: 'Activity', 6000: 'Broadcast', traced_functions[-1].timestamp + 100: 'End' }
+        expected = reference_table(apk_functions, traced_functions, API_CLASSES, started, 250)
+
+        index      = cov.index_apk_methods(apk_functions)
+        first_hits = cov.get_first_hits(traced_functions, API_CLASSES, index)
+        call_times = [ tf.timestamp for tf in reversed(traced_functions) ]
+        self.assertEqual(cov.get_coverage_table(first_hits, call_times, started, 250), expected)
+
+    def test_sweep_matches_per_interval(self):
+        for seed in xrange(5): self.check_table(seed)
+
+    def test_sweep_without_numpy(self):
+        numpy = cov.numpy
+        cov.numpy = None
+        try:
+            for seed in xrange(5): self.check_table(seed)
+        finally:
+            cov.numpy = numpy
+
+if __name__ == '__main__':
+    unittest.main()
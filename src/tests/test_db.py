@@ -0,0 +1,222 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import db
+import features
+
+class StaticAnalysis:
+    def __init__(self, md5sum, package_name):
+        self.md5sum          = md5sum
+        self.package_name    = package_name
+        self.main_activity   = package_name + '.Main'
+        self.activities      = [ self.main_activity ]
+        self.services        = []
+        self.receivers       = [ package_name + '.Boot' ]
+        self.providers       = []
+        self.actions         = ['android.intent.action.BOOT_COMPLETED']
+        self.activityactions = { self.main_activity: ['android.intent.action.MAIN'] }
+        self.categories      = ['android.intent.category.LAUNCHER']
+
+class Coverage:
+    def __init__(self, coverage, f_executed, f_found):
+        self.coverage   = coverage
+        self.f_executed = f_executed
+        self.f_found    = f_found
+
+class Result:
+    def __init__(self, hits, ANR = False):
+        self.ANR        = ANR
+        self.died       = False
+        self.exception  = False
+        self.incomplete = False
+        self.vmcrash    = False
+        self.coverages  = { ('complete', True): Coverage(hits, hits, 100), ('boot', True): Coverage(hits / 2.0, hits / 2, 100) }
+
+def get_rows(md5sum, logdir, hits = 10, ANR = False):
+    methods = [ ('void com.foo.Main.m%d()' % i, False, i + 1) for i in xrange(hits) ]
+    return db.get_rows(logdir + '.apk', logdir, StaticAnalysis(md5sum, 'com.foo'), Result(hits, ANR), features.Features(), stamp = 'stamp', hits = methods)
+
+class MigrateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir   = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'test.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    ##
+    # Write a database of schema version <version>: only the Static, Dynamic
+    # and Ingested tables are filled
+    def write_old_database(self, version):
+        database = db.Database(self.filename)
+        database.close()
+
+        connection = sqlite3.connect(self.filename)
+        for md5sum, package_name, cc in [ ('a', 'com.foo', 50.0), ('b', 'com.bar', None) ]:
+            s = StaticAnalysis(md5sum, package_name)
+            connection.execute("INSERT INTO Static VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (md5sum, package_name, s.main_activity, str(s.activities), str(s.services), str(s.receivers), str(s.providers),
+                                str(s.actions), str(s.activityactions), str(s.categories)))
+            connection.execute("INSERT INTO Dynamic VALUES(?, 1, 0, 0, 0, 0, 10, 20, 5, 10, ?, ?)", (md5sum, cc, cc and cc / 2))
+        connection.execute("INSERT INTO Static(md5sum) VALUES('c')")
+        connection.execute("INSERT INTO Ingested VALUES('/logs/a', 'a', 'stamp')")
+        connection.execute("PRAGMA user_version = %d" % version)
+        connection.commit()
+        connection.close()
+
+    def test_migrate(self):
+        self.write_old_database(0)
+        database = db.Database(self.filename)
+
+        self.assertEqual(database.find('activities',      'com.foo.Main'),                       ['a'])
+        self.assertEqual(database.find('receivers',       'com.bar.Boot'),                       ['b'])
+        self.assertEqual(database.find('services',        'com.foo.Main'),                       [])
+        self.assertEqual(database.find('actions',         'android.intent.action.BOOT_COMPLETED'), ['a', 'b'])
+        self.assertEqual(database.find('activityactions', 'android.intent.action.MAIN'),         ['a', 'b'])
+        self.assertEqual(database.find('categories',      'android.intent.category.LAUNCHER'),   ['a', 'b'])
+        self.assertRaises(db.DatabaseError, database.find, 'permissions', 'android.permission.INTERNET')
+
+        self.assertEqual(database.get_coverage_summary('naive')['complete']['apps'],        1)
+        self.assertEqual(database.get_coverage_summary('naive')['complete']['ANR'],         1)
+        self.assertEqual(database.get_coverage_summary('conservative')['complete']['hits'], 10)
+        self.assertEqual(database.get_coverage_histogram('naive', 'complete'),              [ (50.0, 1) ])
+        self.assertEqual(database.get_ingested(), {})
+
+        database.execute("PRAGMA user_version")
+        self.assertEqual(database.cursor.fetchone()[0], db.SCHEMA_VERSION)
+        database.close()
+
+        # Migrating is done once
+        database = db.Database(self.filename)
+        self.assertEqual(database.find('actions', 'android.intent.action.BOOT_COMPLETED'), ['a', 'b'])
+        self.assertEqual(database.get_view_apps('naive'), 1)
+        database.close()
+
+    def test_migrate_version_1(self):
+        self.write_old_database(1)
+        database = db.Database(self.filename)
+
+        # The child tables are only filled by the migration to version 1
+        self.assertEqual(database.find('activities', 'com.foo.Main'), [])
+        self.assertEqual(database.get_view_apps('conservative'), 1)
+        database.close()
+
+class MethodTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir   = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'test.db')
+        self.database = db.Database(self.filename)
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.tmpdir)
+
+    def get_methods(self):
+        self.database.execute("SELECT signature, id, api FROM Method")
+        return dict( (signature, (method, api)) for signature, method, api in self.database.cursor.fetchall() )
+
+    def test_method_ids(self):
+        methods = [ ('void com.foo.Main.m%d()' % i, i % 3 == 0) for i in xrange(2 * db.METHOD_CHUNK + 10) ]
+        ids = self.database.get_method_ids(methods[:20])
+        self.assertEqual(len(ids), 20)
+
+        ids = self.database.get_method_ids(methods + methods[:5])
+        self.assertEqual(len(ids), len(methods))
+        self.assertEqual(self.get_methods(), dict( (signature, (ids[signature], int(api))) for signature, api in methods ))
+
+    def test_api_flag(self):
+        ids = self.database.get_method_ids([ ('void com.foo.Main.a()', False), ('void com.foo.Main.b()', True) ])
+        self.database.connection.commit()
+
+        # A flag that was stored wrong is corrected, by a writer with and
+        # without the method in its cache
+        self.database.get_method_ids([ ('void com.foo.Main.a()', True) ])
+        self.database.connection.commit()
+        self.assertEqual(self.get_methods()['void com.foo.Main.a()'], (ids['void com.foo.Main.a()'], 1))
+
+        database = db.Database(self.filename)
+        self.assertEqual(database.get_method_ids([ ('void com.foo.Main.b()', False) ]), { 'void com.foo.Main.b()': ids['void com.foo.Main.b()'] })
+        database.connection.commit()
+        database.close()
+        self.assertEqual(self.get_methods()['void com.foo.Main.b()'], (ids['void com.foo.Main.b()'], 0))
+
+    def test_hits(self):
+        hits = { 'a': [ ('a', 'void com.foo.Main.run()', False, 3), ('a', 'long java.lang.System.currentTimeMillis()', True, None) ],
+                 'b': [ ('b', 'void com.foo.Main.run()', False, 1) ] }
+        self.database.insert_hits(['a', 'b'], [ { 'MethodHit': hits['a'] }, { 'MethodHit': hits['b'] } ])
+        self.database.connection.commit()
+
+        self.assertEqual(self.database.get_method_apps('void com.foo.Main.run()'), [ ('a', 3), ('b', 1) ])
+        self.assertEqual(self.database.get_app_methods('a'), [ ('long java.lang.System.currentTimeMillis()', True, None), ('void com.foo.Main.run()', False, 3) ])
+        self.assertEqual(self.database.get_top_methods(1), [ ('void com.foo.Main.run()', 2, 4) ])
+        self.assertEqual(self.database.get_top_methods(api = True), [ ('long java.lang.System.currentTimeMillis()', 1, None) ])
+
+        # The hits of an app are replaced
+        self.database.insert_hits(['a'], [ { 'MethodHit': [ ('a', 'void com.foo.Main.stop()', False, 2) ] } ])
+        self.database.connection.commit()
+        self.assertEqual(self.database.get_app_methods('a'), [ ('void com.foo.Main.stop()', False, 2) ])
+        self.assertEqual(self.database.get_method_apps('void com.foo.Main.run()'), [ ('b', 1) ])
+
+class InsertManyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir   = tempfile.mkdtemp()
+        self.database = db.Database(os.path.join(self.tmpdir, 'test.db'))
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.tmpdir)
+
+    def count(self, table):
+        return self.database.connection.execute("SELECT COUNT(*) FROM " + table).fetchone()[0]
+
+    def test_duplicate_md5sums(self):
+        self.database.insert_many([ get_rows('a', '/logs/a.1', 10), get_rows('b', '/logs/b.1', 20), get_rows('a', '/logs/a.2', 30, ANR = True) ])
+
+        self.assertEqual(self.count('Package'), 2)
+        self.assertEqual(self.database.connection.execute("SELECT logbase FROM Package WHERE md5sum = 'a'").fetchone()[0], '/logs/a.2')
+        self.assertEqual(self.count('Coverage'), 4)
+        self.assertEqual(self.count('MethodHit'), 50)
+        self.assertEqual(self.count('Ingested'), 3)
+
+        summary = self.database.get_coverage_summary('naive')
+        self.assertEqual(summary['complete']['apps'], 2)
+        self.assertEqual(summary['complete']['hits'], 50)
+        self.assertEqual(summary['complete']['ANR'],  1)
+
+        self.database.rebuild_summaries()
+        self.assertEqual(self.database.get_coverage_summary('naive'), summary)
+
+    def test_replace(self):
+        self.database.insert_many([ get_rows('a', '/logs/a.1', 10) ])
+        self.database.insert_many([ get_rows('a', '/logs/a.2', 30), get_rows('a', '/logs/a.2', 30) ])
+
+        self.assertEqual(self.count('Coverage'),  2)
+        self.assertEqual(self.count('MethodHit'), 30)
+        self.assertEqual(self.database.get_coverage_summary('naive')['complete']['hits'], 30)
+        self.assertEqual(self.database.get_view_apps('naive'), 1)
+
+    def test_rollback(self):
+        self.database.insert_many([ get_rows('a', '/logs/a.1', 10) ])
+
+        bad = get_rows('b', '/logs/b.1', 20)
+        bad['Features'] = bad['Features'][:3]
+        self.assertRaises(db.DatabaseError, self.database.insert_many, [ get_rows('c', '/logs/c.1', 5), bad ])
+
+        self.assertEqual(self.count('Package'),   1)
+        self.assertEqual(self.count('Coverage'),  2)
+        self.assertEqual(self.count('MethodHit'), 10)
+        self.assertEqual(self.count('Method'),    10)
+        self.assertEqual(self.database.get_coverage_summary('naive')['complete']['apps'], 1)
+
+        # The method ID cache was rolled back as well
+        self.database.insert_many([ get_rows('c', '/logs/c.1', 15) ])
+        self.assertEqual(self.count('Method'),    15)
+        self.assertEqual(self.count('MethodHit'), 25)
+
+if __name__ == '__main__':
+    unittest.main()
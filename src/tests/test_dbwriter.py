@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+import os
+import time
+import shutil
+import socket
+import struct
+import cPickle
+import logging
+import tempfile
+import threading
+import unittest
+
+import db
+import dbwriter
+
+from test_db import get_rows
+
+class WriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir   = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'test.db')
+
+        logger = logging.getLogger('test_dbwriter')
+        logger.addHandler(logging.NullHandler())
+
+        self.writer = dbwriter.Writer(self.filename, logger = logger)
+        self.thread = threading.Thread(target = self.writer.serve)
+        self.thread.start()
+        while not self.writer.running: time.sleep(0.01)
+
+    def tearDown(self):
+        self.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def stop(self):
+        self.writer.stop()
+        self.thread.join()
+
+    def count(self, table):
+        database = db.Database(self.filename)
+        database.execute("SELECT COUNT(*) FROM " + table)
+        count = database.cursor.fetchone()[0]
+        database.close()
+        return count
+
+    def test_submit(self):
+        threads = [ threading.Thread(target = dbwriter.submit, args = (self.writer.address, get_rows(md5sum, '/logs/' + md5sum))) for md5sum in 'abcde' ]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        dbwriter.submit(self.writer.address, get_rows('a', '/logs/a.2', 20))
+
+        self.stop()
+        self.assertEqual(self.writer.committed, 6)
+        self.assertEqual(self.writer.failed,    0)
+        self.assertEqual(self.count('Package'),   5)
+        self.assertEqual(self.count('MethodHit'), 60)
+        self.assertEqual(self.count('Ingested'),  6)
+
+    def test_errors(self):
+        bad = get_rows('b', '/logs/b')
+        bad['Features'] = bad['Features'][:3]
+        self.assertRaises(db.DatabaseError, dbwriter.submit, self.writer.address, bad)
+        self.assertRaises(db.DatabaseError, dbwriter.submit, self.writer.address, ['not', 'rows'])
+        dbwriter.submit(self.writer.address, get_rows('a', '/logs/a'))
+
+        self.stop()
+        self.assertEqual(self.writer.committed, 1)
+        self.assertEqual(self.writer.failed,    1)
+        self.assertEqual(self.count('Package'), 1)
+
+    def test_stop_drains(self):
+        # A result that is still being received when the writer is stopped is
+        # stored and acknowledged
+        data = cPickle.dumps(get_rows('a', '/logs/a'), cPickle.HIGHEST_PROTOCOL)
+        connection = dbwriter.connect(self.writer.address)
+        connection.settimeout(10)
+        connection.sendall(struct.pack('!I', len(data)) + data[:10])
+        while not self.writer.receiving: time.sleep(0.01)
+
+        self.writer.stop()
+        while os.path.exists(self.writer.address): time.sleep(0.01)
+        self.assertRaises(socket.error, dbwriter.submit, self.writer.address, get_rows('b', '/logs/b'))
+
+        # Longer than the writer waits for the queue, so it would have exited
+        # if it did not wait for the receiver
+        time.sleep(1.5)
+        connection.sendall(data[10:])
+        self.assertEqual(dbwriter._recv(connection), ('ok', None))
+        connection.close()
+
+        self.thread.join()
+        self.assertEqual(self.count('Package'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
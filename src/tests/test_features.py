@@ -0,0 +1,258 @@
+#!/usr/bin/python
+
+import os
+import json
+import random
+import shutil
+import logging
+import tempfile
+import itertools
+import unittest
+
+import trace
+import features
+import tracedata
+
+##
+# The features that the if-chain of Features.get_features() enabled for a
+# traced call, before it was replaced by features.RULES
+def get_chain_features(function, api_classes):
+    enabled = set()
+    def enable(feature): enabled.add(feature)
+
+    target = function.target_object
+    name   = function.name
+
+    if target == 'android.telephony.TelephonyManager':
+        if name == 'getDeviceId':               enable('telephony_imei')
+        if name == 'getSubscriberId':           enable('telephony_imsi')
+        if name == 'getLine1Number':            enable('telephony_msisdn')
+        if name == 'getNetworkCountryIso':      enable('telephony_net_iso')
+        if name == 'getNetworkOperator':        enable('telephony_net_op')
+        if name == 'getNetworkOperatorName':    enable('telephony_net_op_name')
+        if name == 'getNetworkType':            enable('telephony_net_type')
+        if name == 'getSimSerialNumber':        enable('telephony_sim_serial')
+        if name == 'getSimOperator':            enable('telephony_sim_operator')
+        if name == 'getCallState':              enable('telephony_get_call_state')
+
+    if (   (target == 'android.telephony.SmsManager'     and name == 'sendTextMessage')
+        or (target == 'android.telephony.gsm.SmsManager' and name == 'sendTextMessage')): enable('telephony_sms')
+    if target.startswith('android.telephony.SmsMessage'):                                 enable('telephony_sms')
+
+    if target == 'android.net.ConnectivityManager':     enable('net_connect_manager')
+    if target == 'android.net.NetworkInfo':             enable('net_info')
+    if target == 'android.location.LocationManager':    enable('location')
+    if target == 'android.app.AlarmManager':            enable('misc_alarm')
+
+    if target == 'android.content.Intent'          and name == 'setAction': enable('content_intent')
+    if target == 'android.content.ContentResolver' and name == 'query':     enable('content_query')
+    if target == 'android.content.pm.Signature':                            enable('content_signature')
+    if name == 'getSystemService':      enable('content_get_service')
+    if name == 'getPackageManager':     enable('content_get_pmanager')
+    if name == 'getSharedPreferences':  enable('content_get_prefs')
+    if name == 'startService':          enable('content_start_service')
+    if name == 'openFileInput':         enable('io_fopen')
+    if name == 'openFileOutput':        enable('io_fopen')
+    if name == 'deleteFile':            enable('io_delete')
+
+    if target == 'android.provider.Settings$Secure' and name == 'getString' and ('java.lang.String', 'android_id') in function.parameters: enable('settings_android_id')
+
+    if target.startswith('android.database'): enable('io_database')
+
+    if target == 'android.os.Handler' and name in ('sendMessageAtTime', 'sendMessageDelayed', 'sendEmptyMessageAtTime',
+                                                   'sendEmptyMessageDelayed', 'postAtTime', 'postDelayed'): enable('misc_handler')
+
+    if target == 'java.security.MessageDigest' and name == 'digest':        enable('misc_digest')
+    if target == 'java.util.Timer':                                         enable('misc_schedule')
+    if target == 'java.lang.Thread'            and name == 'sleep':         enable('misc_sleep')
+    if target == 'java.util.Locale':                                        enable('misc_locale')
+    if target == 'java.io.File'                and name == 'exists':        enable('io_fexists')
+    if target == 'java.lang.Runtime'           and name == 'exec':          enable('io_exec')
+    if target == 'java.lang.ClassLoader'       and name == 'loadClass' and function.parameters[0][1] not in api_classes:
+                                                                            enable('misc_classloader')
+    if target == 'java.lang.System'            and name == 'loadLibrary':   enable('misc_classloader')
+    if target == 'java.net.HttpURLConnection'  and name == 'connect':       enable('network_http')
+    if target.startswith('org.apache.http'):                                enable('network_http')
+    if target.startswith('java.net'):                                       enable('network')
+    if target.startswith('javax.crypto'):                                   enable('misc_crypto')
+    if target.startswith('java.lang.reflect'):                              enable('misc_reflection')
+    if target.startswith('java.io.File'):                                   enable('io_file')
+    if target.startswith('java.util.zip'):                                  enable('misc_zip')
+
+    if 'native' in function.modifiers and not function.is_api:              enable('misc_native')
+
+    return enabled
+
+def get_table_features(table, function, api_classes):
+    return set( feature for feature, predicate in table.match(function.target_object, function.name)
+                if predicate is None or predicate(function, api_classes) )
+
+class RuleTableTest(unittest.TestCase):
+    def test_chain_parity(self):
+        api_classes = set(['java.lang.String', 'com.foo.Api'])
+
+        # Every class and method of the rules, and names around them
+        classes = set(['com.foo.Main', 'java.io.FileInputStream', 'java.netx.Y', 'android'])
+        methods = set(['foo'])
+        for feature, class_name, method, predicate, values in features.RULES:
+            if class_name:
+                prefix = class_name.rstrip('*')
+                classes.update([ prefix, prefix + 'Foo', prefix[:-1] ])
+            if method and method != '<init>': methods.add(method)
+
+        parameters = [ [('java.lang.String', 'android_id')], [('java.lang.String', 'com.foo.Api')], [('java.lang.String', 'com.foo.Main')] ]
+        modifiers  = [ ['public'], ['public', 'native'] ]
+
+        table = features.RuleTable()
+        for class_name, method, p, m, is_api in itertools.product(sorted(classes), sorted(methods), parameters, modifiers, (True, False)):
+            function = trace.Function()
+            function.target_object = class_name
+            function.name          = method
+            function.parameters    = p
+            function.modifiers     = m
+            function.is_api        = is_api
+
+            self.assertEqual(get_table_features(table, function, api_classes), get_chain_features(function, api_classes),
+                             '%s.%s %s %s %s' % (class_name, method, p, m, is_api))
+
+    def test_constructors(self):
+        table = features.RuleTable()
+        self.assertEqual([ feature for feature, predicate in table.match_constructor('java.io.File') ], ['io_fopen'])
+        self.assertEqual(table.match_constructor('java.io.FileInputStream'), [])
+        self.assertEqual(table.match_constructor('java.util.Timer'),         [])
+
+ABSTRACTS = ['public abstract class java.security.cert.Certificate extends java.lang.Object implements java.io.Serializable{',
+             'public abstract byte[] getEncoded()       throws java.security.cert.CertificateEncodingException;',
+             'public abstract void verify(java.security.PublicKey, java.lang.String)       throws java.security.cert.CertificateException;',
+             'public abstract java.lang.String toString();',
+             'protected abstract void onDraw(android.graphics.Canvas);',
+             'public static abstract void tick(int);',
+             'abstract int size();',
+             'public abstract interface boolean onPreferenceClick(android.preference.Preference);']
+
+##
+# The scan over all .abstracts lines that Features used before
+# features.index_abstracts()
+def is_abstract_scan(function, abstracts):
+    name = "%s abstract %s %s(%s)" % (" ".join(function.modifiers), function.return_type, function.name, ", ".join([x[0] for x in function.parameters]) )
+    return any(name in s for s in abstracts)
+
+##
+# Functions with the modifiers, return type, name and parameters of the
+# abstract methods in <abstracts>, and variations of them. Features only looks
+# up functions with modifiers.
+def get_abstract_functions(abstracts, rnd, number):
+    parts = []
+    for line in abstracts:
+        modifiers, sep, rest = line.partition('abstract ')
+        if not sep or '(' not in rest: continue
+        return_type, name = rest.split('(')[0].split()[-2:]
+        parameters = [ x for x in rest.split('(')[1].split(')')[0].split(', ') if x ]
+        parts.append( (modifiers.split(), return_type, name, parameters) )
+
+    functions = []
+    for i in xrange(number):
+        modifiers, return_type, name, parameters = rnd.choice(parts)
+        modifiers = rnd.choice([ modifiers, modifiers[1:], ['public'], ['protected'], ['private', 'static'] ])
+        if not modifiers: modifiers = ['public']
+        if rnd.random() < 0.2: return_type = rnd.choice(parts)[1]
+        if rnd.random() < 0.2: name        = rnd.choice(parts)[2]
+        if rnd.random() < 0.2: parameters  = rnd.choice(parts)[3]
+
+        function = trace.Function()
+        function.modifiers   = modifiers
+        function.return_type = return_type
+        function.name        = name
+        function.parameters  = [ (x, 'null') for x in parameters ]
+        functions.append(function)
+    return functions
+
+class AbstractsIndexTest(unittest.TestCase):
+    def check_index(self, abstracts, number):
+        index = features.index_abstracts(abstracts)
+        for function in get_abstract_functions(abstracts, random.Random(1), number):
+            name = features.get_abstract_signature(function.modifiers, function.return_type, function.name, [x[0] for x in function.parameters])
+            self.assertEqual(name in index, is_abstract_scan(function, abstracts), name)
+
+    def test_index_matches_scan(self):
+        self.check_index(ABSTRACTS, 2000)
+
+    def test_sdk_abstracts(self):
+        abstracts = os.path.join(os.path.dirname(__file__), '..', '..', 'lib', 'android', 'apis', 'android-support-v4.jar.abstracts')
+        if not os.path.exists(abstracts): self.skipTest('%s not found' % abstracts)
+
+        f = open(abstracts)
+        lines = [ line.strip() for line in f ]
+        f.close()
+        self.check_index(lines[1:], 2000)
+
+class FeatureAccumulatorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.logdir = tracedata.write_logdir(self.tmpdir)
+        self.logger = logging.getLogger('test_features')
+        self.logger.addHandler(logging.NullHandler())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_features(self, budget):
+        fs = features.Features()
+        fs.get_features(trace.load_dir(self.logdir, tracedata.API_CLASSES, self.logger), tracedata.API_CLASSES, 'com.foo', budget)
+        return fs.get_dict()
+
+    def get_dir_features(self, budget):
+        fs = features.Features()
+        fs.get_dir_features(self.logdir, tracedata.API_CLASSES, 'com.foo', self.logger, budget)
+        return fs.get_dict()
+
+    def test_streaming_matches_lists(self):
+        expected = self.get_features(None)
+        for feature in ['telephony_imei', 'settings_android_id', 'io_fopen', 'misc_reflection']:
+            self.assertTrue(expected[feature], feature)
+        self.assertTrue(expected['average'])
+
+        self.assertEqual(self.get_dir_features(None), expected)
+        self.assertEqual(self.get_dir_features(512),  expected)
+        self.assertEqual(self.get_features(512),      expected)
+
+    def test_summary_features(self):
+        summary = os.path.join(self.tmpdir, features.SUMMARY_FILENAME)
+        rows    = None
+        for budget in [None, 512]:
+            fs = features.Features()
+            fs.get_dir_features(self.logdir, tracedata.API_CLASSES, 'com.foo', self.logger, budget, summary = summary)
+            expected = fs.get_dict()
+
+            fs = features.Features()
+            fs.get_summary_features(summary, tracedata.API_CLASSES, 'com.foo', budget)
+            self.assertEqual(fs.get_dict(), expected)
+
+            if rows is None: rows = sorted(features.read_summary(summary))
+            self.assertEqual(sorted(features.read_summary(summary)), rows)
+
+        # Only the values that the rule predicates read are kept
+        values = [ (key[4], key[5], v) for key, count in rows for t, v in key[6] if v is not None ]
+        self.assertEqual(values, [ ('android.provider.Settings$Secure', 'getString', 'android_id') ])
+
+    def test_summary_values(self):
+        def call(class_name, name, value):
+            function = trace.Function()
+            function.modifiers     = ['public']
+            function.return_type   = 'java.lang.Class'
+            function.target_object = class_name
+            function.name          = name
+            function.parameters    = [ ('java.lang.String', value) ]
+            function.is_api        = True
+            return function
+
+        accumulator = features.FeatureAccumulator(features.Features(), tracedata.API_CLASSES, summarize = True)
+        accumulator.add( call('java.lang.ClassLoader', 'loadClass', 'com.foo.Plugin') )
+        accumulator.add( call('java.lang.Class',       'forName',   'com.foo.Plugin') )
+
+        keys = sorted([ json.loads(key) for key in accumulator.calls ])
+        self.assertEqual([ (key[4], key[6]) for key in keys ], [ ('java.lang.Class',       [ ['java.lang.String', None] ]),
+                                                                 ('java.lang.ClassLoader', [ ['java.lang.String', 'com.foo.Plugin'] ]) ])
+
+if __name__ == '__main__':
+    unittest.main()
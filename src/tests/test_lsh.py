@@ -0,0 +1,80 @@
+#!/usr/bin/python
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import lsh
+
+def random_bloom(rnd, bits = 200):
+    bloom = 0
+    for i in xrange(bits):
+        bloom |= 1 << rnd.randrange(lsh.BLOOM_SIZE)
+    return bloom
+
+# A bloom that shares most of its bits with <bloom>
+def mutate(rnd, bloom, flips = 10):
+    for i in xrange(flips):
+        bloom ^= 1 << rnd.randrange(lsh.BLOOM_SIZE)
+    return bloom
+
+class LSHIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+        rnd = random.Random(1)
+        self.index  = lsh.LSHIndex()
+        self.blooms = [ random_bloom(rnd) for i in xrange(50) ]
+        for i, bloom in enumerate(self.blooms):
+            self.index.add('%032x' % i, '/logs/app%d' % i, bloom)
+        self.queries = [ mutate(rnd, bloom) for bloom in self.blooms[:10] ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_signature(self):
+        for bloom in self.blooms[:5] + [1, 1 << (lsh.BLOOM_SIZE - 1)]:
+            positions = [ p for p in xrange(lsh.BLOOM_SIZE) if bloom >> p & 1 ]
+            expected  = [ min([ order.index(p) for p in positions ]) for order in self.index.orders ]
+            self.assertEqual(self.index.get_signature(bloom), tuple(expected))
+
+    def test_query(self):
+        self.assertFalse(self.index.add('0' * 32, '/logs/empty', 0))
+        self.assertEqual(len(self.index), 50)
+        self.assertEqual(self.index.query(0), [])
+
+        for i, bloom in enumerate(self.queries):
+            exact = self.index.query(bloom, k = 5, exhaustive = True)
+            self.assertEqual(exact, sorted(exact, reverse = True))
+            self.assertEqual(exact[0][1:], ('%032x' % i, '/logs/app%d' % i))
+            self.assertEqual(exact[0][0], lsh.get_similarity(bloom, self.blooms[i]))
+
+            self.assertEqual(self.index.query(bloom, k = 1), exact[:1])
+            self.assertNotEqual(self.index.query(bloom, k = 1, exclude = '%032x' % i)[:1], exact[:1])
+
+    def test_dump_load(self):
+        filename = os.path.join(self.tmpdir, 'lsh.gz')
+        self.index.dump(filename)
+
+        index = lsh.LSHIndex.load(filename)
+        self.assertEqual(index.keys,       self.index.keys)
+        self.assertEqual(index.blooms,     self.index.blooms)
+        self.assertEqual(index.signatures, self.index.signatures)
+        self.assertEqual(index.buckets,    self.index.buckets)
+        self.assertEqual(index.md5sums,    self.index.md5sums)
+        for bloom in self.queries:
+            self.assertEqual(index.query(bloom), self.index.query(bloom))
+
+    def test_load_other_parameters(self):
+        filename = os.path.join(self.tmpdir, 'lsh.gz')
+        self.index.dump(filename)
+
+        index = lsh.LSHIndex.load(filename, bands = 8, rows = 2, seed = 7)
+        fresh = lsh.LSHIndex(bands = 8, rows = 2, seed = 7)
+        self.assertEqual(index.signatures, [ fresh.get_signature(bloom) for bloom in self.blooms ])
+        self.assertEqual(len(index.signatures[0]), 16)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import sdk
+import trace
+
+def make_function(target_object, name, parameters = [], return_type = 'void'):
+    function = trace.Function()
+    function.target_object = target_object
+    function.name          = name
+    function.parameters    = list(parameters)
+    function.return_type   = return_type
+    return function
+
+# Methods of a class that implements the same methods as com.ads.Banner
+def banner_methods(class_name):
+    return [ make_function(class_name, 'load', ['java.lang.String']), make_function(class_name, 'show'),
+             make_function(class_name, 'hide'), make_function(class_name, 'setListener', [class_name + 'Listener']),
+             make_function(class_name, '<init>', ['android.content.Context']) ]
+
+def get_signatures(functions):
+    return [ sdk.get_method_signature(f.return_type, f.name, f.parameters) for f in functions ]
+
+class LibraryIndexTest(unittest.TestCase):
+    def setUp(self):
+        # android-support-v13 bundles all of android-support-v4
+        self.index = sdk.LibraryIndex()
+        for jar in ['android-support-v13', 'android-support-v4']:
+            self.index.add_package('android.support.v4.app', jar)
+            self.index.add_package('android.support.v4.view', jar)
+        self.index.add_package('android.support.v13.app', 'android-support-v13')
+        self.index.add_package('com.ads', 'ads-sdk')
+        self.index.add_package('com', 'too-broad')
+        self.index.add_hash(sdk.get_class_hash(get_signatures(banner_methods('com.ads.Banner'))), 'ads-sdk')
+
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lookup_prefix(self):
+        self.assertEqual(self.index.lookup('com.ads.Banner'),           'ads-sdk')
+        self.assertEqual(self.index.lookup('com.ads.internal.Request'), 'ads-sdk')
+        self.assertEqual(self.index.lookup('com.adsx.Banner'),          None)
+        self.assertEqual(self.index.lookup('com.foo.Main'),             None)
+
+    def test_most_specific_library(self):
+        for jars in [['android-support-v13', 'android-support-v4'], ['android-support-v4', 'android-support-v13']]:
+            index = sdk.LibraryIndex()
+            for jar in jars:
+                index.add_package('android.support.v4.app', jar)
+            index.add_package('android.support.v13.app', 'android-support-v13')
+            self.assertEqual(index.lookup('android.support.v4.app.Fragment'),  'android-support-v4')
+            self.assertEqual(index.lookup('android.support.v13.app.Fragment'), 'android-support-v13')
+
+        self.assertEqual(self.index.get_conflicts(), [ ('android.support.v4.app',  ['android-support-v13', 'android-support-v4']),
+                                                       ('android.support.v4.view', ['android-support-v13', 'android-support-v4']) ])
+
+    def test_classify(self):
+        functions = (banner_methods('com.ads.Banner') + banner_methods('a.b.c') + banner_methods('a.b.d')[:2] +
+                     [ make_function('android.support.v4.app.Fragment', 'onCreate'), make_function('com.foo.Main', 'onCreate') ])
+        self.assertEqual(self.index.classify(functions), { 'com.ads.Banner': 'ads-sdk', 'a.b.c': 'ads-sdk',
+                                                           'android.support.v4.app.Fragment': 'android-support-v4' })
+
+    def test_dump_load(self):
+        self.index.jars.append( ('ads-sdk.jar', '0' * 32) )
+        filename = os.path.join(self.tmpdir, 'libraries.index')
+        self.index.dump(filename)
+
+        index = sdk.LibraryIndex.load(filename)
+        self.assertEqual(index.version,  sdk.INDEX_VERSION)
+        self.assertEqual(index.jars,     self.index.jars)
+        self.assertEqual(index.trie,     self.index.trie)
+        self.assertEqual(index.hashes,   self.index.hashes)
+        self.assertEqual(index.packages, self.index.packages)
+
+    def test_stale_index_is_rebuilt(self):
+        filename = os.path.join(self.tmpdir, 'libraries.index')
+        f = open(filename, 'w')
+        f.write('P\tcom.ads\tads-sdk\n')
+        f.close()
+
+        index = sdk.load_index([], filename)
+        self.assertEqual(index.trie, {})
+        self.assertEqual(sdk.LibraryIndex.load(filename).version, sdk.INDEX_VERSION)
+
+if __name__ == '__main__':
+    unittest.main()
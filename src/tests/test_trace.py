@@ -0,0 +1,235 @@
+#!/usr/bin/python
+
+import os
+import random
+import shutil
+import logging
+import tempfile
+import unittest
+
+from collections import Counter
+
+import trace
+import tracedata
+
+def get_edges(traces):
+    edges = Counter()
+    for key, traced in traces.iteritems():
+        for function in traced.functions:
+            caller = function.called_by
+            if caller is None:                     label = '<root>'
+            elif isinstance(caller, trace.Function): label = '%s.%s' % (caller.target_object, caller.name)
+            else:                                  label = '%s.<init>' % caller.class_name
+            edges[ (key, label, function.target_object + '.' + function.name) ] += function.count
+    return edges
+
+class Handler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(record.getMessage())
+
+class ErrorSummaryTest(unittest.TestCase):
+    def test_aggregate(self):
+        errors = trace.ErrorSummary(samples = 2)
+        self.assertFalse(errors)
+        for i in xrange(5): errors.add('regex failed', 'line %d' % i)
+        errors.add('no return', 'return')
+
+        self.assertTrue(errors)
+        self.assertEqual(errors.total(), 6)
+        self.assertEqual(errors.counts, Counter({'regex failed': 5, 'no return': 1}))
+        self.assertEqual(errors.examples['regex failed'], ['line 0', 'line 1'])
+
+    def test_report(self):
+        handler = Handler()
+        logger  = logging.getLogger('test.errors')
+        logger.addHandler(handler)
+
+        trace.ErrorSummary().report(logger, 'Could not parse lines')
+        self.assertEqual(handler.lines, [])
+
+        errors = trace.ErrorSummary(samples = 1)
+        errors.add('regex failed', 'line 1')
+        errors.add('regex failed', 'line 2')
+        errors.add('no return',    'return')
+        errors.report(logger, 'Could not parse lines')
+        logger.removeHandler(handler)
+
+        self.assertEqual([ line.split(None, 2)[2].strip() for line in handler.lines ],
+                         ['Could not parse lines: 3', '2x regex failed', 'line 1', '1x no return', 'return'])
+
+    def test_parse_errors(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'dump.1.1')
+            tracedata.write_trace(filename)
+
+            traced = trace.Trace(api_classes = tracedata.API_CLASSES, logger = logging.getLogger('test'))
+            traced._parse_file_fast(filename, ignore_timestamps = True)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertEqual(traced.errors.total(), 2)
+        self.assertEqual(sorted(sum(traced.errors.examples.values(), [])),
+                         ['garbage line that cannot ( be parsed', 'public void com.foo.Trunc'])
+
+CCT_TRACE = """1000: public void com.foo.A("com.foo.A@1").a()
+1010:  public void com.foo.B("com.foo.B@1").b()
+1030:  return (void) ""
+1040:  public void com.foo.B("com.foo.B@1").b()
+1045:  return (void) ""
+1050:  new com.foo.C()
+1060:  return (com.foo.C) "com.foo.C@2"
+1100: return (void) ""
+2000: public void com.foo.B("com.foo.B@1").b()
+2003: return (void) ""
+"""
+
+class CallingContextTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        f = open(os.path.join(self.tmpdir, 'dump.1.1'), 'w')
+        f.write(CCT_TRACE)
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_nodes(self, cct):
+        return dict( (path, (node.count, node.inclusive, node.exclusive)) for path, node in cct.root.walk() if path )
+
+    def test_times(self):
+        cct = trace.load_cct(self.tmpdir, tracedata.API_CLASSES, logging.getLogger('test'))
+        self.assertEqual(self.get_nodes(cct), { ('com.foo.A.a', ):                   (1, 100, 65),
+                                                ('com.foo.A.a', 'com.foo.B.b'):      (2,  25, 25),
+                                                ('com.foo.A.a', 'com.foo.C.<init>'): (1,  10, 10),
+                                                ('com.foo.B.b', ):                   (1,   3,  3) })
+
+    def test_dump_load_merge(self):
+        cct      = trace.load_cct(self.tmpdir, tracedata.API_CLASSES, logging.getLogger('test'))
+        filename = os.path.join(self.tmpdir, 'cct.txt')
+        cct.dump(filename)
+
+        loaded = trace.CallingContextTree.load(filename)
+        self.assertEqual(self.get_nodes(loaded), self.get_nodes(cct))
+
+        merged = trace.CallingContextTree.load(filename).merge(loaded)
+        self.assertEqual(self.get_nodes(merged), dict( (path, tuple(2 * x for x in value)) for path, value in self.get_nodes(cct).iteritems() ))
+
+class ReflectionTest(unittest.TestCase):
+    def setUp(self):
+        self.traced = trace.Trace(api_classes = tracedata.API_CLASSES, logger = logging.getLogger('test'))
+
+    def test_full_parser(self):
+        calls = [ self.traced._parse_enter(tracedata.INVOKE % i, i + 1, 1000 + i, 1) for i in xrange(3) ]
+
+        self.assertEqual(len(self.traced.reflected_cache), 1)
+        for i, call in enumerate(calls):
+            reflected = call.reflected_method
+            self.assertEqual( (reflected.target_object, reflected.name, reflected.return_type), ('com.foo.Hidden', 'run', 'void') )
+            self.assertEqual(reflected.parameters, [('java.lang.String', 'x'), ('int', str(i))])
+            self.assertEqual(reflected.timestamp_enter, 1000 + i)
+            self.assertFalse(reflected.is_api)
+
+    def test_fast_parser(self):
+        function = self.traced._parse_enter_fast(tracedata.INVOKE % 0, 1000)
+        self.assertEqual(function.get_signature_key(), 'void com.foo.Hidden.run(java.lang.String,int)')
+
+        # The parameters of a resolved call are its own
+        function.parameters.append('long')
+        again = self.traced._parse_enter_fast(tracedata.INVOKE % 1, 1001)
+        self.assertEqual(again.parameters, ['java.lang.String', 'int'])
+        self.assertEqual(len(self.traced.reflected_cache), 1)
+
+    def test_unparsable(self):
+        line = 'public java.lang.Object java.lang.reflect.Method("garbage").invoke((java.lang.Object) "null", (java.lang.Object[]) "[]")'
+        self.assertEqual(self.traced._parse_enter(line, 1, 1000, 1).reflected_method, None)
+        self.assertEqual(self.traced._parse_enter_fast(line, 1000).target_object, 'java.lang.reflect.Method')
+        self.assertEqual(self.traced.reflected_cache, {'garbage': None})
+
+class SpillSetTest(unittest.TestCase):
+    def test_merge(self):
+        random.seed(1)
+        expected = Counter()
+        spillset = trace.SpillSet(budget = 10 * (8 + trace.SPILL_ENTRY_OVERHEAD))
+        for i in xrange(1000):
+            key   = 'key%05d' % random.randint(0, 200)
+            count = random.randint(1, 3)
+            spillset.add(key, count)
+            expected[key] += count
+
+        self.assertTrue(len(spillset.runs) > 1)
+        self.assertEqual(list(spillset), sorted(expected.items()))
+        spillset.close()
+
+    def test_dedup_across_spills(self):
+        spillset = trace.SpillSet(budget = 1 << 20)
+        spillset.add('b', 1)
+        spillset.add('a', 2)
+        spillset.spill()
+        spillset.add('a', 3)
+        spillset.add('c', 1)
+        spillset.spill()
+        spillset.add('b', 4)
+
+        self.assertEqual(len(spillset.runs), 2)
+        self.assertEqual(list(spillset.iteritems()), [ ('a', 5), ('b', 5), ('c', 1) ])
+        spillset.close()
+
+    def test_max_runs(self):
+        expected = Counter()
+        spillset = trace.SpillSet(budget = 1, max_runs = 4)
+        for i in xrange(50):
+            key = 'key%02d' % (i % 7)
+            spillset.add(key, i)
+            expected[key] += i
+            self.assertTrue(len(spillset.runs) < 4)
+
+        self.assertEqual(list(spillset), sorted(expected.items()))
+        spillset.close()
+
+    def test_empty(self):
+        spillset = trace.SpillSet(budget = 1 << 20)
+        self.assertFalse(spillset)
+        spillset.spill()
+        self.assertEqual(list(spillset), [])
+
+        spillset.add('a')
+        spillset.spill()
+        self.assertTrue(spillset)
+
+        spillset.close()
+        self.assertFalse(spillset)
+
+class CompressTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.logdir = tracedata.write_logdir(self.tmpdir)
+        self.logger = logging.getLogger('test')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_callgraph(self):
+        plain      = trace.load_dir(self.logdir, tracedata.API_CLASSES, self.logger, compress = False)
+        compressed = trace.load_dir(self.logdir, tracedata.API_CLASSES, self.logger, compress = True)
+
+        self.assertEqual(get_edges(compressed), get_edges(plain))
+        for key in plain:
+            self.assertEqual(compressed[key].get_function_names(),    plain[key].get_function_names())
+            self.assertEqual(compressed[key].get_constructor_names(), plain[key].get_constructor_names())
+            self.assertTrue(len(compressed[key].functions) < len(plain[key].functions))
+
+    # onDraw() calls that differ in the parameter of a callee are not merged
+    def test_different_subtrees(self):
+        traced = trace.load_dir(self.logdir, tracedata.API_CLASSES, self.logger, compress = True)[ (123, 1) ]
+        ticks  = Counter()
+        for function in traced.functions:
+            if function.name == 'tick': ticks[ function.parameters[0][1] ] += function.count
+        self.assertEqual(ticks, Counter({'3': 20, '0': 7, '1': 7, '2': 6}))
+
+if __name__ == '__main__':
+    unittest.main()
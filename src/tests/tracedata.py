@@ -0,0 +1,75 @@
+#!/usr/bin/python
+
+import os
+
+# Synthetic method traces in the format of the TraceDroid VM, for the tests
+
+API_CLASSES = set(['android.telephony.TelephonyManager', 'android.provider.Settings$Secure', 'android.os.Handler',
+                   'java.io.File', 'java.lang.System', 'java.lang.String', 'java.lang.Object', 'java.lang.reflect.Method'])
+
+ONCREATE   = 'public void com.foo.Main("com.foo.Main@1").onCreate((android.os.Bundle) "null")'
+DEVICE_ID  = 'public java.lang.String android.telephony.TelephonyManager("android.telephony.TelephonyManager@2").getDeviceId()'
+FILE       = 'new java.io.File((java.lang.String) "/sdcard/x")'
+ANDROID_ID = 'public static java.lang.String android.provider.Settings$Secure.getString((android.content.ContentResolver) "cr@1", (java.lang.String) "android_id")'
+INVOKE     = 'public java.lang.Object java.lang.reflect.Method("public void com.foo.Hidden.run(java.lang.String,int)").invoke((java.lang.Object) "com.foo.Hidden@9", (java.lang.Object[]) "[x, %d]")'
+RUN        = 'public void com.foo.Hidden("com.foo.Hidden@9").run((java.lang.String) "x", (int) "%d")'
+ONDRAW     = 'public void com.foo.Main("com.foo.Main@1").onDraw((android.graphics.Canvas) "c@1")'
+POST       = 'public void android.os.Handler("Handler (abc)").postDelayed((java.lang.Runnable) "com.foo.Main$1@4", (long) "100")'
+TICK       = 'private int com.foo.Util.tick((int) "%d")'
+MILLIS     = 'public static long java.lang.System.currentTimeMillis()'
+NATIVE     = 'public native int com.foo.Native("com.foo.Native@3").doIt()'
+
+class Writer:
+    def __init__(self, filename):
+        self.f    = open(filename, 'w')
+        self.time = 1000000
+
+    def line(self, depth, line, step = 10):
+        self.time += step
+        self.f.write('%d: %s%s\n' % (self.time, ' ' * depth, line))
+
+    def call(self, depth, line, ret, body = None):
+        self.line(depth, line)
+        if body: body(depth + 1)
+        self.line(depth, ret)
+
+    def close(self):
+        self.f.close()
+
+##
+# Write a trace with hot loops (<loops> identical onDraw() calls, then calls
+# that differ in a parameter value), reflection, a constructor, a line that
+# cannot be parsed and a truncated last line.
+def write_trace(filename, loops = 20):
+    w = Writer(filename)
+
+    def loop(d, i):
+        w.call(d, POST, 'return (boolean) "true"')
+        w.call(d, TICK % i, 'return (int) "4"', lambda d2: w.call(d2, MILLIS, 'return (long) "1"'))
+
+    w.line(0, ONCREATE)
+    w.call(1, DEVICE_ID,  'return (java.lang.String) "000000000000000"')
+    w.call(1, FILE,       'return (java.io.File) "/sdcard/x"')
+    w.call(1, ANDROID_ID, 'return (java.lang.String) "x"')
+    for i in xrange(3):
+        w.call(1, INVOKE % i, 'return (java.lang.Object) "null"', lambda d: w.call(d, RUN % i, 'return (void) ""'))
+    for i in xrange(loops):
+        w.call(1, ONDRAW, 'return (void) ""', lambda d: loop(d, 3))
+    for i in xrange(loops):
+        w.call(1, ONDRAW, 'return (void) ""', lambda d: loop(d, i % 3))
+    w.call(1, NATIVE, 'return (int) "1"')
+    w.line(1, 'garbage line that cannot ( be parsed')
+    w.line(0, 'return (void) ""')
+    w.f.write('12345: public void com.foo.Trunc')
+    w.close()
+
+##
+# Write a log directory with a trace of the main thread and one of another
+# thread in a subdirectory
+# @return   Path of the log directory
+def write_logdir(parent, loops = 20):
+    logdir = os.path.join(parent, 'app.apk.2013-01-01.00.00.00.000000')
+    os.makedirs(os.path.join(logdir, 'main'))
+    write_trace(os.path.join(logdir, 'dump.123.1'),         loops)
+    write_trace(os.path.join(logdir, 'main', 'dump.123.2'), loops / 2)
+    return logdir
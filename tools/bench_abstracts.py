@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+
+import trace
+import features
+
+#######################################################
+# Benchmark of the abstract method lookup in Features.get_features
+#
+# Compares the substring scan over all .abstracts lines that
+# _get_target_functions used to do with the signature index of
+# features.index_abstracts(), on the traced functions of a log directory or on
+# a synthetic trace. Both methods must agree on every function.
+#
+# The scan is O(functions x abstracts) and is therefore only run on a sample of
+# the functions (--sample) and extrapolated.
+
+def get_logger():
+    logging.basicConfig(format = '%(message)s')
+    return logging.getLogger('bench')
+
+##
+# Generate <n> traced functions. About a third of them implement an abstract
+# method from <abstracts>, the others are app methods.
+def get_synthetic_functions(abstracts, n):
+    signatures = []
+    for line in abstracts:
+        modifiers, sep, rest = line.partition('abstract ')
+        if not sep or rest.startswith('class ') or '(' not in rest: continue
+        # get_features only looks at functions with modifiers
+        if not modifiers.split(): continue
+        return_type, _, rest = rest.partition(' ')
+        name, _, parameters = rest.partition('(')
+        parameters = [ x for x in parameters.split(')')[0].split(', ') if x ]
+        signatures.append( (modifiers.split(), return_type, name, parameters) )
+
+    functions = []
+    for i in xrange(n):
+        f = trace.Function()
+        if signatures and random.random() < 0.33:
+            modifiers, f.return_type, f.name, parameters = random.choice(signatures)
+            f.modifiers = list(modifiers)
+        else:
+            f.modifiers   = ['public']
+            f.return_type = random.choice(['void', 'int', 'java.lang.String'])
+            f.name        = 'method%d' % random.randint(0, n)
+            parameters    = random.choice([ [], ['int'], ['java.lang.String', 'int'] ])
+        f.parameters = [ (x, 'value') for x in parameters ]
+        functions.append(f)
+    return functions
+
+def get_traced_functions(logdir, logger):
+    functions = []
+    for key, value in trace.iter_dir(logdir, trace.load_api([features.API]), logger, fields = ['parameters']):
+        functions += [ f for f in value.functions if f.modifiers and f.return_type and f.name ]
+    return functions
+
+def scan(functions, abstracts):
+    result = []
+    for f in functions:
+        name = "%s abstract %s %s(%s)" % (" ".join(f.modifiers), f.return_type, f.name, ", ".join([x[0] for x in f.parameters]) )
+        result.append( any(name in s for s in abstracts) )
+    return result
+
+def lookup(functions, index):
+    result = []
+    for f in functions:
+        name = features.get_abstract_signature(f.modifiers, f.return_type, f.name, [x[0] for x in f.parameters])
+        result.append( name in index )
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the abstract method lookup of the features script')
+    parser.add_argument('--logdir',   action = 'store', required = False, default = None,          help = 'Log directory with method traces (default: synthetic trace)')
+    parser.add_argument('--functions',action = 'store', required = False, default = 200000, type = int, help = 'Number of functions in the synthetic trace')
+    parser.add_argument('--sample',   action = 'store', required = False, default = 2000,   type = int, help = 'Number of functions to run the substring scan on')
+
+    args = parser.parse_args()
+    random.seed(0)
+
+    t = time.time()
+    abstracts = features.load_abstracts([features.API] + features.get_sdk_jars())
+    print 'loaded %d abstracts lines in %.3fs' % (len(abstracts), time.time() - t)
+
+    if args.logdir:
+        if not os.path.exists(args.logdir):
+            print "Logdir %s does not exist" % args.logdir
+            sys.exit()
+        functions = get_traced_functions(args.logdir, get_logger())
+    else:
+        functions = get_synthetic_functions(abstracts, args.functions)
+    print '%d traced functions' % len(functions)
+
+    if not functions:
+        print 'no traced functions found'
+        sys.exit()
+
+    t = time.time()
+    index = features.index_abstracts(abstracts)
+    t_index = time.time() - t
+
+    t = time.time()
+    found = lookup(functions, index)
+    t_lookup = time.time() - t
+
+    sample = functions[:args.sample]
+    t = time.time()
+    found_scan = scan(sample, abstracts)
+    t_scan = (time.time() - t) * len(functions) / len(sample)
+
+    mismatches = len([ i for i in xrange(len(sample)) if found[i] != found_scan[i] ])
+
+    print 'index:  %8.3fs to build (%d signatures), %8.3fs for all functions' % (t_index, len(index), t_lookup)
+    print 'scan:   %8.3fs for all functions (extrapolated from %d)' % (t_scan, len(sample))
+    print 'speedup: %.0fx, abstract implementations: %d, mismatches in sample: %d' % (t_scan / max(t_index + t_lookup, 1e-9), sum(found), mismatches)
+
+if __name__ == '__main__':
+    main()
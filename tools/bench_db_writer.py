@@ -0,0 +1,189 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import signal
+import random
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+
+import db
+import static
+import dbwriter
+import features
+
+from dynamic import SIMULATIONS
+
+#######################################################
+# Load test of the results database under concurrent workers
+#
+# Starts <workers> processes that all store <results> synthetic results at the
+# same time, the way analysis workers that finish together do, and displays the
+# throughput and the latency of a single result:
+# - direct      Every worker opens the database and inserts its result
+#               (post_analysis/xx-database.py without a writer)
+# - writer      Every worker submits its result to a database writer
+#               (lib/dbwriter.py) and waits for the acknowledgement
+#
+# Every mode starts from an empty database. Results that could not be stored
+# (e.g. 'database is locked' after the timeout of 30s) are counted as errors.
+
+class Coverage:
+    def __init__(self, coverage, f_executed, f_found):
+        self.coverage   = coverage
+        self.f_executed = f_executed
+        self.f_found    = f_found
+
+class Result:
+    def __init__(self):
+        self.ANR        = random.random() < 0.1
+        self.died       = random.random() < 0.1
+        self.exception  = random.random() < 0.1
+        self.incomplete = random.random() < 0.1
+        self.vmcrash    = random.random() < 0.1
+        self.coverages  = {}
+        for keyword in SIMULATIONS + ['complete']:
+            for mode in (True, False):
+                total = random.randint(1, 5000)
+                hits  = random.randint(0, total)
+                self.coverages[ (keyword, mode) ] = Coverage((100.0 / total) * hits, hits, total)
+
+##
+# Rows of a synthetic result, about the size of those of a real app
+def get_rows(worker, i, fs):
+    md5sum = '%08x%024x' % (worker, i)
+
+    sa = static.StaticAnalysis()
+    sa.md5sum          = md5sum
+    sa.package_name    = 'com.bench.w%d.r%d' % (worker, i)
+    sa.main_activity   = sa.package_name + '.Main'
+    sa.activities      = [ '%s.Activity%d' % (sa.package_name, j) for j in xrange(random.randint(1, 20)) ]
+    sa.services        = [ '%s.Service%d'  % (sa.package_name, j) for j in xrange(random.randint(0, 5)) ]
+    sa.receivers       = [ '%s.Receiver%d' % (sa.package_name, j) for j in xrange(random.randint(0, 5)) ]
+    sa.actions         = [ 'android.intent.action.ACTION%d' % random.randint(0, 100) for j in xrange(random.randint(0, 10)) ]
+    sa.activityactions = { sa.main_activity: ['android.intent.action.MAIN'] }
+    sa.categories      = ['android.intent.category.LAUNCHER']
+
+    hits = [ ('void %s.C%d.m%d()' % (sa.package_name, j / 10, j), False, random.randint(1, 100)) for j in xrange(random.randint(50, 500)) ]
+    hits += [ ('void android.api.C%d.m%d()' % (j / 20, j), True, random.randint(1, 1000)) for j in random.sample(xrange(20000), 200) ]
+
+    logdir = '/bench/w%d/r%d' % (worker, i)
+    return db.get_rows(logdir + '.apk', logdir, sa, Result(), fs, hits = hits)
+
+def store_direct(database, rows):
+    d = db.Database(database)
+    try:
+        d.insert_many([ rows ])
+    finally:
+        d.close()
+
+def store_writer(database, rows):
+    dbwriter.submit(dbwriter.get_address(database), rows)
+
+##
+# A worker: waits for <start>, then stores its results one after the other
+def work(worker, results, mode, database, start, output):
+    random.seed(worker)
+    fs   = features.Features()
+    rows = [ get_rows(worker, i, fs) for i in xrange(results) ]
+
+    if mode == 'direct': store = store_direct
+    else:                store = store_writer
+
+    latencies = []
+    errors    = []
+    start.wait()
+    for i in xrange(results):
+        t = time.time()
+        try:
+            store(database, rows[i])
+            latencies.append(time.time() - t)
+        except Exception as e:
+            errors.append(str(e))
+    output.put( (latencies, errors) )
+
+def serve(database):
+    writer = dbwriter.Writer(database)
+    signal.signal(signal.SIGTERM, writer.stop)
+    writer.serve()
+
+def percentile(values, p):
+    if not values: return float('nan')
+    return values[ min(len(values) - 1, int(len(values) * p / 100.0)) ]
+
+##
+# Run <mode> on a new database in <tmpdir>
+# @return   Tuple of the elapsed time, the sorted latencies and the errors
+def run(mode, workers, results, tmpdir):
+    database = os.path.join(tmpdir, '%s.db' % mode)
+    db.Database(database).close()
+
+    writer = None
+    if mode == 'writer':
+        writer = multiprocessing.Process(target = serve, args = (database, ))
+        writer.start()
+        while not os.path.exists(dbwriter.get_address(database)): time.sleep(0.01)
+
+    start  = multiprocessing.Event()
+    output = multiprocessing.Queue()
+    processes = [ multiprocessing.Process(target = work, args = (worker, results, mode, database, start, output)) for worker in xrange(workers) ]
+    for p in processes:
+        p.start()
+
+    # Wait until the workers have generated their rows
+    time.sleep(1)
+    t = time.time()
+    start.set()
+
+    latencies = []
+    errors    = []
+    for p in processes:
+        l, e = output.get()
+        latencies += l
+        errors    += e
+    elapsed = time.time() - t
+
+    for p in processes:
+        p.join()
+
+    if writer:
+        os.kill(writer.pid, signal.SIGTERM)
+        writer.join()
+
+    return elapsed, sorted(latencies), errors
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the results database with many concurrent workers')
+    parser.add_argument('--workers', action = 'store', required = False, default = 32, type = int, help = 'Number of worker processes')
+    parser.add_argument('--results', action = 'store', required = False, default = 20, type = int, help = 'Number of results per worker')
+    parser.add_argument('--mode',    action = 'store', required = False, default = 'direct,writer', help = 'Comma separated list of modes (direct, writer)')
+
+    args  = parser.parse_args()
+    modes = [ mode for mode in args.mode.split(',') if mode ]
+
+    for mode in modes:
+        if mode not in ('direct', 'writer'):
+            print "Unknown mode %s" % mode
+            sys.exit()
+
+    tmpdir = tempfile.mkdtemp(prefix = 'bench_db_writer.')
+    try:
+        print '%d workers, %d results each' % (args.workers, args.results)
+        print
+        print 'mode    | stored | errors | elapsed | results/s |  p50 ms |  p95 ms |  p99 ms |  max ms'
+        print '--------+--------+--------+---------+-----------+---------+---------+---------+--------'
+        for mode in modes:
+            elapsed, latencies, errors = run(mode, args.workers, args.results, tmpdir)
+            print '%-7s | %6d | %6d | %6.2fs | %9.1f | %7.1f | %7.1f | %7.1f | %7.1f' % (mode, len(latencies), len(errors), elapsed, len(latencies) / elapsed,
+                                                                                       percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+                                                                                       percentile(latencies, 99) * 1000, latencies[-1] * 1000 if latencies else float('nan'))
+            for error in sorted(set(errors)):
+                print '        %dx %s' % (errors.count(error), error)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+
+import os
+import re
+import sys
+import mmap
+import array
+import argparse
+import multiprocessing
+
+from collections import defaultdict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import features
+
+#######################################################
+# Corpus feature matrix
+#
+# Loop over the log directories in <input> and collect their features.log
+# (written by post_analysis/02-features.py) into a single matrix of float32
+# values, one row per log directory, that can be memory-mapped by the ML
+# pipeline (see load()). Three files are written next to <output>:
+# - <output>.columns    The column names, one per line. The order is the one of
+#                       Features.get_fields(): boolean features are 0.0 or 1.0,
+#                       'average' is kept as is and 'bloom_array' is expanded
+#                       into 1024 dense columns (bloom_array[0], ...). The
+#                       package name and 'bloom' (the bits of bloom_array that
+#                       are not 0) are left out.
+# - <output>.matrix     The rows, without a header: row <i> starts at byte
+#                       i * len(columns) * 4.
+# - <output>.index      '<md5sum>\t<logdir>' for every row, in row order.
+#
+# Log directories that are already in the index are skipped, so rerunning the
+# script on a growing corpus only appends the rows of new runs. Rows are
+# written before their index lines: rows of an interrupted run that did not
+# make it into the index are dropped on the next run.
+
+BLOOM_SIZE = 1024
+
+FEATURES_FILENAME = 'features.log'
+STATIC_FILENAME   = 'static.log'
+
+andrubis_logdir = re.compile('^[a-fA-F\d]{32}$')
+
+##
+# @return   List of (feature name, number of columns) tuples, in column order
+def get_layout():
+    layout = []
+    for name, value in features.Features().get_fields():
+        if   name == 'bloom_array':             layout.append( (name, BLOOM_SIZE) )
+        elif name in ('package_name', 'bloom'): continue
+        else:                                   layout.append( (name, 1) )
+    return layout
+
+def get_columns(layout):
+    columns = []
+    for name, width in layout:
+        if width == 1: columns.append(name)
+        else:          columns += [ '%s[%d]' % (name, i) for i in xrange(width) ]
+    return columns
+
+##
+# md5sum of the analyzed apk: the md5sum line of static.log, or the name of an
+# Andrubis log directory
+def get_md5sum(logdir):
+    md5sum = None
+    try:
+        f = open(os.path.join(logdir, STATIC_FILENAME))
+        for line in f:
+            if line.startswith('md5sum'): md5sum = line.partition(':')[2].strip()
+            if md5sum or not line.strip(): break
+        f.close()
+    except IOError:
+        pass
+    if md5sum: return md5sum
+
+    basename = os.path.basename(os.path.normpath(logdir))
+    if andrubis_logdir.search(basename): return basename.lower()
+    return None
+
+##
+# Read the row of a log directory. Values are converted directly instead of
+# being evaluated (see features.parse()).
+# @return   Tuple of the md5sum, the log directory name and the row as an
+#           array of floats, or None if the directory has no usable output
+def read_row(args):
+    logdir, layout = args
+
+    md5sum = get_md5sum(logdir)
+    if not md5sum: return None
+
+    values = {}
+    try:
+        f = open(os.path.join(logdir, FEATURES_FILENAME))
+        for line in f:
+            key, _, val = line.partition(':')
+            values[key.strip()] = val.strip()
+        f.close()
+    except IOError:
+        return None
+
+    row = array.array('f')
+    for name, width in layout:
+        val = values.get(name, '')
+        if width == 1:
+            if   val == 'True':                 row.append(1.0)
+            elif val in ('', 'False', 'None'):  row.append(0.0)
+            else:                               row.append(float(val))
+        else:
+            cells = [ float(x) for x in val.strip('[]').split(',') if x.strip() and x.strip() != 'None' ]
+            if len(cells) != width: cells = [0.0] * width
+            row.extend(cells)
+
+    return md5sum, os.path.basename(os.path.normpath(logdir)), row
+
+def find_logdirs(indir):
+    for dirpath, dirnames, filenames in os.walk(indir):
+        if FEATURES_FILENAME in filenames: yield dirpath
+
+##
+# Index of an existing matrix
+# @return   List of (md5sum, logdir) tuples in row order
+def read_index(output):
+    index = []
+    if os.path.exists(output + '.index'):
+        f = open(output + '.index')
+        for line in f:
+            md5sum, _, logdir = line.rstrip('\n').partition('\t')
+            index.append( (md5sum, logdir) )
+        f.close()
+    return index
+
+def read_columns(output):
+    f = open(output + '.columns')
+    columns = [ line.rstrip('\n') for line in f ]
+    f.close()
+    return columns
+
+##
+# Add the log directories in <indir> that are not in the matrix yet
+# @return   Number of rows added
+def update(indir, output, processes = None):
+    layout  = get_layout()
+    columns = get_columns(layout)
+
+    if os.path.exists(output + '.columns') and read_columns(output) != columns:
+        print "Columns of %s differ from the current features, remove it to rebuild the matrix" % output
+        sys.exit()
+
+    index = read_index(output)
+    known = set( logdir for md5sum, logdir in index )
+
+    f = open(output + '.columns', 'w')
+    for column in columns:
+        print >>f, column
+    f.close()
+
+    # Drop rows that were written without being indexed
+    rowsize = len(columns) * 4
+    matrix_f = open(output + '.matrix', 'ab')
+    matrix_f.truncate(len(index) * rowsize)
+    matrix_f.close()
+
+    logdirs = [ (logdir, layout) for logdir in sorted(find_logdirs(indir)) if os.path.basename(os.path.normpath(logdir)) not in known ]
+
+    if processes is None: processes = multiprocessing.cpu_count()
+    if processes > 1 and len(logdirs) > 1:
+        pool = multiprocessing.Pool(processes)
+        rows = pool.imap(read_row, logdirs, chunksize = 64)
+    else:
+        pool = None
+        rows = (read_row(x) for x in logdirs)
+
+    added = 0
+    matrix_f = open(output + '.matrix', 'ab')
+    index_f  = open(output + '.index',  'a')
+    try:
+        pending = []
+        for result in rows:
+            if result is None: continue
+            md5sum, logdir, row = result
+            row.tofile(matrix_f)
+            pending.append( (md5sum, logdir) )
+
+            if len(pending) >= 1024:
+                _flush(matrix_f, index_f, pending)
+                added  += len(pending)
+                pending = []
+        _flush(matrix_f, index_f, pending)
+        added += len(pending)
+    finally:
+        matrix_f.close()
+        index_f.close()
+        if pool:
+            pool.close()
+            pool.join()
+
+    return added
+
+def _flush(matrix_f, index_f, pending):
+    matrix_f.flush()
+    for md5sum, logdir in pending:
+        print >>index_f, '%s\t%s' % (md5sum, logdir)
+    index_f.flush()
+
+##
+# Memory-map a matrix written by this script
+# @return   Tuple of the column names, a dictionary of md5sum -> list of row
+#           numbers, and the matrix: a read-only numpy.memmap of shape (rows,
+#           columns) if numpy is available, an mmap.mmap object of raw float32
+#           values otherwise
+def load(output):
+    columns = read_columns(output)
+    index   = read_index(output)
+
+    rows = defaultdict(list)
+    for i, (md5sum, logdir) in enumerate(index):
+        rows[md5sum].append(i)
+
+    shape = (len(index), len(columns))
+    if numpy is not None:
+        if not index: return columns, rows, numpy.zeros(shape, dtype = numpy.float32)
+        return columns, rows, numpy.memmap(output + '.matrix', dtype = numpy.float32, mode = 'r', shape = shape)
+
+    if not index: return columns, rows, None
+    f = open(output + '.matrix', 'rb')
+    matrix = mmap.mmap(f.fileno(), shape[0] * shape[1] * 4, access = mmap.ACCESS_READ)
+    f.close()
+    return columns, rows, matrix
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect the features of a batch of log directories into a memory-mapped matrix')
+    parser.add_argument('--input',     action = 'store', required = True,                          help = 'Directory containing the analysis output directories')
+    parser.add_argument('--output',    action = 'store', required = True,                          help = 'Output prefix (<output>.columns, <output>.matrix, <output>.index)')
+    parser.add_argument('--processes', action = 'store', required = False, default = None, type = int, help = 'Number of worker processes (default: one per CPU)')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print "Input %s does not exist" % args.input
+        sys.exit()
+
+    added = update(args.input, args.output, args.processes)
+    print '%d rows added, %d rows in total' % (added, len(read_index(args.output)))
+
+if __name__ == '__main__':
+    main()
@@ -3,11 +3,15 @@
 import os
 import re
 import sys
+import time
 import argparse
 
 from collections import defaultdict
 
 from dynamic import SIMULATIONS
+from results import load as load_manifest, get_coverages, get_flags
+
+import db
 
 keywords_local = SIMULATIONS
 keywords_local.append('complete')
@@ -38,6 +42,15 @@ keywords_andrubis = ['common-only',
 # and one for naive code coverage computation.
 #
 # This script expects that log directories have a md5sum filename.
+#
+# The results file of a log directory (see lib/results.py) is used instead of
+# the coverage logs if it has a coverage section.
+#
+# With --database, the averages and the CDF are read from the summary tables of
+# a results database that is filled by post_analysis/xx-database.py (see
+# lib/db.py) instead, which takes the same time for any corpus size. The rows
+# per log directory are not displayed in this mode. The breakdown averages are
+# over the apps with a coverage for any keyword.
 
 class Coverage:
     def __init__(self):
@@ -81,6 +94,20 @@ def parse(outdir, keywords):
         if andrubis_logdir.search(basename) or local_logdir.search(basename):
             result = Result(basename)
 
+            manifest = load_manifest(dirpath)
+            if 'coverage' in manifest:
+                for name, value in get_flags(manifest).iteritems():
+                    setattr(result, name, value)
+                for key, (percentage, hits, total) in get_coverages(manifest).iteritems():
+                    coverage = Coverage()
+                    coverage.coverage   = percentage
+                    coverage.f_executed = hits
+                    coverage.f_found    = total
+                    result.coverages[key] = coverage
+
+                results.append(result)
+                continue
+
             # Search for the coverage.<timestamp> files
             for filename in filenames:
                 if coverage_filename_parser.search(filename):
@@ -111,7 +138,13 @@ def parse(outdir, keywords):
                                 if 'complete' in keywords: keyword = 'complete'
                                 else:                      keyword = 'everything'
 
-                            result.coverages[ (keyword, naive) ] = coverage
+                            # Logs with several views name the view on every coverage line
+                            mode = naive
+                            if groups.group(5):
+                                mode = groups.group(5).strip()
+                                if mode in ('naive', 'conservative'): mode = (mode == 'naive')
+
+                            result.coverages[ (keyword, mode) ] = coverage
             
             results.append(result)
 
@@ -280,9 +313,78 @@ def display(results, naive, breakdown, keywords, cdf):
 
 
 
+##
+# Same as display(), from the summary tables of a results database, without the
+# rows per log directory
+def display_summary(database, naive, breakdown, keywords, cdf):
+    if naive: view = 'naive'
+    else:     view = 'conservative'
+
+    summary = database.get_coverage_summary(view)
+
+    if naive: sys.stdout.write('-----------------COVERAGES-NAIVE-')
+    else:     sys.stdout.write('-----------------COVERAGES-------')
+
+    if breakdown:
+        print '-'*137,
+        print
+        print 'apps                            |',
+        for keyword in keywords:
+            sys.stdout.write('%s|' % keyword.rjust(6))
+        print
+        print '--------------------------------+',
+        for keyword in keywords:
+            if len(keyword) > 6: sys.stdout.write('-'*len(keyword) + '+')
+            else:                sys.stdout.write('-'*6            + '+')
+        print
+
+        # Keywords without a coverage count as 0, like in display()
+        i = database.get_view_apps(view)
+        sys.stdout.write('%s|' % str(i).ljust(32))
+        for keyword in keywords:
+            if i > 0: c = '%6.2f' % (summary.get(keyword, {}).get('coverage', 0.0) / i)
+            else:     c = '%6.2f' % -1.0
+
+            if len(keyword) > 6: sys.stdout.write('%s|' % c.rjust(len(keyword)))
+            else:                sys.stdout.write('%s|' % c.rjust(6))
+        print
+        print
+        return
+
+    if 'complete' in keywords: keyword = 'complete'
+    else:                      keyword = 'everything'
+    totals = summary.get(keyword, {})
+    i      = totals.get('apps', 0)
+
+    def percentage(name):
+        if i > 0: return float(totals[name]) / i * 100.0
+        return -1.0
+
+    if i > 0: average = totals['coverage'] / i
+    else:     average = -1.0
+
+    print '-'*83
+    print 'filename                        | coverage | calls of total |     ANR |    died | exception | incomplete | vmcrash |'
+    print '--------------------------------+----------+----------------+---------+---------+-----------+------------+---------+'
+    print '%d apps' % i
+    print '--------------------------------+----------+----------------+---------+---------+-----------+------------+---------+'
+    print 'average (only for completed)    |%9.4f |                | %6.2f%% | %6.2f%% | %8.2f%% | %9.2f%% | %6.2f%% |' % (average, percentage('ANR'), percentage('died'), percentage('exception'), percentage('incomplete'), percentage('vmcrash'))
+    print
+
+    if cdf:
+        histogram = database.get_coverage_histogram(view, keyword)
+        s = sum( apps for coverage, apps in histogram )
+        p = 0.0
+
+        print '# %s %s' % ('Percentage'.rjust(10), 'Coverage'.rjust(20))
+        for coverage, apps in histogram:
+            p += apps / float(s)
+            print '  %10f %20f' % (p*100, coverage)
+
 def main():
     parser = argparse.ArgumentParser(description='Process a batch of log directories')
-    parser.add_argument('--input',    action = 'store',      required = True,                   help = 'Directory containing the analysis output directories')
+    parser.add_argument('--input',    action = 'store',      required = False, default = None,  help = 'Directory containing the analysis output directories')
+    parser.add_argument('--database', action = 'store',      required = False, default = None,  help = 'Read the summaries of this results database (post_analysis/xx-database.py) instead of the log directories')
     parser.add_argument('--naive',    action = 'store_true', required = False, default = False, help = 'Display naive code coverage instead of conservative')
     parser.add_argument('--breakdown',action = 'store_true', required = False, default = False, help = 'Display coverage per simulation technique')
     parser.add_argument('--andrubis', action = 'store_true', required = False, default = False, help = 'Process Andrubis output files')
@@ -298,6 +400,22 @@ def main():
     if andrubis: keywords = keywords_andrubis
     else:        keywords = keywords_local
 
+    if args.database:
+        if not os.path.exists(args.database):
+            print "Database %s does not exist" % args.database
+            sys.exit()
+
+        t = time.time()
+        database = db.Database(args.database)
+        display_summary(database, naive, breakdown, keywords, cdf)
+        database.close()
+        print '# %.3fs' % (time.time() - t)
+        return
+
+    if not outdir:
+        print "Either --input or --database is required"
+        sys.exit()
+
     results = parse(outdir, keywords)
     display(results, naive, breakdown, keywords, cdf)
 
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+import sdk
+import trace
+import static
+import results
+import features
+
+#######################################################
+# Refresh the features of a batch of log directories
+#
+# Loop over the log directories in <input> and evaluate the feature rules of
+# lib/features.py again against the call summary that post_analysis/02-features.py
+# wrote to every log directory (features-calls.json.gz), instead of parsing the
+# traces again. features.log and the features section of the results file are
+# replaced.
+#
+# Run this after adding or changing a feature rule. Log directories without a
+# call summary (older runs) are skipped and listed; run 02-features.py on them
+# once.
+
+# API classes and library index, loaded once per worker process
+_state = {}
+
+def _init():
+    _state['api_classes'] = trace.load_api([features.API])
+    _state['library']     = sdk.load_index()
+
+def get_package_name(logdir):
+    manifest = results.load(logdir)
+    if 'static' in manifest: return manifest['static'].get('package_name', '')
+    return static.parse( os.path.join(logdir, 'static.log') ).package_name
+
+##
+# Refresh the features of a single log directory
+# @return   Tuple of the log directory and whether or not it was refreshed
+def refresh(logdir):
+    summary = os.path.join(logdir, features.SUMMARY_FILENAME)
+    if not os.path.exists(summary): return logdir, False
+
+    fs = features.Features(output = os.path.join(logdir, 'features.log'))
+    fs.get_summary_features(summary, _state['api_classes'], get_package_name(logdir), library = _state['library'])
+    fs.dump()
+
+    results.update(logdir, 'features', fs.get_dict())
+    return logdir, True
+
+def find_logdirs(indir):
+    for dirpath, dirnames, filenames in os.walk(indir):
+        if 'features.log' in filenames or features.SUMMARY_FILENAME in filenames: yield dirpath
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the feature rules again against the call summaries of a batch of log directories')
+    parser.add_argument('--input',     action = 'store', required = True,                          help = 'Directory containing the analysis output directories')
+    parser.add_argument('--processes', action = 'store', required = False, default = None, type = int, help = 'Number of worker processes (default: one per CPU)')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print "Input %s does not exist" % args.input
+        sys.exit()
+
+    processes = args.processes or multiprocessing.cpu_count()
+    logdirs   = sorted(find_logdirs(args.input))
+
+    t = time.time()
+    if processes > 1 and len(logdirs) > 1:
+        pool = multiprocessing.Pool(processes, _init)
+        try:
+            done = pool.map(refresh, logdirs, chunksize = 16)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init()
+        done = [ refresh(logdir) for logdir in logdirs ]
+
+    skipped = [ logdir for logdir, refreshed in done if not refreshed ]
+    print '%d log directories refreshed in %.1fs' % (len(done) - len(skipped), time.time() - t)
+    if skipped:
+        print '%d log directories without a call summary:' % len(skipped)
+        for logdir in skipped:
+            print '  %s' % logdir
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+
+import os
+import re
+import sys
+import time
+import argparse
+
+import lsh
+import static
+import results
+import features
+
+#######################################################
+# Near-duplicate app detection
+#
+# Maintains a locality-sensitive hashing index (see lib/lsh.py) over the bloom
+# feature of the log directories in <input>, and lists the analyzed apps that
+# are most similar to a query app. Use it to find repackaged apps of the same
+# family, or to skip the deep analysis of an app that was analyzed before.
+#
+# The index is persisted in <index>. Log directories that are already in the
+# index are skipped, so rerunning the script with --input on a growing corpus
+# only adds the new runs.
+#
+# The similarity is the Jaccard index of the bloom bits of two apps (the share
+# of called function name hashes they have in common).
+
+FEATURES_FILENAME = 'features.log'
+STATIC_FILENAME   = 'static.log'
+
+andrubis_logdir = re.compile('^[a-fA-F\d]{32}$')
+
+##
+# Get the md5sum and the bloom of a log directory, from its results file or
+# else from its logs
+# @return   Tuple of the md5sum and the bloom, or None if the directory has no
+#           features
+def get_app(logdir):
+    manifest = results.load(logdir)
+
+    if 'features' in manifest: bloom = manifest['features'].get('bloom')
+    elif os.path.exists(os.path.join(logdir, FEATURES_FILENAME)):
+        bloom = features.parse( os.path.join(logdir, FEATURES_FILENAME) ).bloom.value
+    else: return None
+
+    if 'static' in manifest: md5sum = manifest['static'].get('md5sum')
+    else:                    md5sum = static.parse( os.path.join(logdir, STATIC_FILENAME) ).md5sum
+
+    basename = os.path.basename(os.path.normpath(logdir))
+    if not md5sum and andrubis_logdir.search(basename): md5sum = basename.lower()
+    if not md5sum: return None
+
+    return md5sum, bloom
+
+##
+# Add the log directories in <indir> that are not in <index> yet
+# @return   Number of apps added
+def update(index, indir):
+    added = 0
+    for dirpath, dirnames, filenames in sorted(os.walk(indir)):
+        if FEATURES_FILENAME not in filenames and results.FILENAME not in filenames: continue
+
+        logdir = os.path.basename(os.path.normpath(dirpath))
+        if logdir in index.logdirs: continue
+
+        app = get_app(dirpath)
+        if app and index.add(app[0], logdir, app[1]): added += 1
+    return added
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the analyzed apps that are most similar to a given app')
+    parser.add_argument('--index',     action = 'store',      required = True,                       help = 'Index file (created if it does not exist)')
+    parser.add_argument('--input',     action = 'store',      required = False, default = None,      help = 'Directory containing the analysis output directories to add to the index')
+    parser.add_argument('--query',     action = 'store',      required = False, default = None,      help = 'Log directory or md5sum of the app to search similar apps for')
+    parser.add_argument('--top',       action = 'store',      required = False, default = 10, type = int, help = 'Number of similar apps to list')
+    parser.add_argument('--exhaustive',action = 'store_true', required = False, default = False,     help = 'Compare to every app in the index instead of using the LSH buckets')
+
+    args = parser.parse_args()
+
+    if os.path.exists(args.index):
+        t = time.time()
+        index = lsh.LSHIndex.load(args.index)
+        print 'loaded %d apps in %.3fs' % (len(index), time.time() - t)
+    else:
+        index = lsh.LSHIndex()
+
+    if args.input:
+        if not os.path.exists(args.input):
+            print "Input %s does not exist" % args.input
+            sys.exit()
+
+        added = update(index, args.input)
+        if added or not os.path.exists(args.index): index.dump(args.index)
+        print '%d apps added, %d apps in total' % (added, len(index))
+
+    if not args.query: return
+
+    if os.path.isdir(args.query):
+        app = get_app(args.query)
+        if not app:
+            print "No features found in %s" % args.query
+            sys.exit()
+        md5sum, bloom = app
+    elif args.query in index.md5sums:
+        md5sum = args.query
+        bloom  = index.blooms[ index.md5sums[md5sum] ]
+    else:
+        print "App %s is not in the index" % args.query
+        sys.exit()
+
+    t = time.time()
+    similar = index.query(bloom, args.top, args.exhaustive, exclude = md5sum)
+    print 'query took %.2fms' % ((time.time() - t) * 1000)
+    print
+    print 'similarity | md5sum                           | logdir'
+    print '-----------+----------------------------------+-------'
+    for similarity, other, logdir in similar:
+        print '%10.4f | %-32s | %s' % (similarity, other, logdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+
+import os
+import sys
+import argparse
+
+from collections import defaultdict
+
+import bitset
+
+from dynamic import SIMULATIONS
+
+#######################################################
+# Marginal value of each simulation
+#
+# Loop over the log directories in <input> and read the method coverage
+# bitmaps written by post_analysis/01-coverage.py (coverage-bitmaps.gz). For
+# every simulation, this script displays across the whole corpus:
+# - apks        Number of APKs for which the simulation produced traces
+# - hits        Number of methods hit by the simulation
+# - unique      Number of methods hit by this simulation only. This is what
+#               would be lost if the simulation was removed.
+#
+# It then displays the union and intersection of all simulations, and a greedy
+# ordering of the simulations by marginal gain: every step adds the simulation
+# that hits the most methods not yet hit by the previous steps. Simulations at
+# the end of this list cost emulator time but add (almost) nothing.
+#
+# Traces are only stored per simulation (in a subdirectory of the log directory
+# named after the simulation) if the dynamic analysis runs with --breakdown.
+# Without it, there is only the complete coverage of every apk, and the log
+# directory is ignored.
+#
+# Use --store to collect the bitmaps of a corpus in a single file once, and
+# --input <store> to rerun the computation on it.
+
+BITMAPS_FILENAME = 'coverage-bitmaps.gz'
+
+##
+# Collect the bitmaps of all log directories in <indir>
+# @return   Dictionary of (logdir, view, keyword) -> (number of methods, bitset),
+#           with logdir relative to <indir>
+def collect(indir):
+    bitmaps = {}
+    for dirpath, dirnames, filenames in sorted(os.walk(indir)):
+        if BITMAPS_FILENAME not in filenames: continue
+
+        logdir = os.path.relpath(dirpath, indir)
+        for (view, keyword), value in bitset.read_bitmaps(os.path.join(dirpath, BITMAPS_FILENAME)).iteritems():
+            bitmaps[ (logdir, view, keyword) ] = value
+    return bitmaps
+
+##
+# @return   Tuple of a dictionary of logdir -> {simulation: bitset} and a
+#           dictionary of logdir -> number of methods
+def select(bitmaps, view, simulations):
+    apks    = defaultdict(dict)
+    methods = {}
+    for (logdir, v, keyword), (nbits, bits) in bitmaps.iteritems():
+        if v != view or keyword not in simulations: continue
+        apks[logdir][keyword] = bits
+        methods[logdir]       = nbits
+    return apks, methods
+
+##
+# @return   Number of log directories with coverage bitmaps of <view>, but none
+#           per simulation (not analyzed with --breakdown)
+def count_complete_only(bitmaps, view, simulations):
+    logdirs = set( logdir for (logdir, v, keyword) in bitmaps if v == view )
+    broken  = set( logdir for (logdir, v, keyword) in bitmaps if v == view and keyword in simulations )
+    return len(logdirs - broken)
+
+def display(apks, methods, simulations):
+    popcount = bitset.popcount
+    total    = sum(methods.itervalues())
+
+    if not apks or not total:
+        print 'no per-simulation coverage bitmaps found (run the dynamic analysis with --breakdown)'
+        return
+
+    def percentage(n): return (100.0 / total) * n
+
+    union        = {}
+    intersection = {}
+    for logdir, sims in apks.iteritems():
+        union[logdir]        = reduce(lambda x, y: x | y, sims.values(), 0L)
+        intersection[logdir] = reduce(lambda x, y: x & y, sims.values())
+
+    print '%d apks, %d methods' % (len(apks), total)
+    print
+    print 'simulation           |    apks |       hits |   hits % |     unique | unique % |'
+    print '---------------------+---------+------------+----------+------------+----------+'
+    for simulation in simulations:
+        n_apks = 0
+        hits   = 0
+        unique = 0
+        for logdir, sims in apks.iteritems():
+            bits = sims.get(simulation)
+            if bits is None: continue
+
+            others = 0L
+            for other, other_bits in sims.iteritems():
+                if other != simulation: others |= other_bits
+
+            n_apks += 1
+            hits   += popcount(bits)
+            unique += popcount(bits & ~others)
+
+        print '%-20s | %7d | %10d | %7.2f%% | %10d | %7.2f%% |' % (simulation, n_apks, hits, percentage(hits), unique, percentage(unique))
+
+    n_union        = sum( popcount(bits) for bits in union.itervalues() )
+    n_intersection = sum( popcount(bits) for bits in intersection.itervalues() )
+    print '---------------------+---------+------------+----------+------------+----------+'
+    print '%-20s | %7d | %10d | %7.2f%% |' % ('union',        len(apks), n_union,        percentage(n_union))
+    print '%-20s | %7d | %10d | %7.2f%% |' % ('intersection', len(apks), n_intersection, percentage(n_intersection))
+    print
+
+    # greedy ordering by marginal gain
+    print 'step | simulation           |       gain |   gain % | cumulative % |'
+    print '-----+----------------------+------------+----------+--------------+'
+    covered   = dict( (logdir, 0L) for logdir in apks )
+    remaining = [ simulation for simulation in simulations ]
+    step      = 0
+    n_covered = 0
+    while remaining:
+        gains = {}
+        for simulation in remaining:
+            gains[simulation] = sum( popcount(sims[simulation] & ~covered[logdir]) for logdir, sims in apks.iteritems() if simulation in sims )
+
+        best = max(remaining, key = lambda x: (gains[x], -remaining.index(x)))
+        for logdir, sims in apks.iteritems():
+            if best in sims: covered[logdir] |= sims[best]
+
+        step      += 1
+        n_covered += gains[best]
+        remaining.remove(best)
+        print '%4d | %-20s | %10d | %7.2f%% | %11.2f%% |' % (step, best, gains[best], percentage(gains[best]), percentage(n_covered))
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute the marginal coverage gain of each simulation over a batch of log directories (analyzed with --breakdown)')
+    parser.add_argument('--input',      action = 'store', required = True,                      help = 'Directory containing the analysis output directories, or a file written by --store')
+    parser.add_argument('--view',       action = 'store', required = False, default = 'naive',  help = 'Coverage view (naive, conservative, package)')
+    parser.add_argument('--store',      action = 'store', required = False, default = None,     help = 'Write the bitmaps of all log directories to this file')
+    parser.add_argument('--simulations',action = 'store', required = False, default = '',       help = 'Comma separated list of simulations to consider (default: all)')
+
+    args = parser.parse_args()
+    indir       = args.input
+    view        = args.view
+    store       = args.store
+    simulations = [ simulation for simulation in args.simulations.split(',') if simulation ] or SIMULATIONS
+
+    if not os.path.exists(indir):
+        print "Input %s does not exist" % indir
+        sys.exit()
+
+    if os.path.isdir(indir): bitmaps = collect(indir)
+    else:                    bitmaps = bitset.read_bitmaps(indir)
+
+    if store: bitset.write_bitmaps(store, bitmaps)
+
+    complete_only = count_complete_only(bitmaps, view, simulations)
+    if complete_only: print '%d log directories without per-simulation traces (not analyzed with --breakdown) are ignored' % complete_only
+
+    apks, methods = select(bitmaps, view, simulations)
+    display(apks, methods, simulations)
+
+
+if __name__ == '__main__':
+    main()